@@ -0,0 +1,167 @@
+'''
+arena.py contains the loop arena: one contiguous, page-aligned block of memory holding the
+audio of every track.
+
+np.zeros() memory is mapped lazily by the kernel, so the first recording pass used to
+page-fault its way through fresh memory inside the audio callback (add_buffer, dub).
+The arena is an anonymous mmap that can be pre-faulted once at startup (one write per page,
+off the audio path) and, where the kernel supports transparent hugepages, is aligned to and
+advised for 2MB pages so far fewer TLB entries cover it.
+
+The arena is divided into slots of [maxlength, chunk] int16 rows; the engine maps each
+track's main and dub layer onto a slot. Rows can be given back to the kernel (release(),
+used for compressed cold tracks by coldstore.py); they read as zeros until written again.
+
+For loops longer than RAM the arena can instead map a file (long loop mode): the kernel then
+keeps only part of it in memory, and diskstore.py pages in what the callback is about to
+touch and writes back what it has written.
+'''
+
+import ctypes
+import ctypes.util
+import mmap
+import time
+
+import numpy as np
+
+HUGEPAGE_SIZE = 2 * 1024 * 1024
+THP_PATH = '/sys/kernel/mm/transparent_hugepage/enabled'
+
+_libc = None
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno = True)
+    return _libc
+
+def prefault(arrays):
+    '''
+    prefault() writes to every page of the given arrays so they are backed by RAM, returns the bytes touched
+    '''
+    total = 0
+    for array in arrays:
+        flat = array.reshape(-1).view(np.uint8)
+        pages = flat[::mmap.PAGESIZE]
+        pages |= 0 #a write (not a read) is needed to replace the shared zero page
+        total += flat.nbytes
+    return total
+
+def resident_fraction(array):
+    '''
+    resident_fraction() returns the fraction of the array's pages that are in RAM (via mincore)
+    '''
+    page = mmap.PAGESIZE
+    address = array.ctypes.data
+    start = address - address % page
+    length = address + array.nbytes - start
+    pages = (length + page - 1) // page
+    vec = (ctypes.c_ubyte * pages)()
+    mincore = libc().mincore
+    mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    if mincore(start, length, vec) != 0:
+        return None
+    return float(np.count_nonzero(np.frombuffer(vec, dtype = np.uint8) & 1)) / pages
+
+def hugepage_mode():
+    '''
+    hugepage_mode() returns the kernel's transparent hugepage mode ('always', 'madvise', 'never') or None
+    '''
+    try:
+        with open(THP_PATH, 'r') as f:
+            text = f.read()
+    except OSError:
+        return None
+    start = text.find('[')
+    return text[start + 1:text.find(']', start)] if start >= 0 else None
+
+def anon_hugepages_kb():
+    '''
+    anon_hugepages_kb() returns how much of this process's anonymous memory is backed by hugepages
+    '''
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                if line.startswith('AnonHugePages:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+class Arena:
+    def __init__(self, slots, maxlength, chunk, hugepages = True, path = None):
+        self.slot_shape = (maxlength, chunk)
+        self.row_bytes = chunk * 2
+        self.nbytes = slots * maxlength * chunk * 2
+        self.hugepages = False #True once the arena is advised for hugepages
+        self.prefaulted = False
+        self.prefault_seconds = 0.0
+        self.path = path #backing file in long loop mode, None = anonymous memory
+
+        if path:
+            #a new sparse file of zeros every start (the autosave restores the session into it), shared so writes reach it
+            with open(path, 'w+b') as f:
+                f.truncate(self.nbytes)
+                self.map = mmap.mmap(f.fileno(), self.nbytes, flags = mmap.MAP_SHARED)
+            offset = 0
+            hugepages = False #not for file mappings
+        else:
+            #over-allocate by one hugepage so the arena can start on a 2MB boundary
+            align = HUGEPAGE_SIZE if hugepages else mmap.PAGESIZE
+            self.map = mmap.mmap(-1, self.nbytes + align, flags = mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+            address = np.frombuffer(self.map, dtype = np.uint8).ctypes.data
+            offset = -address % align
+        self.offset = offset #of the arena in self.map
+        if hugepages and hasattr(mmap, 'MADV_HUGEPAGE') and hugepage_mode() in ('always', 'madvise'):
+            try:
+                self.map.madvise(mmap.MADV_HUGEPAGE, offset, self.nbytes - self.nbytes % HUGEPAGE_SIZE)
+                self.hugepages = True
+            except (OSError, ValueError):
+                pass
+        self.buffer = np.frombuffer(self.map, dtype = np.int16, count = self.nbytes // 2, offset = offset)
+        #[slot, row, sample], and the same storage as a flat list of rows
+        self.slots = self.buffer.reshape(slots, maxlength, chunk)
+        self.rows = self.buffer.reshape(slots * maxlength, chunk)
+
+    def prefault(self):
+        '''
+        prefault() touches every page of the arena so recording never faults in the audio callback
+
+        call once at startup, before the stream is opened
+        '''
+        start = time.perf_counter()
+        prefault([self.buffer])
+        self.prefault_seconds = time.perf_counter() - start
+        self.prefaulted = True
+
+    def release(self, slot, start, count):
+        '''
+        release() gives the whole pages in rows start to start + count of slot back to the kernel, returns the bytes released
+
+        the rows read as zeros afterwards (in long loop mode they are read back from the file).
+        Raises OSError if the memory is locked (mlock)
+        '''
+        page = mmap.PAGESIZE
+        begin = self.offset + (slot * self.slot_shape[0] + start) * self.row_bytes
+        end = begin + count * self.row_bytes
+        begin += -begin % page
+        end -= end % page
+        if end <= begin:
+            return 0
+        self.map.madvise(mmap.MADV_DONTNEED, begin, end - begin)
+        return end - begin
+
+    def report(self):
+        '''
+        report() returns a one-line summary of the arena's memory state
+        '''
+        resident = resident_fraction(self.buffer)
+        resident = 'unknown' if resident is None else f'{100 * resident:.0f}% resident'
+        text = f'Loop arena: {self.nbytes // 2**20} MB, {resident}'
+        if self.path:
+            text += f', mapped from {self.path}'
+        if self.prefaulted:
+            text += f', prefaulted in {self.prefault_seconds:.2f}s'
+        if self.hugepages:
+            text += f', hugepages advised ({anon_hugepages_kb()} kB in hugepages)'
+        return text
@@ -0,0 +1,648 @@
+'''
+audioprocess.py runs the audio engine in a process of its own, away from the UI.
+
+In a single process the audio callback shares the interpreter lock with everything else:
+gpiozero callbacks, PIL rendering, I2C display writes and encoder polling can all hold it
+while the callback is due. With threads.engine_process enabled, main.py starts this file as a
+child process that owns the engine, the loop arena, the PortAudio stream, autosave and the
+time-stretch and import workers; the UI process keeps GPIO and the display and never holds a lock the
+callback needs.
+
+The two processes share one memfd block (passed over a Unix socketpair, so nothing is left
+behind in /dev/shm if either dies) holding:
+- the status: per-engine and per-track records published by EngineServer every poll interval
+  and after every command, under a sequence counter (odd while a write is in progress) so the
+  UI always reads a consistent copy without locking
+- the waveform mipmap pyramid, kept up to date here and drawn by the UI
+The loop audio itself stays private to this process.
+
+Commands go over the same socketpair as small (target, name, args) tuples and are answered
+once applied and published, so a status read right after a command already shows its effect.
+Only the commands in COMMANDS are accepted.
+
+RemoteEngine is the UI side: it starts the process and stands in for LooperEngine (and its
+loops, meters, stretcher, importer, capturer and checkpointer) in main.py.
+'''
+
+import json
+import mmap
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from multiprocessing.connection import Connection
+
+import numpy as np
+import pyaudio
+
+from capture import CaptureRing, Capturer
+from checkpoint import Checkpointer
+from coldstore import ColdStore
+from config import get_config
+from diskstore import DiskStore
+from effects import EFFECT_NAMES, EffectsChain
+from engine import LooperEngine, PLAYBACK_MODES
+from importer import Importer
+from limiter import Limiter
+from onset import OnsetDetector
+from meters import MeterSnapshot
+from midiclock import MidiClock
+from realtime import Realtime
+from stretch import Stretcher
+from waveform import WaveformMipmap, mipmap_nbytes
+
+PUBLISH_INTERVAL = 0.01 #seconds between status publishes when no command arrives
+
+EngineParts = namedtuple('EngineParts', ['engine', 'stretcher', 'importer', 'capturer', 'checkpointer', 'realtime', 'midi'])
+
+#published engine state
+STATUS_DTYPE = np.dtype([
+    ('length', np.int64), ('setup_is_recording', np.bool_), ('setup_donerecording', np.bool_),
+    ('restored', np.bool_), ('click_enabled', np.bool_), ('output_volume', np.float32),
+    ('stretch_track', np.int32), ('stretch_progress', np.float32), #stretch_track is -1 when idle
+    ('input_peak', np.float32), ('input_rms', np.float32), ('master_peak', np.float32),
+    ('master_rms', np.float32), ('gain_reduction', np.float32),
+    ('callback_count', np.uint64), ('callback_seconds', np.float32), ('callback_peak_seconds', np.float32),
+    ('callback_overruns', np.uint64), ('scene', np.int32), ('pending_scene', np.int32), #pending_scene is -1 when none
+    ('effect_seconds', np.float32, (len(EFFECT_NAMES),)), ('auto_record', np.bool_),
+])
+
+#published audioloop state, one record per track; mode is an index into PLAYBACK_MODES
+TRACK_DTYPE = np.dtype([
+    ('initialized', np.bool_), ('is_recording', np.bool_), ('is_waiting', np.bool_), ('is_playing', np.bool_),
+    ('sos', np.bool_), ('mode', np.uint8), ('readp', np.int64), ('length', np.int64), ('length_factor', np.int64),
+    ('content_length', np.int64), ('gain', np.float32), ('pan', np.float32), ('feedback', np.float32),
+    ('peak', np.float32), ('rms', np.float32), ('main_slot', np.int32), ('dub_slot', np.int32), ('effects', np.uint8),
+])
+
+#target -> accepted names; loop, stretcher, importer and capturer commands take the track index as their first argument
+COMMANDS = {
+    'engine': ('set_length', 'update_volume', 'start_first_recording', 'cancel_first_recording', 'finish_first_recording',
+               'select_scene'),
+    'setting': ('output_volume', 'click_enabled', 'auto_record'),
+    'loop': ('set_recording', 'toggle_mute', 'clear_or_undo', 'set_gain', 'set_pan', 'set_feedback', 'set_sos', 'set_mode', 'set_effect'),
+    'stretcher': ('fit', 'pitch'),
+    'importer': ('load',),
+    'capturer': ('capture', 'capture_first'),
+    'checkpointer': ('start', 'discard', 'save', 'load'),
+}
+
+def build_engine(config):
+    '''
+    build_engine() creates the engine and everything that works on its arena or timing (limiter, effects, onset detector, stretcher,
+    realtime setup, autosave with restore, cold track compression, MIDI clock, file import, input capture) from the configuration,
+    returns EngineParts
+    '''
+    audio = config['audio']
+    rate, chunk, channels = audio['rate'], audio['chunk'], audio['channels']
+    latency = round((audio['latency_ms'] / 1000) * (rate / chunk)) #latency in buffers
+    overshoot = round((audio['overshoot_ms'] / 1000) * (rate / chunk)) #allowance in buffers
+    maxlength = int(audio['max_samples'] / chunk) #buffer budget per track
+
+    #long loop mode: the arena is a memory-mapped file, kept streaming by a DiskStore
+    longloop = config['longloop']
+    arena_path = None
+    if longloop['enabled']:
+        arena_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), longloop['path'])
+
+    limiter = None
+    if config['limiter']['enabled']:
+        limiter = Limiter(rate, chunk, channels, ceiling = config['limiter']['ceiling'] * (2**15),
+                          lookahead_ms = config['limiter']['lookahead_ms'], release_ms = config['limiter']['release_ms'])
+        print(f'Master limiter enabled ({limiter.lookahead} samples look-ahead, added to the latency correction)')
+    #the last seconds of input, for retrospective looping
+    ring = None
+    if config['capture']['enabled']:
+        ring = CaptureRing(chunk, int(np.ceil(config['capture']['seconds'] * rate / chunk)) + 1)
+    effects = None
+    if config['effects']['enabled']:
+        fx = config['effects']
+        effects = EffectsChain(rate, chunk, audio['tracks'], budget = fx['budget'], eq_type = fx['eq_type'],
+                               eq_freq = fx['eq_freq'], eq_q = fx['eq_q'], eq_gain_db = fx['eq_gain_db'],
+                               delay_ms = fx['delay_ms'], delay_feedback = fx['delay_feedback'], delay_mix = fx['delay_mix'],
+                               reverb_decay = fx['reverb_decay'], reverb_mix = fx['reverb_mix'])
+        print(effects.report())
+    engine = LooperEngine(rate, chunk, audio['tracks'], maxlength, latency, overshoot,
+                          channels = channels, ramp_ms = config['mixer']['ramp_ms'], limiter = limiter,
+                          input_shift = audio['input_shift'],
+                          monitor_gain = config['monitor']['gain'] if config['monitor']['enabled'] else 0.0,
+                          hugepages = config['memory']['hugepages'], feedback = config['overdub']['feedback'],
+                          spare_slots = 2 if config['stretch']['enabled'] or config['import']['enabled'] or ring else 0,
+                          arena_path = arena_path, scenes = config['scenes']['count'], effects = effects,
+                          onset = OnsetDetector(rate, chunk, config['autorecord']['threshold_db'], config['autorecord']['preroll_ms']),
+                          capture = ring)
+    engine.auto_record = config['autorecord']['enabled']
+
+    #time-stretch/pitch-shift, file import and capture workers, results are swapped in by the callback at a loop boundary
+    stretcher = Stretcher(engine) if config['stretch']['enabled'] else None
+    importer = None
+    if config['import']['enabled']:
+        importer = Importer(engine, os.path.join(os.path.dirname(os.path.abspath(__file__)), config['import']['path']))
+    capturer = Capturer(engine, ring) if ring else None
+
+    #fault in the loop arena now, so recording doesn't page-fault in the audio callback
+    #(a mapped file is paged in ahead of the callback instead, prefaulting would read all of it)
+    if arena_path:
+        engine.diskstore = DiskStore(engine, longloop['readahead_ms'], longloop['flush_ms'])
+        if config['threads']['realtime']:
+            print('longloop: realtime mode locks the whole loop file in memory')
+    elif config['memory']['prefault']:
+        engine.arena.prefault()
+    #realtime mode: lock memory and reserve a core for the audio thread before anything runs
+    realtime = Realtime(config['threads']['realtime'], config['threads']['audio_priority'], config['threads']['audio_cpu'])
+    realtime.prepare(engine.arena)
+    print(engine.arena.report())
+
+    #autosave: checkpoint the session in the background and restore it after a crash
+    checkpointer = None
+    if config['autosave']['enabled']:
+        try:
+            autosave_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), config['autosave']['path'])
+            checkpointer = Checkpointer(engine, autosave_path, config['autosave']['interval'])
+            checkpointer.open_image()
+            checkpointer.restore()
+        except Exception as e:
+            print(f'Autosave not available: {e}')
+            checkpointer = None
+
+    #cold tracks compressed in the background, after the restore (released pages can't be locked in memory)
+    if config['memory']['compress_cold']:
+        if arena_path:
+            print('memory.compress_cold is off in long loop mode (the loops are paged from their file)')
+        elif config['threads']['realtime']:
+            print('memory.compress_cold is off in realtime mode (loop memory is locked)')
+        else:
+            ColdStore(engine, config['memory']['cold_loops'], config['memory']['cold_ahead_ms'])
+
+    #MIDI clock sync, clock events are timestamped in the audio callback
+    midi = None
+    if config['midi']['clock_out'] or config['midi']['clock_in']:
+        try:
+            midi = MidiClock(engine, config['midi']['beats_per_loop'])
+            if config['midi']['clock_out']:
+                midi.open_output(config['midi']['output_port'])
+            if config['midi']['clock_in']:
+                midi.open_input(config['midi']['input_port'])
+        except Exception as e:
+            print(f'MIDI clock not available: {e}')
+            midi = None
+    print(footprint(engine, ring, checkpointer))
+    return EngineParts(engine, stretcher, importer, capturer, checkpointer, realtime, midi)
+
+def footprint(engine, ring, checkpointer):
+    '''
+    footprint() returns a one-line summary of the memory the configuration reserves (and the autosave image on disk)
+    '''
+    layer = engine.maxlength * engine.chunk * 2
+    spare = len(engine.spare_slots)
+    text = (f'Footprint: {engine.slot_count - spare} track layers + {spare} spare (stretch/import/capture) '
+            f'of {layer / 2**20:.1f} MB = {engine.arena.nbytes / 2**20:.0f} MB loop memory, '
+            f'{"taken at startup" if engine.arena.prefaulted else "taken as it is recorded"}')
+    if ring:
+        text += f', capture ring {ring.data.nbytes / 2**20:.1f} MB taken at startup'
+    if checkpointer:
+        text += f', autosave image {engine.arena.nbytes / 2**20:.0f} MB on disk'
+    return text
+
+def open_stream(pa, config, callback):
+    '''
+    open_stream() opens and starts the duplex 16-bit stream (the only audio stream) calling callback
+    '''
+    audio = config['audio']
+    return pa.open(
+        format = pyaudio.paInt16,
+        channels = audio['channels'],
+        rate = audio['rate'],
+        input = True,
+        output = True,
+        input_device_index = audio['input_device'],
+        output_device_index = audio['output_device'],
+        frames_per_buffer = audio['chunk'],
+        start = True,
+        stream_callback = callback
+    )
+
+class SharedStatus:
+    def __init__(self, tracks, slot_count, maxlength, fd = None):
+        '''
+        creates the shared block (fd = None, in the audio process) or maps the one received from it
+        '''
+        status_offset = 8
+        tracks_offset = status_offset + STATUS_DTYPE.itemsize
+        waveform_offset = tracks_offset + tracks * TRACK_DTYPE.itemsize
+        waveform_offset += -waveform_offset % 8
+        size = waveform_offset + mipmap_nbytes(slot_count, maxlength)
+        if fd is None:
+            fd = os.memfd_create('raspi-looper-status')
+            os.ftruncate(fd, size)
+        self.fd = fd
+        self.map = mmap.mmap(fd, size)
+        self.sequence = np.frombuffer(self.map, dtype = np.uint64, count = 1)
+        self.status = np.frombuffer(self.map, dtype = STATUS_DTYPE, count = 1, offset = status_offset)
+        self.tracks = np.frombuffer(self.map, dtype = TRACK_DTYPE, count = tracks, offset = tracks_offset)
+        self.waveform = np.frombuffer(self.map, dtype = np.uint8, offset = waveform_offset)
+
+class EngineServer:
+    def __init__(self, parts, conn, shared, interval):
+        self.engine = parts.engine
+        self.waveform = WaveformMipmap(parts.engine, shared.waveform)
+        self.stretcher = parts.stretcher
+        self.importer = parts.importer
+        self.capturer = parts.capturer
+        self.checkpointer = parts.checkpointer
+        self.conn = conn
+        self.shared = shared
+        self.interval = interval
+
+    def serve(self):
+        '''
+        serve() applies commands as they arrive and publishes the status every interval,
+        returns when the UI asks to quit or goes away
+        '''
+        next_publish = time.monotonic()
+        while True:
+            if self.conn.poll(max(0.0, next_publish - time.monotonic())):
+                try:
+                    command = self.conn.recv()
+                except EOFError:
+                    return
+                if command is None:
+                    self.conn.send(None)
+                    return
+                reply = self.apply(*command)
+                self.publish()
+                self.conn.send(reply)
+                continue
+            self.waveform.update(max_rows = 512) #bounded, so a burst of dirty rows is spread over several polls
+            self.publish()
+            next_publish = time.monotonic() + self.interval
+
+    def apply(self, target, name, args):
+        '''
+        apply() runs one command, returns None or an error message for the UI
+        '''
+        engine = self.engine
+        try:
+            if name not in COMMANDS.get(target, ()):
+                raise ValueError('unknown command')
+            if target == 'engine':
+                getattr(engine, name)(*args)
+            elif target == 'setting':
+                setattr(engine, name, args[0])
+            elif target == 'loop':
+                getattr(engine.loops[args[0]], name)(*args[1:])
+            elif target == 'stretcher':
+                getattr(self.stretcher, name)(engine.loops[args[0]], *args[1:])
+            elif target == 'importer':
+                getattr(self.importer, name)(engine.loops[args[0]], *args[1:])
+            elif target == 'capturer':
+                getattr(self.capturer, name)(engine.loops[args[0]], *args[1:])
+            elif target == 'checkpointer':
+                getattr(self.checkpointer, name)(*args)
+        except Exception as e:
+            return f'{target}.{name}: {e}'
+        return None
+
+    def publish(self):
+        '''
+        publish() writes the engine and track status to the shared block
+        '''
+        engine = self.engine
+        shared = self.shared
+        snapshot = engine.meters.snapshot
+        busy = self.stretcher.busy if self.stretcher else None
+        shared.sequence[0] += 1 #odd: readers retry until the write is done
+        shared.status[0] = (engine.length, engine.setup_is_recording, engine.setup_donerecording,
+                            bool(self.checkpointer and self.checkpointer.restored), engine.click_enabled,
+                            engine.output_volume, busy[0] if busy else -1, self.stretcher.progress if self.stretcher else 0.0,
+                            snapshot.input_peak, snapshot.input_rms, snapshot.master_peak, snapshot.master_rms,
+                            snapshot.gain_reduction, engine.callback_count, engine.callback_seconds,
+                            engine.callback_peak_seconds, engine.callback_overruns, engine.scene,
+                            -1 if engine.pending_scene is None else engine.pending_scene, engine.effect_seconds,
+                            engine.auto_record)
+        for loop in engine.loops:
+            i = loop.index
+            shared.tracks[i] = (loop.initialized, loop.is_recording, loop.is_waiting, loop.is_playing,
+                                loop.sos, PLAYBACK_MODES.index(loop.mode), loop.readp, loop.length, loop.length_factor,
+                                loop.content_length, loop.gain, loop.pan, loop.feedback,
+                                snapshot.track_peak[i], snapshot.track_rms[i], engine.slot_of[0, i], engine.slot_of[1, i],
+                                loop.effects)
+        shared.sequence[0] += 1
+
+class RemoteLoop:
+    '''
+    stands in for an audioloop: state is read from the shared status, methods are sent as commands
+    '''
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+
+    def __getattr__(self, name):
+        if name not in TRACK_DTYPE.names:
+            raise AttributeError(name)
+        value = self.engine.read_status()[2][self.index][name]
+        if name == 'mode':
+            return PLAYBACK_MODES[value]
+        return value.item()
+
+    def set_recording(self):
+        self.engine.call('loop', 'set_recording', self.index)
+
+    def toggle_mute(self):
+        self.engine.call('loop', 'toggle_mute', self.index)
+
+    def clear_or_undo(self):
+        self.engine.call('loop', 'clear_or_undo', self.index)
+
+    def set_gain(self, gain):
+        self.engine.call('loop', 'set_gain', self.index, float(gain))
+
+    def set_pan(self, pan):
+        self.engine.call('loop', 'set_pan', self.index, float(pan))
+
+    def set_feedback(self, feedback):
+        self.engine.call('loop', 'set_feedback', self.index, float(feedback))
+
+    def set_sos(self, enabled):
+        self.engine.call('loop', 'set_sos', self.index, bool(enabled))
+
+    def set_mode(self, mode):
+        self.engine.call('loop', 'set_mode', self.index, mode)
+
+    def set_effect(self, name, enabled):
+        self.engine.call('loop', 'set_effect', self.index, str(name), bool(enabled))
+
+class RemoteMeters:
+    def __init__(self, engine):
+        self.engine = engine
+
+    @property
+    def snapshot(self):
+        _, status, tracks = self.engine.read_status()
+        return MeterSnapshot(float(status['input_peak']), float(status['input_rms']), tracks['peak'], tracks['rms'],
+                             float(status['master_peak']), float(status['master_rms']), float(status['gain_reduction']))
+
+class RemoteStretcher:
+    def __init__(self, engine):
+        self.engine = engine
+
+    @property
+    def busy(self):
+        track = int(self.engine.read_status()[1]['stretch_track'])
+        return (track, '') if track >= 0 else None
+
+    @property
+    def progress(self):
+        return float(self.engine.read_status()[1]['stretch_progress'])
+
+    def fit(self, loop):
+        self.engine.call('stretcher', 'fit', loop.index)
+
+    def pitch(self, loop, semitones):
+        self.engine.call('stretcher', 'pitch', loop.index, int(semitones))
+
+class RemoteImporter:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def load(self, loop, name, master = False):
+        self.engine.call('importer', 'load', loop.index, str(name), bool(master))
+
+class RemoteCapturer:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def capture(self, loop, seconds = None, loops = None, ago = 0.0):
+        self.engine.call('capturer', 'capture', loop.index, seconds, loops, float(ago))
+
+    def capture_first(self, loop, seconds, ago = 0.0):
+        self.engine.call('capturer', 'capture_first', loop.index, float(seconds), float(ago))
+
+class RemoteCheckpointer:
+    def __init__(self, engine):
+        self.engine = engine
+
+    @property
+    def restored(self):
+        return bool(self.engine.read_status()[1]['restored'])
+
+    def start(self):
+        self.engine.call('checkpointer', 'start')
+
+    def discard(self):
+        self.engine.call('checkpointer', 'discard')
+
+    def save(self, name):
+        self.engine.call('checkpointer', 'save', str(name))
+
+    def load(self, name):
+        self.engine.call('checkpointer', 'load', str(name))
+
+class RemoteEngine:
+    '''
+    starts the audio process and stands in for its LooperEngine in the UI process
+    '''
+    def __init__(self):
+        ui_socket, audio_socket = socket.socketpair()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(audio_socket.fileno())],
+                                        pass_fds = [audio_socket.fileno()])
+        audio_socket.close()
+        #the audio process answers with its layout and the shared block once the stream is running
+        message, fds, _, _ = socket.recv_fds(ui_socket, 65536, 1)
+        if not message or not fds:
+            self.process.wait()
+            raise RuntimeError(f'audio process failed to start (exit code {self.process.returncode})')
+        layout = json.loads(message)
+        self.tracks = layout['tracks']
+        self.chunk = layout['chunk']
+        self.deadline = layout['deadline']
+        self.maxlength = layout['maxlength']
+        self.slot_count = layout['slot_count']
+        self.shared = SharedStatus(self.tracks, self.slot_count, self.maxlength, fds[0])
+        self.conn = Connection(ui_socket.detach())
+        self.lock = threading.Lock() #button callbacks, the encoder poll and the main loop all send commands
+        self.cached = (None, None, None) #(sequence, status, tracks) of the last consistent read
+
+        self.loops = tuple(RemoteLoop(self, i) for i in range(self.tracks))
+        self.meters = RemoteMeters(self)
+        self.waveform = WaveformMipmap(self, self.shared.waveform) #drawn here, updated by the audio process
+        self.stretcher = RemoteStretcher(self) if layout['stretcher'] else None
+        self.importer = RemoteImporter(self) if layout['importer'] else None
+        self.capturer = RemoteCapturer(self) if layout['capturer'] else None
+        self.checkpointer = RemoteCheckpointer(self) if layout['checkpointer'] else None
+
+    def read_status(self):
+        '''
+        read_status() returns a consistent (sequence, status, tracks) copy of the shared status,
+        copied again only after the audio process published a change
+        '''
+        shared = self.shared
+        while True:
+            sequence = int(shared.sequence[0])
+            cached = self.cached
+            if sequence == cached[0]:
+                return cached
+            if sequence % 2 == 0:
+                status = shared.status[0].copy()
+                tracks = shared.tracks.copy()
+                if int(shared.sequence[0]) == sequence:
+                    self.cached = (sequence, status, tracks)
+                    return self.cached
+            time.sleep(0)
+
+    def call(self, target, name, *args):
+        '''
+        call() sends a command to the audio process and waits until it has been applied
+        '''
+        with self.lock:
+            self.conn.send((target, name, args))
+            error = self.conn.recv()
+        if error:
+            raise RuntimeError(error)
+
+    def close(self):
+        '''
+        close() stops the audio process (stream, autosave and all)
+        '''
+        with self.lock:
+            try:
+                self.conn.send(None)
+                self.conn.recv()
+            except (EOFError, OSError):
+                pass
+        try:
+            self.process.wait(timeout = 5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    @property
+    def length(self):
+        return int(self.read_status()[1]['length'])
+
+    @property
+    def setup_is_recording(self):
+        return bool(self.read_status()[1]['setup_is_recording'])
+
+    @property
+    def setup_donerecording(self):
+        return bool(self.read_status()[1]['setup_donerecording'])
+
+    @property
+    def output_volume(self):
+        return float(self.read_status()[1]['output_volume'])
+
+    @output_volume.setter
+    def output_volume(self, volume):
+        self.call('setting', 'output_volume', float(volume))
+
+    @property
+    def click_enabled(self):
+        return bool(self.read_status()[1]['click_enabled'])
+
+    @click_enabled.setter
+    def click_enabled(self, enabled):
+        self.call('setting', 'click_enabled', bool(enabled))
+
+    @property
+    def auto_record(self):
+        return bool(self.read_status()[1]['auto_record'])
+
+    @auto_record.setter
+    def auto_record(self, enabled):
+        self.call('setting', 'auto_record', bool(enabled))
+
+    @property
+    def callback_count(self):
+        return int(self.read_status()[1]['callback_count'])
+
+    @property
+    def callback_seconds(self):
+        return float(self.read_status()[1]['callback_seconds'])
+
+    @property
+    def callback_peak_seconds(self):
+        return float(self.read_status()[1]['callback_peak_seconds'])
+
+    @property
+    def callback_overruns(self):
+        return int(self.read_status()[1]['callback_overruns'])
+
+    @property
+    def scene(self):
+        return int(self.read_status()[1]['scene'])
+
+    @property
+    def pending_scene(self):
+        scene = int(self.read_status()[1]['pending_scene'])
+        return None if scene < 0 else scene
+
+    @property
+    def effect_seconds(self):
+        return self.read_status()[1]['effect_seconds'].tolist()
+
+    @property
+    def slot_of(self):
+        tracks = self.read_status()[2]
+        return np.stack([tracks['main_slot'], tracks['dub_slot']])
+
+    def set_length(self, length):
+        self.call('engine', 'set_length', int(length))
+
+    def update_volume(self):
+        self.call('engine', 'update_volume')
+
+    def start_first_recording(self):
+        self.call('engine', 'start_first_recording')
+
+    def cancel_first_recording(self):
+        self.call('engine', 'cancel_first_recording')
+
+    def finish_first_recording(self):
+        self.call('engine', 'finish_first_recording')
+
+    def select_scene(self, scene):
+        self.call('engine', 'select_scene', int(scene))
+
+def run(fd):
+    '''
+    run() is the audio process: builds the engine, starts the stream, then serves the UI until it quits
+    '''
+    ui_socket = socket.socket(fileno = fd)
+    config = get_config()
+    parts = build_engine(config)
+    engine, realtime, midi = parts.engine, parts.realtime, parts.midi
+
+    audio_thread_configured = False
+    def callback(in_data, frame_count, time_info, status):
+        nonlocal audio_thread_configured
+        if not audio_thread_configured:
+            audio_thread_configured = True
+            realtime.configure_audio_thread()
+        out = engine.process(in_data)
+        if midi:
+            midi.process(time_info)
+        return (out, pyaudio.paContinue)
+
+    pa = pyaudio.PyAudio()
+    try:
+        open_stream(pa, config, callback)
+        shared = SharedStatus(engine.tracks, engine.slot_count, engine.maxlength)
+        server = EngineServer(parts, None, shared, PUBLISH_INTERVAL)
+        server.publish()
+        layout = {'tracks': engine.tracks, 'chunk': engine.chunk, 'deadline': engine.deadline, 'maxlength': engine.maxlength,
+                  'slot_count': engine.slot_count, 'stretcher': parts.stretcher is not None,
+                  'importer': parts.importer is not None, 'capturer': parts.capturer is not None,
+                  'checkpointer': parts.checkpointer is not None}
+        socket.send_fds(ui_socket, [json.dumps(layout).encode()], [shared.fd])
+        server.conn = Connection(ui_socket.detach())
+        #give the stream time to start before reporting on the audio thread
+        threading.Timer(3, lambda: print('\n'.join(realtime.report()))).start()
+        server.serve()
+    finally:
+        pa.terminate() #needed to free audio device for reuse
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]))
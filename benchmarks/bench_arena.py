@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark callback jitter during the first recording pass, with and without a prefaulted arena.
+
+Each run builds a fresh engine, then drives engine.process() exactly like the audio callback:
+first recording the master loop (add_buffer into never-touched memory), then overdubbing it on
+every track at once (dub into untouched dub rows). Per-callback times and minor page faults are
+reported for a lazily mapped arena and a prefaulted one, each with and without hugepages.
+
+    python3 benchmarks/bench_arena.py [chunk] [rows]
+"""
+
+import contextlib
+import io
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from arena import hugepage_mode
+from engine import LooperEngine
+
+RATE = 44100
+CHUNK = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+ROWS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000 #loop length in buffers (2000 x 512 = 23s)
+TRACKS = 4
+
+def run(prefault, hugepages):
+    engine = LooperEngine(RATE, CHUNK, TRACKS, ROWS + 10, 0, 10, hugepages = hugepages)
+    engine.meters = None #measure storage, not metering
+    if prefault:
+        engine.arena.prefault()
+    rng = np.random.default_rng(0)
+    in_data = rng.integers(-8000, 8000, size = CHUNK, dtype = np.int16).tobytes()
+    times = np.zeros([2 * ROWS])
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+
+    #first pass: record the master loop
+    engine.setup_is_recording = True
+    for i in range(ROWS):
+        start = time.perf_counter()
+        engine.process(in_data)
+        times[i] = time.perf_counter() - start
+    engine.setup_is_recording = False
+    engine.setup_donerecording = True
+    engine.loops[0].initialize()
+    #second pass: overdub on every track
+    for loop in engine.loops:
+        loop.start_recording(engine.prev_rec_buffer)
+        loop.initialized = True
+        loop.length = engine.length
+        loop.rows_used = engine.length
+    for i in range(ROWS, 2 * ROWS):
+        start = time.perf_counter()
+        engine.process(in_data)
+        times[i] = time.perf_counter() - start
+
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults
+    return times, faults
+
+print(f'CHUNK {CHUNK}, {ROWS} rows per pass, {TRACKS} tracks: callback deadline {1e6 * CHUNK / RATE:.0f} us')
+print(f'transparent hugepages: {hugepage_mode()}')
+print(f'{"arena":<22} {"median":>9} {"p99":>9} {"max":>9} {"faults":>8}')
+for prefault in (False, True):
+    for hugepages in (False, True):
+        with contextlib.redirect_stdout(io.StringIO()): #the engine logs every loop restart
+            times, faults = run(prefault, hugepages)
+        label = ('prefaulted' if prefault else 'lazy') + (' + hugepages' if hugepages else '')
+        print(f'{label:<22} {1e6 * np.median(times):>6.1f} us {1e6 * np.percentile(times, 99):>6.1f} us '
+              f'{1e6 * times.max():>6.1f} us {faults:>8}')
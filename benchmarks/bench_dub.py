@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark overdubbing for 1 to 4 simultaneously recording tracks.
+
+Compares the old per-track dub() (float64 temporaries per track), the batched kernel
+engine.dub_many() (one gather, float32 math in preallocated scratch, one scatter for all
+dubbing tracks) and engine.dub(), which takes the direct engine.dub_one() path for a single
+overdub and the batched kernel for more.
+
+    python3 benchmarks/bench_dub.py [chunk]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from engine import DIRTY_ALL, LooperEngine
+
+RATE = 44100
+CHUNK = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+ROWS = 200
+TRACKS = 4
+ITERATIONS = 5000
+
+def make_engine():
+    engine = LooperEngine(RATE, CHUNK, TRACKS, ROWS + 1, 0, 0)
+    rng = np.random.default_rng(0)
+    engine.arena.slots[:, :ROWS] = rng.integers(-4000, 4000, size = engine.arena.slots[:, :ROWS].shape, dtype = np.int16)
+    for loop in engine.loops:
+        loop.length = ROWS
+        loop.rows_used = ROWS
+        loop.initialized = True
+        loop.dub_ratio = 0.81
+    return engine
+
+def legacy_dub(loop, data):
+    datadump = np.copy(data)
+    loop.main_audio[loop.writep, :] = loop.main_audio[loop.writep, :] * 0.9 + loop.dub_audio[loop.writep, :] * loop.dub_ratio
+    loop.dub_audio[loop.writep, :] = datadump[:]
+    loop.main_dirty[loop.writep] = DIRTY_ALL
+    loop.dub_dirty[loop.writep] = DIRTY_ALL
+
+def time_per_call(function, engine, dubbing, data):
+    for _ in range(100):
+        function(engine, dubbing, data)
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        for loop in dubbing:
+            loop.writep = i % ROWS
+        function(engine, dubbing, data)
+    return (time.perf_counter() - start) / ITERATIONS
+
+def per_track(engine, dubbing, data):
+    for loop in dubbing:
+        legacy_dub(loop, data)
+
+def batched(engine, dubbing, data):
+    engine.dub_many(dubbing, data)
+
+def dub(engine, dubbing, data):
+    engine.dub(dubbing, data)
+
+engine = make_engine()
+data = np.random.default_rng(1).integers(-4000, 4000, size = CHUNK, dtype = np.int16)
+print(f'CHUNK {CHUNK}, RATE {RATE}: callback deadline {1e6 * CHUNK / RATE:.0f} us')
+print(f'{"overdubs":>8} {"per-track":>12} {"batched":>12} {"dub()":>12}')
+for count in range(1, TRACKS + 1):
+    dubbing = engine.loops[:count]
+    legacy = time_per_call(per_track, engine, dubbing, data)
+    fused = time_per_call(batched, engine, dubbing, data)
+    used = time_per_call(dub, engine, dubbing, data)
+    print(f'{count:>8} {1e6 * legacy:>9.1f} us {1e6 * fused:>9.1f} us {1e6 * used:>9.1f} us')
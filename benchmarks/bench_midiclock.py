@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Check MIDI clock output timing through an ALSA virtual MIDI port (needs mido and python-rtmidi).
+
+Records a master loop of the length that gives the requested tempo, then drives
+engine.process() and MidiClock.process() in real time like the audio callback (with an ideal
+stream clock as PortAudio's DAC time). The clock goes out on the looper's virtual port and is
+read back on a second virtual port connected to it. Reports the tempo and the jitter of the
+received ticks against the ideal tick interval.
+
+    python3 benchmarks/bench_midiclock.py [bpm] [seconds]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from engine import LooperEngine
+from midiclock import PPQN, MidiClock
+
+RATE = 44100
+CHUNK = 512
+BEATS = 4
+BPM = float(sys.argv[1]) if len(sys.argv) > 1 else 120.0
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+
+try:
+    import mido
+except ImportError:
+    sys.exit('mido (with python-rtmidi) is needed for this check: pip install mido python-rtmidi')
+
+rows = round(BEATS * 60 / BPM * RATE / CHUNK)
+engine = LooperEngine(RATE, CHUNK, 1, rows + 10, 0, 10)
+silence = np.zeros([CHUNK], dtype = np.int16).tobytes()
+with contextlib.redirect_stdout(io.StringIO()):
+    engine.start_first_recording()
+    for _ in range(rows):
+        engine.process(silence)
+    engine.finish_first_recording()
+
+received = []
+monitor = mido.open_input('raspi-looper-check', virtual = True,
+                          callback = lambda message: received.append((time.monotonic(), message.type)))
+clock = MidiClock(engine, BEATS)
+clock.open_output(next(name for name in mido.get_output_names() if 'raspi-looper-check' in name))
+
+start = time.monotonic()
+buffers = int(SECONDS * RATE / CHUNK)
+for i in range(buffers):
+    engine.process(silence)
+    now = time.monotonic()
+    clock.process({'current_time': now, 'output_buffer_dac_time': start + (i + 1) * CHUNK / RATE})
+    time.sleep(max(0.0, start + (i + 1) * CHUNK / RATE - time.monotonic()))
+engine.loops[0].clear()
+engine.process(silence)
+clock.process({})
+time.sleep(0.5)
+
+ticks = np.array([t for t, kind in received if kind == 'clock'])
+ideal = engine.length * CHUNK / RATE / (PPQN * BEATS)
+error = np.abs(np.diff(ticks) - ideal)
+print(f'loop {engine.length} buffers = {60 * BEATS / (engine.length * CHUNK / RATE):.2f} bpm, {len(ticks)} ticks received')
+print(f'messages: {[kind for _, kind in received if kind != "clock"]}, sent late: {clock.late}')
+print(f'tick interval: ideal {1e3 * ideal:.3f} ms, mean {1e3 * np.mean(np.diff(ticks)):.3f} ms')
+print(f'jitter: median {1e6 * np.median(error):.0f} us, p99 {1e6 * np.percentile(error, 99):.0f} us, max {1e6 * error.max():.0f} us')
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Benchmark the N-track mixer.
+
+Compares engine.mix() (one gather + one dot product for all tracks) with the old
+per-track approach (read() each track and sum them) for 4, 8 and 16 tracks.
+Run it on the Pi itself to get numbers for a Pi-class CPU:
+
+    python3 benchmarks/bench_mixer.py [chunk]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from engine import LooperEngine
+
+RATE = 44100
+CHUNK = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+ROWS = 200 #loop length in buffers, kept small so 16 tracks fit in memory
+ITERATIONS = 2000
+
+def make_engine(tracks):
+    engine = LooperEngine(RATE, CHUNK, tracks, ROWS + 1, 0, 0)
+    rng = np.random.default_rng(0)
+    engine.arena.slots[:, :ROWS] = rng.integers(-4000, 4000, size = engine.arena.slots[:, :ROWS].shape, dtype = np.int16)
+    engine.length = ROWS
+    for i, loop in enumerate(engine.loops):
+        loop.length = ROWS
+        loop.rows_used = ROWS
+        loop.initialized = True
+        loop.is_playing = (i % 4 != 3) #mute every fourth track
+    return engine
+
+def legacy_mix(engine):
+    mixed = np.zeros([CHUNK], dtype = np.int32)
+    for loop in engine.loops:
+        mixed += loop.read().astype(np.int32)
+    return mixed
+
+def time_per_call(function, engine):
+    for _ in range(100):
+        function(engine)
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        function(engine)
+    return (time.perf_counter() - start) / ITERATIONS
+
+print(f'CHUNK {CHUNK}, RATE {RATE}: callback deadline {1e6 * CHUNK / RATE:.0f} us')
+print(f'{"tracks":>6} {"per-track sum":>15} {"vectorized":>12} {"per track":>10}')
+for tracks in (4, 8, 16):
+    engine = make_engine(tracks)
+    legacy = time_per_call(legacy_mix, engine)
+    vectorized = time_per_call(LooperEngine.mix, engine)
+    print(f'{tracks:>6} {1e6 * legacy:>12.1f} us {1e6 * vectorized:>9.1f} us {1e6 * vectorized / tracks:>7.2f} us')
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the audio hot paths, saved as JSON to catch regressions between releases.
+
+Sweeps CHUNK, RATE, track count and overdub count and times, headless:
+- process: the whole audio callback (engine.process(), what looping_callback runs) with
+  that many tracks overdubbing
+- read, dub, add_buffer, initialize: the audioloop methods, one track
+- fx_eq, fx_dly, fx_rev: each insert effect (effects.py) on every track, one callback's worth
+- update_volume: the global peak scan run on button release (without the limiter)
+- waveform: folding one callback's worth of written rows into the waveform mipmap
+- display: one OLED frame as update_display_status() draws it (screen.py: text, waveform,
+  meters); the drawing needs PIL, without it the frame is drawn into a target that does nothing
+
+Every case reports median, p99 and max microseconds; callback-path cases also report the
+median as a fraction of the buffer duration (load).
+
+    python3 benchmarks/bench_suite.py [--quick] [--output results.json] [--baseline old.json]
+
+With --baseline, cases whose median got slower by more than --tolerance (default 20%) are
+listed and the exit status is 1.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from effects import EffectsChain
+from engine import DIRTY_ALL, LooperEngine
+from screen import Screen
+from waveform import WaveformMipmap
+
+ROWS = 200 #loop length in buffers
+
+def make_engine(rate, chunk, tracks):
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = LooperEngine(rate, chunk, tracks, ROWS + 10, 0, 10)
+    rng = np.random.default_rng(0)
+    engine.arena.slots[:, :ROWS] = rng.integers(-4000, 4000, size = engine.arena.slots[:, :ROWS].shape, dtype = np.int16)
+    engine.length = ROWS
+    engine.setup_donerecording = True
+    for loop in engine.loops:
+        loop.length = ROWS
+        loop.rows_used = ROWS
+        loop.content_length = ROWS
+        loop.initialized = True
+        loop.is_playing = True
+    return engine
+
+def timed(function, iterations, setup = None):
+    '''
+    timed() returns the run times of function() in seconds, setup() (untimed) runs before each call
+    '''
+    times = np.zeros([iterations])
+    with contextlib.redirect_stdout(io.StringIO()): #the engine logs loop restarts and initialization
+        for _ in range(min(20, iterations)):
+            if setup:
+                setup()
+            function()
+        for i in range(iterations):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            function()
+            times[i] = time.perf_counter() - start
+    return times
+
+def summary(times, deadline = None):
+    result = {
+        'median_us': round(1e6 * float(np.median(times)), 2),
+        'p99_us': round(1e6 * float(np.percentile(times, 99)), 2),
+        'max_us': round(1e6 * float(times.max()), 2),
+    }
+    if deadline:
+        result['load'] = round(float(np.median(times)) / deadline, 4)
+    return result
+
+def bench_process(rate, chunk, tracks, overdubs, iterations):
+    engine = make_engine(rate, chunk, tracks)
+    for loop in engine.loops[:overdubs]:
+        loop.is_recording = True
+    in_data = np.random.default_rng(1).integers(-8000, 8000, size = chunk, dtype = np.int16).tobytes()
+    return timed(lambda: engine.process(in_data), iterations)
+
+def bench_loop_methods(rate, chunk, iterations):
+    engine = make_engine(rate, chunk, 1)
+    loop = engine.loops[0]
+    data = np.random.default_rng(1).integers(-8000, 8000, size = chunk, dtype = np.int16)
+    results = {
+        'read': timed(loop.read, iterations),
+        'dub': timed(lambda: loop.dub(data), iterations),
+    }
+
+    def fresh_recording():
+        loop.initialized = False
+        loop.length = 0
+    def add_buffers():
+        for _ in range(10):
+            loop.add_buffer(data)
+    #per buffer: ten buffers per call so the reset doesn't dominate
+    results['add_buffer'] = timed(add_buffers, iterations // 10 + 1, setup = fresh_recording) / 10
+
+    def recorded():
+        loop.initialized = False
+        loop.length = ROWS
+    results['initialize'] = timed(loop.initialize, iterations, setup = recorded)
+    return results
+
+def bench_effects(rate, chunk, tracks, iterations):
+    chain = EffectsChain(rate, chunk, tracks)
+    rows = np.random.default_rng(1).standard_normal([tracks, chunk]).astype(np.float32) * 3000
+    active = np.arange(tracks)
+    return {f'fx_{effect.name.lower()}': timed(lambda: effect.process(rows, active), iterations) for effect in chain.effects}
+
+def bench_update_volume(rate, chunk, tracks, iterations):
+    engine = make_engine(rate, chunk, tracks)
+    return timed(engine.update_volume, max(5, iterations // 50))
+
+def bench_waveform(rate, chunk, tracks, iterations):
+    engine = make_engine(rate, chunk, tracks)
+    waveform = WaveformMipmap(engine)
+    waveform.update(max_rows = engine.dirty.size)
+    rows = np.arange(2 * tracks) * engine.maxlength #one row per track layer, as after one callback overdubbing everything
+    def dirty():
+        engine.dirty_rows[rows] = DIRTY_ALL
+    return timed(waveform.update, iterations, setup = dirty)
+
+class NullDraw:
+    #draw target that draws nothing, for timing the rest of a frame without PIL
+    def text(self, *args, **kwargs):
+        pass
+
+    line = rectangle = text
+
+def bench_display(rate, chunk, tracks, iterations):
+    engine = make_engine(rate, chunk, tracks)
+    waveform = WaveformMipmap(engine)
+    waveform.update(max_rows = engine.dirty.size)
+    screen = Screen(engine, waveform, rate)
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+        font = ImageFont.load_default()
+    except ImportError:
+        Image = None
+
+    def frame():
+        draw = ImageDraw.Draw(Image.new('1', (128, 64))) if Image else NullDraw()
+        screen.draw_oled(draw, font if Image else None, 0, '[VOL:100%] TR CLK T1')
+    return timed(frame, max(10, iterations // 5)), Image is not None
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def case_key(case):
+    return tuple((name, case[name]) for name in ('bench', 'rate', 'chunk', 'tracks', 'overdubs') if name in case)
+
+def compare(results, baseline, tolerance):
+    '''
+    compare() prints the cases slower than in baseline by more than tolerance, returns how many there are
+    '''
+    old = {case_key(case): case for case in baseline['results']}
+    regressions = 0
+    for case in results['results']:
+        before = old.get(case_key(case))
+        if before is None or before['median_us'] <= 0:
+            continue
+        change = case['median_us'] / before['median_us'] - 1
+        if change > tolerance:
+            regressions += 1
+            label = ' '.join(f'{name}={value}' for name, value in case_key(case))
+            print(f'REGRESSION {label}: {before["median_us"]:.1f} -> {case["median_us"]:.1f} us ({100 * change:+.0f}%)')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the looper audio hot paths')
+    parser.add_argument('--chunks', default = '128,256,512,1024,2048')
+    parser.add_argument('--rates', default = '44100,48000,96000')
+    parser.add_argument('--tracks', default = '4,8')
+    parser.add_argument('--overdubs', default = '0,1,4')
+    parser.add_argument('--iterations', type = int, default = 500)
+    parser.add_argument('--quick', action = 'store_true', help = 'CHUNK 256/1024 at 44.1kHz, 4 tracks, fewer iterations')
+    parser.add_argument('--output', help = 'write results to this JSON file')
+    parser.add_argument('--baseline', help = 'compare with an earlier JSON result')
+    parser.add_argument('--tolerance', type = float, default = 0.2)
+    args = parser.parse_args()
+    if args.quick:
+        args.chunks, args.rates, args.tracks, args.overdubs, args.iterations = '256,1024', '44100', '4', '0,4', 100
+    chunks = [int(x) for x in args.chunks.split(',')]
+    rates = [int(x) for x in args.rates.split(',')]
+    track_counts = [int(x) for x in args.tracks.split(',')]
+    overdub_counts = [int(x) for x in args.overdubs.split(',')]
+    iterations = args.iterations
+
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'iterations': iterations,
+            'rows': ROWS,
+        },
+        'results': [],
+    }
+    def record(bench, times, deadline = None, **case):
+        entry = dict(bench = bench, **case, **summary(times, deadline))
+        results['results'].append(entry)
+        load = f" load {100 * entry['load']:5.1f}%" if 'load' in entry else ''
+        label = ' '.join(f'{name}={value}' for name, value in case.items())
+        print(f"{bench:<13} {label:<44} {entry['median_us']:>9.1f} us  p99 {entry['p99_us']:>9.1f} us{load}")
+
+    for rate in rates:
+        for chunk in chunks:
+            deadline = chunk / rate
+            for tracks in track_counts:
+                for overdubs in overdub_counts:
+                    if overdubs <= tracks:
+                        record('process', bench_process(rate, chunk, tracks, overdubs, iterations), deadline,
+                               rate = rate, chunk = chunk, tracks = tracks, overdubs = overdubs)
+                record('waveform', bench_waveform(rate, chunk, tracks, iterations), deadline,
+                       rate = rate, chunk = chunk, tracks = tracks)
+                for name, times in bench_effects(rate, chunk, tracks, iterations).items():
+                    record(name, times, deadline, rate = rate, chunk = chunk, tracks = tracks)
+            for name, times in bench_loop_methods(rate, chunk, iterations).items():
+                record(name, times, deadline, rate = rate, chunk = chunk)
+    #not on the callback path, and independent of the rate
+    for chunk in chunks:
+        for tracks in track_counts:
+            record('update_volume', bench_update_volume(rates[0], chunk, tracks, iterations), rate = rates[0], chunk = chunk, tracks = tracks)
+    for tracks in track_counts:
+        times, drawn = bench_display(rates[0], chunks[0], tracks, iterations)
+        record('display' if drawn else 'display_data', times, rate = rates[0], chunk = chunks[0], tracks = tracks)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+        print(f'Results written to {args.output}')
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print(f'{regressions} regressions against {args.baseline} (revision {baseline["meta"].get("revision")})')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+'''
+capture.py keeps the last seconds of input, so a phrase played without pressing record can
+still be looped (retrospective looping).
+
+CaptureRing is a preallocated ring of input rows that the callback always records into: the
+input is attenuated by input_shift straight into the next row of the ring (that row then is the
+buffer the engine records and overdubs from), so keeping it costs no copy at all. Each row also
+notes the master loop row playing when it came in.
+
+Capturer turns the end of the ring into a track on a worker thread, never in the callback:
+- capture(loop, loops = N): the last N master loop lengths, or capture(loop, seconds = N) the
+  last N seconds rounded to whole master loops, copied into two spare slots so that every row
+  lands where a recording of it would have (latency included) and swapped in at the track's
+  next loop boundary (engine.request_swap), like an imported file (importer.py)
+- before the first loop: capture_first(loops[0], seconds = N) copies the last N seconds into track 1,
+  waits for the copy and makes them the master loop, setting LENGTH; it raises the job's error
+  (e.g. less input than N seconds in the ring), so the caller can fall back to recording
+- ago leaves out the newest input, e.g. the time REC 1 was held down to ask for the capture
+
+Either way the seam (newest row followed by the oldest) is crossfaded like the end of a
+recording. A capture the callback overwrites while it is copied (close to the ring's length)
+is refused.
+'''
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from engine import DIRTY_ALL
+
+class CaptureRing:
+    def __init__(self, chunk, rows):
+        self.rows = rows
+        self.data = np.zeros([rows, chunk], dtype = np.int16)
+        #the callback writes every row: fault the pages in now rather than in its first pass, whatever memory.prefault says
+        #(the ring is small, capture.seconds of mono input)
+        self.data.fill(0)
+        self.master_row = np.full([rows], -1, dtype = np.int64) #master loop row playing as each row came in, -1 before the first loop
+        self.count = 0 #rows written so far, the next one goes to count % rows
+
+    def record(self, input_buffer, shift, master_row):
+        '''
+        record() writes input_buffer attenuated by shift bits into the next row and returns that row (in the callback)
+        '''
+        position = self.count % self.rows
+        row = self.data[position]
+        np.right_shift(input_buffer, shift, out = row)
+        self.master_row[position] = master_row
+        self.count += 1
+        return row
+
+    def last(self, count):
+        '''
+        last() returns the ring positions of the newest count rows, oldest first, and the count they end at
+        '''
+        end = self.count
+        if count > min(end, self.rows):
+            raise ValueError(f'only {min(end, self.rows)} buffers of input captured')
+        return (np.arange(end - count, end) % self.rows), end
+
+    def check(self, end, count):
+        '''
+        check() raises ValueError if the count rows ending at end were overwritten since last() returned them
+        '''
+        if self.count - end > self.rows - count:
+            raise ValueError('the capture was overwritten while it was copied, capture less')
+
+class Capturer:
+    def __init__(self, engine, ring):
+        self.engine = engine
+        self.ring = ring
+        self.jobs = queue.Queue()
+        self.busy = None #track index of the running job
+        self.thread = threading.Thread(target = self.run, name = 'capture', daemon = True)
+        self.thread.start()
+
+    def capture(self, loop, seconds = None, loops = None, ago = 0.0):
+        '''
+        capture() turns the last seconds, or loops master loop lengths, of input (leaving out the newest ago seconds)
+        into the track in the background
+        '''
+        engine = self.engine
+        if (seconds is None) == (loops is None):
+            raise ValueError('capture needs seconds or loops')
+        if not engine.setup_donerecording:
+            raise ValueError('record the first loop before capturing, or capture it with REC 1')
+        if loops is not None:
+            rows = int(loops) * engine.length
+        else:
+            rows = max(1, int(round(seconds * engine.rate / engine.chunk / engine.length))) * engine.length
+        self.submit(loop, rows, ago)
+
+    def capture_first(self, loop, seconds, ago = 0.0):
+        '''
+        capture_first() turns the last seconds of input (leaving out the newest ago seconds) into the master loop,
+        setting LENGTH; waits until it is done and raises ValueError if it could not be
+        '''
+        engine = self.engine
+        if engine.setup_donerecording or loop.index != 0:
+            raise ValueError('only the first loop is captured into track 1')
+        if engine.setup_is_recording or engine.setup_armed:
+            raise ValueError('the first loop is being recorded')
+        rows = int(round(seconds * engine.rate / engine.chunk))
+        self.submit(loop, rows, ago).result()
+        engine.finish_captured_first(rows)
+        print(f'Captured the last {rows * engine.chunk / engine.rate:.2f}s as the first loop')
+
+    def submit(self, loop, rows, ago):
+        '''
+        submit() checks that the ring holds rows of input before the newest ago seconds and queues the job,
+        returns a Future that is done when the rows are copied (or holds the job's error)
+        '''
+        engine = self.engine
+        if rows < 1 or rows > engine.maxlength:
+            raise ValueError(f'capture length must be 1 to {engine.maxlength} buffers')
+        skip = max(0, int(round(ago * engine.rate / engine.chunk)))
+        if rows + 1 + skip > self.ring.rows:
+            raise ValueError(f'the capture ring holds {self.ring.rows * engine.chunk / engine.rate:.1f}s')
+        captured = min(self.ring.count, self.ring.rows)
+        if rows + 1 + skip > captured:
+            raise ValueError(f'only {max(0, captured - 1 - skip) * engine.chunk / engine.rate:.1f}s of input captured so far')
+        done = Future()
+        self.jobs.put((loop, rows, skip, done))
+        return done
+
+    def run(self):
+        while True:
+            loop, rows, skip, done = self.jobs.get()
+            try:
+                self.busy = loop.index
+                if self.engine.setup_donerecording:
+                    with self.engine.acquire_spare() as (main_slot, dub_slot):
+                        self.process(loop, rows, skip, main_slot, dub_slot)
+                else:
+                    self.process_first(rows, skip)
+                done.set_result(rows)
+            except Exception as e:
+                print(f'Capture error: {e}')
+                done.set_exception(e)
+            self.busy = None
+
+    def copy(self, out, rows, skip, shift = None):
+        '''
+        copy() copies the newest rows of the ring but skip into out, oldest first: from row 0, or (with shift) so that the row
+        that came in at master row m goes to row m + shift (mod rows), crossfading the newest row into the row before
+        the oldest like the end of a recording; returns the row before the oldest
+        '''
+        engine = self.engine
+        ring = self.ring
+        positions, end = ring.last(rows + 1 + skip)
+        positions = positions[:rows + 1]
+        before = ring.data[positions[0]].copy()
+        if shift is None:
+            out[:rows] = ring.data[positions[1:]]
+        else:
+            newest = max(0, int(ring.master_row[positions[-1]]))
+            targets = (newest + shift - rows + 1 + np.arange(rows)) % rows
+            out[targets] = ring.data[positions[1:]]
+            seam = out[targets[-1]]
+            np.multiply(seam, engine.down_ramp, out = seam, casting = 'unsafe')
+            seam += (before * engine.up_ramp).astype(np.int16)
+        ring.check(end, rows + 1 + skip)
+        return before
+
+    def process(self, loop, rows, skip, main_slot, dub_slot):
+        engine = self.engine
+        start = time.perf_counter()
+        #input that came in at master row m plays at master row m - latency, as a recording of it would;
+        #a playing track keeps its offset from the master loop (latency, for a recorded one) through the swap
+        shift = -engine.latency
+        if loop.initialized:
+            shift += (loop.readp - engine.loops[0].readp) % engine.length
+        self.copy(engine.arena.slots[main_slot], rows, skip, shift)
+        engine.arena.slots[dub_slot, :rows] = 0
+        engine.dirty[main_slot, :rows] = DIRTY_ALL
+        engine.dirty[dub_slot, :rows] = DIRTY_ALL
+        engine.request_swap(loop, main_slot, dub_slot, rows, rows, 'replace' if loop.initialized else 'fill')
+        print(f'Track {loop.index + 1}: captured the last {rows * engine.chunk / engine.rate:.2f}s '
+              f'({rows // engine.length}x the master loop) in {time.perf_counter() - start:.2f}s')
+
+    def process_first(self, rows, skip):
+        engine = self.engine
+        loop = engine.loops[0]
+        #the seam is crossfaded by initialize(), from the row before the capture
+        loop.preceding_buffer = self.copy(loop.main_audio, rows, skip)
+        loop.dub_audio[:rows] = 0
+        loop.main_dirty[:rows] = DIRTY_ALL
+        loop.dub_dirty[:rows] = DIRTY_ALL
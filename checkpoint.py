@@ -0,0 +1,273 @@
+'''
+checkpoint.py contains the crash-safe autosave of the looper session.
+
+The audio callback never does any I/O: it only marks the rows it writes in engine.dirty
+(one flag per [arena slot, row]). A background thread wakes up every few seconds,
+copies just the dirty rows into a preallocated on-disk image (a memory-mapped file with
+the same layout as the loop arena), flushes it, and then atomically replaces a small JSON
+file with the loop state (lengths, pointers, mute, gain, which slots hold each track...).
+
+After a crash or power loss, restore() reads back only the rows each track uses and the
+state, so the session resumes where the last checkpoint left it.
+
+save() keeps a named copy of the session in sessions/ (a sparse image holding only the rows in
+use, plus the state). load() copies a saved session over the autosave and stops checkpointing,
+so the next start restores it; sessions are never swapped under a running callback.
+'''
+
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from engine import DIRTY_CHECKPOINT, DIRTY_WAVEFORM, LOOP_FIELDS, dirty_plane
+
+STATE_VERSION = 1
+
+SESSION_NAME = re.compile(r'[A-Za-z0-9_-]{1,32}')
+
+def write_state(path, state):
+    '''
+    write_state() atomically replaces the JSON state file at path
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class Checkpointer:
+    def __init__(self, engine, path, interval = 5.0):
+        self.engine = engine
+        self.path = path
+        self.interval = interval
+        self.image_path = os.path.join(path, 'session.img')
+        self.state_path = os.path.join(path, 'session.json')
+        self.sessions_path = os.path.join(path, 'sessions')
+        self.image = None
+        self.restored = False
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock() #serializes checkpoint() and discard()
+        self.last_checkpoint_rows = 0
+        self.last_checkpoint_seconds = 0.0
+
+    def open_image(self):
+        '''
+        open_image() opens the on-disk image, creating and preallocating it if needed
+        '''
+        os.makedirs(self.path, exist_ok = True)
+        size = self.engine.arena.nbytes
+        if not os.path.exists(self.image_path) or os.path.getsize(self.image_path) != size:
+            with open(self.image_path, 'wb') as f:
+                try:
+                    #reserve the blocks now so a checkpoint can't fail for lack of space later
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except (AttributeError, OSError):
+                    f.truncate(size)
+            #a new image doesn't match any saved state
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+        self.image = np.memmap(self.image_path, dtype = np.int16, mode = 'r+', shape = self.engine.rows.shape)
+
+    def session_state(self):
+        '''
+        session_state() returns the engine and loop state as a JSON-serializable dict
+        '''
+        engine = self.engine
+        return {
+            'version': STATE_VERSION,
+            'time': time.time(),
+            'rate': engine.rate,
+            'chunk': engine.chunk,
+            'tracks': engine.tracks,
+            'maxlength': engine.maxlength,
+            'slots': engine.arena.slots.shape[0],
+            'slot_of': engine.slot_of.tolist(),
+            'length': engine.length,
+            'output_volume': float(engine.output_volume),
+            'click_enabled': engine.click_enabled,
+            'loops': [{field: getattr(loop, field) for field in LOOP_FIELDS} for loop in engine.loops],
+            #the scenes not playing: their slots and track state
+            'scene': engine.scene,
+            'scene_slots': engine.scene_slots.tolist(),
+            'scenes': list(engine.scene_states),
+        }
+
+    def checkpoint(self):
+        '''
+        checkpoint() writes the rows written since the last checkpoint, then the state
+
+        runs on the checkpoint thread, never in the audio callback
+        '''
+        engine = self.engine
+        if not engine.setup_donerecording:
+            return
+        with self.lock:
+            start = time.perf_counter()
+            dirty = dirty_plane(engine.dirty_rows, DIRTY_CHECKPOINT)
+            rows = np.flatnonzero(dirty)
+            if len(rows):
+                #clear the flags before copying, so rows rewritten meanwhile are picked up next time
+                dirty[rows] = 0
+                self.image[rows] = engine.read_rows(rows)
+                self.image.flush()
+            state = self.session_state()
+            write_state(self.state_path, state)
+            self.last_checkpoint_rows = len(rows)
+            self.last_checkpoint_seconds = time.perf_counter() - start
+
+    def restore(self):
+        '''
+        restore() loads the last checkpointed session into the engine, returns True if there was one
+
+        must be called before the audio stream is started
+        '''
+        engine = self.engine
+        if not os.path.exists(self.state_path):
+            return False
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'Autosave state unreadable, starting a new session: {e}')
+            return False
+        layout = (STATE_VERSION, engine.rate, engine.chunk, engine.tracks, engine.maxlength, engine.arena.slots.shape[0])
+        if (state.get('version'), state.get('rate'), state.get('chunk'), state.get('tracks'), state.get('maxlength'), state.get('slots')) != layout:
+            print('Autosave was made with different audio settings, starting a new session')
+            return False
+
+        start = time.perf_counter()
+        #time-stretched tracks live in other slots than they started in
+        if len(state.get('scenes', [])) == len(engine.scene_states):
+            engine.scene_slots[:] = state['scene_slots']
+            engine.scene = state['scene']
+            engine.slot_of = engine.scene_slots[engine.scene]
+            engine.scene_states = state['scenes']
+        engine.slot_of[:] = state['slot_of']
+        engine.track_base[:] = engine.slot_of.reshape(-1) * engine.maxlength
+        engine.spare_slots = [slot for slot in range(engine.arena.slots.shape[0]) if slot not in engine.scene_slots]
+        for loop, loop_state in zip(engine.loops, state['loops']):
+            for field in LOOP_FIELDS:
+                if field in loop_state: #fields added later keep their defaults
+                    setattr(loop, field, loop_state[field])
+            loop.update_channel_gains()
+            loop.bind()
+            rows = loop.rows_used
+            main_base = engine.track_base[loop.index]
+            dub_base = engine.track_base[engine.tracks + loop.index]
+            loop.main_audio[:rows] = self.image[main_base:main_base + rows]
+            loop.dub_audio[:rows] = self.image[dub_base:dub_base + rows]
+        #the audio of the other scenes, as (slot, rows used)
+        other_layers = [(slot, loop_state['rows_used']) for slot_of, loops in zip(engine.scene_slots, engine.scene_states) if loops
+                        for layer in slot_of for slot, loop_state in zip(layer, loops)]
+        for slot, rows in other_layers:
+            engine.arena.slots[slot, :rows] = self.image[slot * engine.maxlength:slot * engine.maxlength + rows]
+        engine.length = state['length']
+        engine.output_volume = state['output_volume']
+        engine.click_enabled = state['click_enabled']
+        engine.setup_donerecording = True
+        #everything restored is already in the image, but the waveform overview has to see it
+        engine.dirty[:] = 0
+        for loop in engine.loops:
+            loop.main_dirty[:loop.rows_used] = DIRTY_WAVEFORM
+            loop.dub_dirty[:loop.rows_used] = DIRTY_WAVEFORM
+        for slot, rows in other_layers:
+            engine.dirty[slot, :rows] = DIRTY_WAVEFORM
+        self.restored = True
+        age = time.time() - state['time']
+        print(f'Restored session from autosave ({time.perf_counter() - start:.2f}s, checkpoint was {age:.0f}s old)')
+        return True
+
+    def session_paths(self, name):
+        '''
+        session_paths() returns the (image, state) paths of the saved session name
+        '''
+        if not SESSION_NAME.fullmatch(name):
+            raise ValueError(f'invalid session name {name!r}')
+        base = os.path.join(self.sessions_path, name)
+        return base + '.img', base + '.json'
+
+    def used_rows(self, state):
+        '''
+        used_rows() returns the image rows holding audio in the given session state
+        '''
+        maxlength = state['maxlength']
+        rows = []
+        scenes = [(state['slot_of'], state['loops'])]
+        scenes += [(slots, loops) for slots, loops in zip(state.get('scene_slots', []), state.get('scenes', [])) if loops]
+        for slot_of, loops in scenes:
+            for layer in slot_of:
+                for slot, loop in zip(layer, loops):
+                    rows.append(np.arange(loop['rows_used']) + slot * maxlength)
+        return np.concatenate(rows)
+
+    def save(self, name):
+        '''
+        save() writes the current session to sessions/<name>, replacing an earlier save of that name
+        '''
+        engine = self.engine
+        if not engine.setup_donerecording:
+            raise ValueError('nothing recorded yet')
+        image_path, state_path = self.session_paths(name)
+        os.makedirs(self.sessions_path, exist_ok = True)
+        with self.lock:
+            state = self.session_state()
+            rows = self.used_rows(state)
+            image = np.memmap(image_path, dtype = np.int16, mode = 'w+', shape = engine.rows.shape) #sparse until written
+            image[rows] = engine.read_rows(rows)
+            image.flush()
+            del image
+            write_state(state_path, state)
+        print(f'Saved session {name} ({len(rows)} rows)')
+
+    def load(self, name):
+        '''
+        load() makes sessions/<name> the autosaved session, to be restored by the next start
+
+        checkpointing stops, so the caller should restart the looper right after
+        '''
+        image_path, state_path = self.session_paths(name)
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        if state['maxlength'] != self.engine.maxlength or state['slots'] != self.engine.arena.slots.shape[0]:
+            raise ValueError(f'session {name} was saved with different audio settings')
+        self.stop()
+        with self.lock:
+            rows = self.used_rows(state)
+            self.image[rows] = np.memmap(image_path, dtype = np.int16, mode = 'r', shape = self.image.shape)[rows]
+            self.image.flush()
+            write_state(self.state_path, state)
+        print(f'Loaded session {name}, restored on restart')
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(f'Autosave error: {e}')
+
+    def start(self):
+        '''
+        start() starts the background checkpoint thread
+        '''
+        self.thread = threading.Thread(target = self.run, name = 'checkpoint', daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def discard(self):
+        '''
+        discard() stops checkpointing and forgets the saved session (intentional exit or new session)
+        '''
+        self.stop()
+        with self.lock:
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
@@ -0,0 +1,252 @@
+'''
+coldstore.py keeps cold tracks compressed, so the same RAM holds more (or longer) loops.
+
+A track goes cold when it has been muted for a master loop length, or (with cold_loops) when
+nothing has been recorded on it for cold_loops master loops. The ColdStore worker thread then
+compresses both layers of the track block by block (engine.block_rows rows per block) with a
+fast lossless codec (sample deltas split into byte planes, zlib level 1) and gives the blocks'
+pages back to the kernel (Arena.release()). While a cold track plays, the worker decompresses
+the blocks ahead of its read pointer and releases the ones behind it, so only about ahead_ms of
+it stays in memory; unmuting a cold track pages in the blocks at its read pointer first.
+
+The callback never decompresses anything: it plays a cold track's row only when its block is
+resident (engine.resident), otherwise the track stays silent and fades in once the block is
+back. A cold track doesn't start recording; a track waiting to record, or playing in a mode
+other than FWD, is decompressed completely (thawed) first.
+
+Clear and undo zero the layers of a cold track like any other (released pages read back as
+zeros), the store sees the rows flagged DIRTY_COLD and drops its copy of those layers. Code
+reading loop audio outside the callback goes through engine.read_rows(), which fills in the
+released rows from the compressed blocks.
+
+Pages can't be released while memory is locked (threads.realtime), and to hold more loop audio
+than there is RAM the arena must not be prefaulted (memory.prefault).
+'''
+
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from engine import DIRTY_COLD, dirty_plane
+
+ZEROS = b'' #compressed form of a silent block
+
+def compress_block(rows, level = 1):
+    '''
+    compress_block() returns the int16 rows losslessly compressed: sample deltas, low and high byte planes, zlib
+    '''
+    samples = rows.reshape(-1)
+    if not samples.any():
+        return ZEROS
+    delta = np.diff(samples, prepend = np.int16(0)) #wraps around in int16, cumsum in int16 undoes it exactly
+    planes = delta.view(np.uint8).reshape(-1, 2).T
+    return zlib.compress(planes.tobytes(), level)
+
+def decompress_block(blob, out):
+    '''
+    decompress_block() writes the rows compressed by compress_block() into out (int16, contiguous)
+    '''
+    if blob == ZEROS:
+        out[:] = 0
+        return
+    planes = np.frombuffer(zlib.decompress(blob), dtype = np.uint8).reshape(2, -1)
+    delta = np.empty([planes.shape[1]], dtype = np.int16)
+    delta.view(np.uint8).reshape(-1, 2)[:] = planes.T
+    np.cumsum(delta, dtype = np.int16, out = out.reshape(-1))
+
+class ColdStore:
+    def __init__(self, engine, cold_loops = 8, ahead_ms = 500, level = 1, interval = 0.02):
+        self.engine = engine
+        self.cold_loops = cold_loops #master loops without recording before a playing track goes cold, 0 = only muted tracks
+        self.ahead_rows = max(1, round(ahead_ms / 1000 * engine.rate / engine.chunk)) #rows kept in memory ahead of readp
+        self.level = level #zlib level
+        self.interval = interval #seconds between passes of the worker
+        self.blobs = {} #(slot, block) -> compressed rows, for every block of a cold track
+        self.lock = threading.Lock() #held while a block is compressed, released or paged in, and by read_rows()
+        self.slots = [None] * engine.tracks #(main, dub) slots of each cold track
+        now = time.monotonic()
+        self.last_active = [now] * engine.tracks #last time the track was recording, waiting or not playing FWD
+        self.last_audible = [now] * engine.tracks #last time the track was playing
+        self.can_release = True #False once releasing failed (locked memory)
+        engine.cold_store = self
+        self.thread = threading.Thread(target = self.run, name = 'coldstore', daemon = True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            for loop in self.engine.loops:
+                try:
+                    self.update(loop)
+                except Exception as e:
+                    print(f'Cold store error: {e}')
+            time.sleep(self.interval)
+
+    def update(self, loop):
+        '''
+        update() freezes, pages or thaws one track as its state asks for
+        '''
+        engine = self.engine
+        i = loop.index
+        now = time.monotonic()
+        slots = (int(engine.slot_of[0, i]), int(engine.slot_of[1, i]))
+        if self.slots[i] is not None and self.slots[i] != slots:
+            #a time-stretch or import result was swapped in, or another scene is playing: the old slots get their audio back
+            self.restore(self.slots[i])
+            self.slots[i] = None
+            loop.cold = False
+        if self.slots[i] is not None:
+            #clear and undo write zeros, which is what released rows read as: the written layers are up to date
+            dirty = dirty_plane(engine.dirty, DIRTY_COLD)
+            written = dirty[list(slots)].any(axis = 1)
+            for slot in np.array(slots)[written]:
+                dirty[slot] = 0
+                self.forget([int(slot)])
+        if not loop.initialized or loop.is_recording or loop.is_waiting or loop.mode != 'FWD':
+            self.last_active[i] = now
+        if loop.is_playing:
+            self.last_audible[i] = now
+        loop_seconds = engine.length * engine.chunk / engine.rate
+        quiet = now - self.last_active[i]
+        cold = (loop.initialized and self.can_release and quiet >= loop_seconds and
+                (now - self.last_audible[i] >= loop_seconds or (self.cold_loops and quiet >= self.cold_loops * loop_seconds)))
+        if not cold:
+            if self.slots[i] is not None:
+                self.thaw(loop)
+            return
+        if self.slots[i] is None:
+            loop.cold = True #from here on the callback won't start recording on it
+            if loop.is_recording or loop.is_waiting:
+                loop.cold = False
+                return
+            dirty_plane(engine.dirty, DIRTY_COLD)[list(slots)] = 0
+            self.slots[i] = slots
+            frozen = True
+        else:
+            frozen = False
+        block_rows = engine.block_rows
+        window = set()
+        if loop.is_playing and loop.length > 0:
+            for offset in list(range(0, self.ahead_rows, block_rows)) + [self.ahead_rows]:
+                window.add((loop.readp + offset) % loop.length // block_rows)
+        for block in range(-(-loop.rows_used // block_rows)):
+            if block in window:
+                self.page_in(slots, block)
+            else:
+                self.page_out(slots, block)
+        if frozen:
+            print(f'Track {i + 1}: cold. {self.report()}')
+
+    def block_range(self, block):
+        start = block * self.engine.block_rows
+        return start, min(start + self.engine.block_rows, self.engine.maxlength)
+
+    def page_out(self, slots, block):
+        '''
+        page_out() compresses the block of both layers (unless it already is) and releases its pages
+        '''
+        engine = self.engine
+        if not self.can_release:
+            return
+        start, end = self.block_range(block)
+        with self.lock:
+            #main layer first: it is the one the callback checks
+            for slot in slots:
+                if not engine.resident[slot, block]:
+                    continue
+                if (slot, block) not in self.blobs:
+                    self.blobs[(slot, block)] = compress_block(engine.arena.slots[slot, start:end], self.level)
+                engine.resident[slot, block] = False
+                try:
+                    engine.arena.release(slot, start, end - start)
+                except OSError as e:
+                    print(f'Cold store: can\'t release memory ({e}), is it locked (threads.realtime)?')
+                    self.can_release = False
+                    engine.resident[slot, block] = True
+                    return
+
+    def page_in(self, slots, block):
+        '''
+        page_in() decompresses the block of both layers back into the arena
+        '''
+        engine = self.engine
+        start, end = self.block_range(block)
+        with self.lock:
+            #dub layer first, the main layer marks the block playable
+            for slot in reversed(slots):
+                if engine.resident[slot, block]:
+                    continue
+                decompress_block(self.blobs[(slot, block)], engine.arena.slots[slot, start:end])
+                if dirty_plane(engine.dirty, DIRTY_COLD)[slot, start:end].any():
+                    engine.arena.slots[slot, start:end] = 0 #cleared or undone while decompressing
+                engine.resident[slot, block] = True
+
+    def thaw(self, loop):
+        '''
+        thaw() decompresses the whole track and makes it an ordinary track again
+        '''
+        slots = self.slots[loop.index]
+        blocks = list(range(-(-loop.rows_used // self.engine.block_rows)))
+        #from the read pointer on, so an unmuted track is heard before the whole of it is back
+        first = min(loop.readp // self.engine.block_rows, len(blocks))
+        for block in blocks[first:] + blocks[:first]:
+            self.page_in(slots, block)
+        self.forget(slots)
+        self.slots[loop.index] = None
+        loop.cold = False
+
+    def restore(self, slots):
+        '''
+        restore() decompresses the released blocks of slots no track plays any more, and forgets them
+        '''
+        engine = self.engine
+        with self.lock:
+            for (slot, block), blob in list(self.blobs.items()):
+                if slot in slots and not engine.resident[slot, block]:
+                    start, end = self.block_range(block)
+                    decompress_block(blob, engine.arena.slots[slot, start:end])
+                    engine.resident[slot, block] = True
+        self.forget(slots)
+
+    def forget(self, slots):
+        '''
+        forget() drops the compressed blocks of the slots, whose rows in the arena are to be used as they are
+        '''
+        engine = self.engine
+        with self.lock:
+            for slot in slots:
+                for block in range(engine.resident.shape[1]):
+                    self.blobs.pop((slot, block), None)
+                engine.resident[slot] = True
+
+    def read_rows(self, index):
+        '''
+        read_rows() returns a copy of the rows at index (into engine.rows), decompressing the ones not in memory
+        '''
+        engine = self.engine
+        with self.lock:
+            rows = engine.rows[index]
+            slots, offsets = np.divmod(index, engine.maxlength)
+            blocks = offsets // engine.block_rows
+            missing = ~engine.resident[slots, blocks]
+            if missing.any():
+                for slot, block in set(zip(slots[missing].tolist(), blocks[missing].tolist())):
+                    start, end = self.block_range(block)
+                    data = np.empty([end - start, engine.chunk], dtype = np.int16)
+                    decompress_block(self.blobs[(slot, block)], data)
+                    selected = missing & (slots == slot) & (blocks == block)
+                    rows[selected] = data[offsets[selected] - start]
+            return rows
+
+    def report(self):
+        '''
+        report() returns a one-line summary of the cold tracks and their memory
+        '''
+        engine = self.engine
+        with self.lock:
+            compressed = sum(len(blob) for blob in self.blobs.values())
+            released = int(np.count_nonzero(~engine.resident)) * engine.block_rows * engine.chunk * 2
+        cold = [str(i + 1) for i, slots in enumerate(self.slots) if slots is not None]
+        return (f'Cold store: tracks {",".join(cold) or "none"} cold, {released / 2**20:.1f} MB released, '
+                f'{compressed / 2**20:.1f} MB compressed')
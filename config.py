@@ -0,0 +1,310 @@
+'''
+config.py loads, validates and saves the looper configuration.
+
+The configuration lives in Config/settings.json. Every key has a default and a
+validation rule in SCHEMA, so a partial file (or no file at all) still yields a
+complete configuration. The old positional Config/settings.prt is migrated
+automatically the first time it is found without a settings.json next to it.
+
+Usage:
+    from config import get_config
+    config = get_config()
+    RATE = config['audio']['rate']
+'''
+
+import copy
+import json
+import os
+import re
+
+CONFIG_VERSION = 1
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Config')
+CONFIG_PATH = os.path.join(CONFIG_DIR, 'settings.json')
+LEGACY_PATH = os.path.join(CONFIG_DIR, 'settings.prt')
+
+
+class ConfigError(ValueError):
+    '''raised when the configuration file is malformed or a value fails validation'''
+    pass
+
+
+#SCHEMA maps section -> key -> (kind, default, limits)
+#kind is one of 'int', 'float', 'bool', 'str', 'int_list'
+#limits is (min, max) for numbers, (min_len, max_len) for lists, a tuple of choices for str, or None
+SCHEMA = {
+    'audio': {
+        'rate': ('int', 44100, (8000, 192000)), #sample rate
+        'chunk': ('int', 512, (32, 8192)), #buffer size in samples per callback
+        'latency_ms': ('int', 50, (0, 2000)), #input+output latency correction
+        'input_device': ('int', 1, (0, 255)), #index (per pyaudio) of input device
+        'output_device': ('int', 1, (0, 255)), #index of output device
+        'overshoot_ms': ('int', 500, (0, 10000)), #allowance for pressing 'stop recording' late
+        'max_samples': ('int', 12582912, (4096, 2**31 - 1)), #buffer budget per track (12582912 samples = 96mb total for 4 tracks)
+        'channels': ('int', 1, (1, 2)), #1 = mono, 2 = stereo output (enables per-track pan; input is mixed down to mono)
+        'tracks': ('int', 4, (1, 16)), #number of tracks, tracks beyond the configured buttons/LEDs have no GPIO controls
+        'input_shift': ('int', 2, (0, 8)), #recorded input is attenuated by 2**input_shift for overdub headroom
+    },
+    'mixer': {
+        'ramp_ms': ('float', 10.0, (0.0, 1000.0)), #duration of gain, pan and mute ramps
+    },
+    'effects': {
+        'enabled': ('bool', True, None), #per-track insert effects (FX menu item), off on every track until turned on
+        'budget': ('float', 0.25, (0.01, 1.0)), #fraction of the callback deadline all enabled effects may take, more are refused
+        'eq_type': ('str', 'lowpass', ('lowpass', 'highpass', 'bandpass', 'peak')), #EQ: biquad filter type
+        'eq_freq': ('float', 1000.0, (20.0, 20000.0)), #EQ: cutoff or center frequency in Hz
+        'eq_q': ('float', 0.707, (0.1, 20.0)),
+        'eq_gain_db': ('float', 6.0, (-24.0, 24.0)), #EQ: boost or cut of the peak filter
+        'delay_ms': ('float', 375.0, (1.0, 2000.0)), #DLY: delay time, at least one buffer
+        'delay_feedback': ('float', 0.4, (0.0, 0.95)),
+        'delay_mix': ('float', 0.35, (0.0, 1.0)), #DLY: level of the echoes added to the dry track
+        'reverb_decay': ('float', 0.8, (0.0, 0.95)), #REV: comb feedback, longer tails towards 0.95
+        'reverb_mix': ('float', 0.25, (0.0, 1.0)),
+    },
+    'overdub': {
+        'feedback': ('float', 0.9, (0.0, 1.0)), #initial per-track overdub feedback, existing audio is scaled by this on every pass
+    },
+    'autorecord': {
+        'enabled': ('bool', False, None), #armed tracks (and the first loop) start at the first onset in the input instead of the button press or loop restart (AUTO menu item)
+        'threshold_db': ('float', -30.0, (-90.0, 0.0)), #input level in dBFS that counts as an onset
+        'preroll_ms': ('float', 5.0, (0.0, 100.0)), #input recorded before the onset, so the attack isn't cut
+    },
+    'stretch': {
+        'enabled': ('bool', False, None), #background time-stretch/pitch-shift of tracks (FIT and PITCH menu items), needs two extra track layers of memory
+    },
+    'import': {
+        'enabled': ('bool', False, None), #load WAV/FLAC files into tracks (control API "import"), shares the two spare track layers with stretch
+        'path': ('str', 'imports', None), #directory for relative file names, relative to the looper directory
+    },
+    'capture': {
+        'enabled': ('bool', False, None), #keep the last seconds of input to capture into a track (CAP menu item, control API "capture"), uses the two spare track layers
+        'seconds': ('float', 30.0, (1.0, 600.0)), #length of the input kept, 2 bytes per sample
+        'first_seconds': ('float', 4.0, (0.1, 600.0)), #input captured as the first loop by holding REC 1 at the start
+    },
+    'scenes': {
+        'count': ('int', 1, (1, 16)), #complete sets of tracks held at once, switched with the SCN menu item at the loop boundary; each needs the memory of all tracks
+    },
+    'longloop': {
+        'enabled': ('bool', False, None), #map the loop memory from a file, for loops longer than RAM allows (raise audio.max_samples)
+        'path': ('str', 'loops.bin', None), #the file (recreated at every start), relative to the looper directory; put it on a fast card or USB drive
+        'readahead_ms': ('int', 2000, (100, 60000)), #audio paged in ahead of every track's read and write pointers
+        'flush_ms': ('int', 500, (50, 60000)), #period of writing recorded rows back to the file
+    },
+    'monitor': {
+        'enabled': ('bool', False, None), #mix the input directly into the output
+        'gain': ('float', 1.0, (0.0, 2.0)),
+    },
+    'limiter': {
+        'enabled': ('bool', True, None), #master bus limiter, replaces the global peak scan on button release
+        'ceiling': ('float', 0.9, (0.1, 1.0)), #maximum output level as a fraction of full scale
+        'lookahead_ms': ('float', 3.0, (0.1, 50.0)), #adds to output latency, recordings are moved back by it
+        'release_ms': ('float', 100.0, (1.0, 5000.0)),
+    },
+    'autosave': {
+        'enabled': ('bool', True, None), #checkpoint the session to disk so it survives a crash or power loss
+        'interval': ('float', 5.0, (0.5, 600.0)), #seconds between checkpoints
+        'path': ('str', 'autosave', None), #directory for the session image, relative to the looper directory
+    },
+    'midi': {
+        'clock_out': ('bool', False, None), #send 24 PPQN MIDI clock and start/stop following the master loop
+        'clock_in': ('bool', False, None), #follow the tempo of incoming MIDI clock with the master loop length
+        'output_port': ('str', '', None), #MIDI port name, empty = create a virtual port
+        'input_port': ('str', '', None),
+        'beats_per_loop': ('int', 4, (1, 64)), #beats in one master loop, sets the tempo of the clock
+    },
+    'memory': {
+        'prefault': ('bool', False, None), #touch all loop memory at startup instead of page-faulting during the first recording (takes it all from RAM at once)
+        'hugepages': ('bool', True, None), #ask for transparent hugepages for the loop arena (if the kernel allows madvise)
+        'compress_cold': ('bool', False, None), #keep muted and long unrecorded tracks compressed, paged in ahead of playback (not with threads.realtime)
+        'cold_loops': ('int', 8, (0, 10000)), #master loops without recording before a playing track is compressed, 0 = only muted tracks
+        'cold_ahead_ms': ('int', 500, (50, 10000)), #audio of a cold track kept decompressed ahead of its read pointer
+    },
+    'controls': {
+        'debounce': ('float', 0.03, (0.0, 1.0)), #length in seconds of button debounce period
+        'hold_time': ('float', 2.0, (0.1, 10.0)), #length in seconds to hold button before triggering held event
+        'encoder_bounce': ('float', 0.002, (0.0, 1.0)),
+        'encoder_button_bounce': ('float', 0.1, (0.0, 1.0)),
+        'poll_interval': ('float', 0.1, (0.01, 1.0)), #period in seconds of the main UI loop
+    },
+    'control': {
+        'enabled': ('bool', False, None), #local control/telemetry API on a Unix socket (controlapi.py)
+        'socket': ('str', '/tmp/raspi-looper.sock', None),
+        'telemetry_rate': ('float', 20.0, (1.0, 200.0)), #default telemetry frames per second
+        'telemetry_batch': ('int', 5, (1, 100)), #default frames per telemetry message
+    },
+    'gpio': {
+        'play_leds': ('int_list', [12, 16, 4, 17], (1, 16)),
+        'rec_leds': ('int_list', [27, 22, 10, 9], (1, 16)),
+        'play_buttons': ('int_list', [11, 5, 6, 13], (1, 16)),
+        'rec_buttons': ('int_list', [19, 26, 21, 20], (1, 16)),
+        'encoder_clk': ('int', 23, (0, 27)),
+        'encoder_dt': ('int', 24, (0, 27)),
+        'encoder_sw': ('int', 25, (0, 27)),
+    },
+    'display': {
+        'i2c_buses': ('int_list', [1, 20, 21], (0, 8)), #probed in order
+        'oled_addresses': ('int_list', [0x3C, 0x3D], (0, 8)),
+        'lcd_addresses': ('int_list', [0x27, 0x3F], (0, 8)),
+        'lcd_cols': ('int', 20, (8, 40)),
+        'lcd_rows': ('int', 4, (1, 4)),
+        'oled_refresh_buffers': ('int', 50, (1, 10000)), #audio buffers between display refreshes
+        'lcd_refresh_buffers': ('int', 100, (1, 10000)),
+    },
+    'threads': {
+        'realtime': ('bool', False, None), #prefault and mlock the loop buffers, pin the audio thread to audio_cpu with SCHED_FIFO
+        'audio_priority': ('int', 0, (0, 99)), #0 = normal scheduling (70 in realtime mode), 1-99 = SCHED_FIFO priority of the audio callback thread
+        'audio_cpu': ('int', 3, (-1, 63)), #core reserved for the audio thread in realtime mode, -1 = no pinning
+        'ui_nice': ('int', 0, (-20, 19)), #niceness of the main UI loop thread
+        'engine_process': ('bool', False, None), #run the engine, audio stream, autosave and stretcher in their own process (audioprocess.py)
+    },
+}
+
+
+def defaults():
+    '''
+    defaults() returns a complete configuration built only from SCHEMA defaults
+    '''
+    config = {'version': CONFIG_VERSION}
+    for section, keys in SCHEMA.items():
+        config[section] = {key: copy.deepcopy(rule[1]) for key, rule in keys.items()}
+    return config
+
+
+def _parse_int(value, where):
+    #accept ints and hex/decimal strings (e.g. "0x3C" for I2C addresses), reject bools
+    if isinstance(value, bool):
+        raise ConfigError(f'{where}: expected an integer, got {value!r}')
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value, 0)
+        except ValueError:
+            pass
+    raise ConfigError(f'{where}: expected an integer, got {value!r}')
+
+
+def _validate_value(kind, value, limits, where):
+    if kind == 'int':
+        value = _parse_int(value, where)
+    elif kind == 'float':
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ConfigError(f'{where}: expected a number, got {value!r}')
+        value = float(value)
+    elif kind == 'bool':
+        if not isinstance(value, bool):
+            raise ConfigError(f'{where}: expected true or false, got {value!r}')
+    elif kind == 'str':
+        if not isinstance(value, str):
+            raise ConfigError(f'{where}: expected a string, got {value!r}')
+        if limits and value not in limits:
+            raise ConfigError(f'{where}: must be one of {", ".join(limits)}, got {value!r}')
+        return value
+    elif kind == 'int_list':
+        if not isinstance(value, list):
+            raise ConfigError(f'{where}: expected a list of integers, got {value!r}')
+        value = [_parse_int(v, f'{where}[{i}]') for i, v in enumerate(value)]
+        if limits and not (limits[0] <= len(value) <= limits[1]):
+            raise ConfigError(f'{where}: expected between {limits[0]} and {limits[1]} entries, got {len(value)}')
+        return value
+    else:
+        raise ConfigError(f'{where}: unknown kind {kind!r} in schema')
+
+    if limits and kind in ('int', 'float') and not (limits[0] <= value <= limits[1]):
+        raise ConfigError(f'{where}: {value} is outside the allowed range {limits[0]}..{limits[1]}')
+    return value
+
+
+def validate(raw):
+    '''
+    validate() checks a raw configuration dict against SCHEMA and returns a complete, normalized copy
+
+    missing sections and keys are filled with defaults, unknown ones are rejected
+    '''
+    if not isinstance(raw, dict):
+        raise ConfigError('configuration must be a JSON object')
+    version = raw.get('version', CONFIG_VERSION)
+    if version != CONFIG_VERSION:
+        raise ConfigError(f'unsupported configuration version {version!r} (expected {CONFIG_VERSION})')
+
+    config = defaults()
+    for section, values in raw.items():
+        if section == 'version':
+            continue
+        if section not in SCHEMA:
+            raise ConfigError(f'unknown section {section!r}')
+        if not isinstance(values, dict):
+            raise ConfigError(f'section {section!r} must be a JSON object')
+        for key, value in values.items():
+            if key not in SCHEMA[section]:
+                raise ConfigError(f'unknown key {section}.{key}')
+            kind, default, limits = SCHEMA[section][key]
+            config[section][key] = _validate_value(kind, value, limits, f'{section}.{key}')
+    return config
+
+
+def migrate_legacy(path = LEGACY_PATH):
+    '''
+    migrate_legacy() converts the positional settings.prt (rate, chunk, latency ms, in-device, out-device, overshoot ms)
+    into a configuration dict
+    '''
+    with open(path, 'r') as f:
+        parameters = [line.strip() for line in f.readlines()]
+    keys = ('rate', 'chunk', 'latency_ms', 'input_device', 'output_device', 'overshoot_ms')
+    raw = {'version': CONFIG_VERSION, 'audio': {}}
+    for key, value in zip(keys, parameters):
+        if value != '':
+            raw['audio'][key] = value
+    return validate(raw)
+
+
+def load_config(path = CONFIG_PATH):
+    '''
+    load_config() reads and validates the configuration file
+
+    if the file does not exist, the legacy settings.prt is migrated (and saved as settings.json),
+    otherwise defaults are used
+    '''
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                raw = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ConfigError(f'{path}: {e}')
+        return validate(raw)
+    if path == CONFIG_PATH and os.path.exists(LEGACY_PATH):
+        print('Migrating ' + LEGACY_PATH + ' to ' + CONFIG_PATH)
+        config = migrate_legacy(LEGACY_PATH)
+        save_config(config, path)
+        return config
+    print('No configuration found at ' + path + ', using defaults')
+    return defaults()
+
+
+def save_config(config, path = CONFIG_PATH):
+    '''
+    save_config() validates and atomically writes the configuration file
+    '''
+    config = validate(config)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = path + '.tmp'
+    text = json.dumps(config, indent = 4)
+    #keep integer lists (pin maps, addresses) on one line
+    text = re.sub(r'\[\s+([-\d,\s]+?)\s+\]', lambda m: '[' + ' '.join(m.group(1).split()) + ']', text)
+    with open(tmp_path, 'w') as f:
+        f.write(text + '\n')
+    os.replace(tmp_path, path)
+
+
+_config = None
+
+def get_config():
+    '''
+    get_config() returns the shared configuration, loading it on first use
+    '''
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
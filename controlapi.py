@@ -0,0 +1,198 @@
+'''
+controlapi.py contains the local control API: newline-delimited JSON over a Unix domain socket,
+for scripted control (e.g. a foot-controller daemon) and telemetry.
+
+The server is an asyncio loop on its own thread in the UI process. Actions call the same
+functions as the buttons and the encoder menu (passed in by main.py), run on a worker thread
+so a slow one doesn't hold up telemetry, and never touch the audio thread directly.
+
+Requests are one JSON object per line; "id", if given, is echoed in the reply:
+    {"action": "record", "track": 1}          REC button of track 1 (tracks count from 1)
+    {"action": "mute", "track": 1}            PLAY button
+    {"action": "clear", "track": 1}           holding REC: clear, or undo the last overdub
+    {"action": "volume", "value": 0.8}        or {"action": "volume", "steps": -5} (VOL menu)
+    {"action": "trim", "steps": 2}            TRIM menu, 2 buffers per step
+    {"action": "click", "enabled": true}      CLK menu, toggles without "enabled"
+    {"action": "auto", "enabled": true}       AUTO menu: armed tracks start at the first onset, toggles without "enabled"
+    {"action": "scene", "scene": 2}           SCN menu: switch to scene 2 at the next master loop boundary
+    {"action": "fx", "track": 2, "effect": "DLY", "enabled": true}
+                                              FX menu: turn an insert effect (EQ, DLY, REV) on or off, toggles
+                                              without "enabled"; refused when over the effects budget
+    {"action": "save", "name": "song1"}       save the session (needs autosave)
+    {"action": "load", "name": "song1"}       load a saved session (the looper restarts)
+    {"action": "import", "track": 2, "file": "drums.wav"}
+                                              load a WAV/FLAC file (relative to import.path, nothing outside it) into track 2;
+                                              with "master": true instead of "track" it replaces the master
+                                              loop and LENGTH follows the file
+    {"action": "capture", "track": 2, "loops": 2}
+                                              the last 2 master loops of input into track 2 (or "seconds": 8,
+                                              rounded to whole master loops)
+    {"action": "status"}                      one telemetry frame
+    {"action": "subscribe", "rate": 20, "batch": 5}
+    {"action": "unsubscribe"}
+Replies are {"id": ..., "ok": true} (with "frame" for status) or {"id": ..., "ok": false, "error": "..."} when
+the action failed or was refused.
+
+A subscription samples a telemetry frame (loop position, track states, meters, callback
+timing) rate times per second and sends them batch frames per message, {"telemetry": [...]}.
+Batches for a client that doesn't keep up are dropped rather than queued.
+'''
+
+import asyncio
+import json
+import os
+import stat
+import threading
+import time
+
+from effects import EFFECT_NAMES
+
+MAX_PENDING_BYTES = 256 * 1024 #telemetry is dropped for a client with this much unsent
+
+def track_state(loop):
+    '''
+    track_state() returns the one-letter state of a track: R(ecording), W(aiting), P(laying), M(uted) or - (empty)
+    '''
+    if loop.is_recording:
+        return 'R'
+    elif loop.is_waiting:
+        return 'W'
+    elif loop.is_playing:
+        return 'P'
+    elif loop.initialized:
+        return 'M'
+    return '-'
+
+def telemetry_frame(engine):
+    '''
+    telemetry_frame() returns the engine's current state as a JSON-serializable dict
+    '''
+    snapshot = engine.meters.snapshot
+    master = engine.loops[0]
+    return {
+        'time': time.time(),
+        'length': engine.length,
+        'position': master.readp if master.initialized else 0,
+        'volume': float(engine.output_volume),
+        'click': engine.click_enabled,
+        'auto_record': engine.auto_record,
+        'scene': engine.scene + 1,
+        'tracks': [{
+            'state': track_state(loop),
+            'readp': loop.readp,
+            'length': loop.length,
+            'gain': round(loop.gain, 3),
+            'pan': round(loop.pan, 3),
+            'feedback': round(loop.feedback, 3),
+            'sos': loop.sos,
+            'mode': loop.mode,
+            'effects': [name for i, name in enumerate(EFFECT_NAMES) if loop.effects >> i & 1],
+        } for loop in engine.loops],
+        'meters': {
+            'input_peak': round(float(snapshot.input_peak), 5),
+            'input_rms': round(float(snapshot.input_rms), 5),
+            'track_peak': [round(float(level), 5) for level in snapshot.track_peak],
+            'track_rms': [round(float(level), 5) for level in snapshot.track_rms],
+            'master_peak': round(float(snapshot.master_peak), 5),
+            'master_rms': round(float(snapshot.master_rms), 5),
+            'gain_reduction': round(float(snapshot.gain_reduction), 5),
+        },
+        'callback': {
+            'count': engine.callback_count,
+            'last_us': round(1e6 * engine.callback_seconds, 1),
+            'peak_us': round(1e6 * engine.callback_peak_seconds, 1),
+            'deadline_us': round(1e6 * engine.deadline, 1),
+            'overruns': engine.callback_overruns,
+            'effects_us': {name: round(1e6 * seconds, 1) for name, seconds in zip(EFFECT_NAMES, engine.effect_seconds)},
+        },
+    }
+
+class ControlServer:
+    def __init__(self, path, engine, actions, rate = 20.0, batch = 5):
+        self.path = path
+        self.engine = engine
+        self.actions = actions #action name -> function(request), raises (ValueError, RuntimeError, ...) if it fails
+        self.rate = rate
+        self.batch = batch
+        self.thread = None
+
+    def start(self):
+        '''
+        start() starts serving on a background thread
+        '''
+        self.thread = threading.Thread(target = asyncio.run, args = (self.serve(),), name = 'control', daemon = True)
+        self.thread.start()
+
+    async def serve(self):
+        #a socket left behind by an earlier run would make the bind fail
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self.handle, path = self.path)
+        print(f'Control API listening on {self.path}')
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        stream = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('request must be a JSON object')
+                except ValueError as e:
+                    self.send(writer, {'ok': False, 'error': f'bad request: {e}'})
+                    continue
+                reply = {'id': request['id']} if 'id' in request else {}
+                action = request.get('action')
+                try:
+                    if action == 'subscribe':
+                        rate = min(200.0, max(1.0, float(request.get('rate', self.rate))))
+                        batch = min(100, max(1, int(request.get('batch', self.batch))))
+                        if stream:
+                            stream.cancel()
+                        stream = asyncio.create_task(self.stream(writer, rate, batch))
+                    elif action == 'unsubscribe':
+                        if stream:
+                            stream.cancel()
+                            stream = None
+                    elif action == 'status':
+                        reply['frame'] = telemetry_frame(self.engine)
+                    elif action in self.actions:
+                        await asyncio.get_running_loop().run_in_executor(None, self.actions[action], request)
+                    else:
+                        raise ValueError(f'unknown action {action!r}')
+                    reply['ok'] = True
+                except Exception as e:
+                    reply['ok'] = False
+                    reply['error'] = str(e)
+                self.send(writer, reply)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if stream:
+                stream.cancel()
+            writer.close()
+
+    async def stream(self, writer, rate, batch):
+        '''
+        stream() sends telemetry frames to one client until cancelled
+        '''
+        frames = []
+        interval = 1.0 / rate
+        next_frame = time.monotonic()
+        while not writer.is_closing():
+            frames.append(telemetry_frame(self.engine))
+            if len(frames) >= batch:
+                if writer.transport.get_write_buffer_size() < MAX_PENDING_BYTES:
+                    self.send(writer, {'telemetry': frames})
+                frames = []
+            next_frame += interval
+            await asyncio.sleep(max(0.0, next_frame - time.monotonic()))
+
+    def send(self, writer, message):
+        writer.write(json.dumps(message, separators = (',', ':')).encode() + b'\n')
@@ -0,0 +1,155 @@
+'''
+diskstore.py keeps a file-backed loop arena (long loop mode, config section longloop) streaming.
+
+In long loop mode the arena (arena.py) maps a file on the SD card or a USB drive instead of
+anonymous memory, so a track can be many minutes long: the kernel keeps only part of the file
+in RAM. The callback must still never wait for the disk, so DiskStore runs a thread that
+- reads ahead: pages in the rows every track reads in the next readahead_ms (in its playback
+  mode) with madvise(WILLNEED) and a touch of every page, muted tracks included (the mixer reads
+  them too, at gain 0), and write-faults the rows a recording track is about to write, so the
+  callback only touches resident pages
+- writes behind: writes the rows written since its last pass (flagged DIRTY_DISK) back to the
+  file, except the ones next to a write pointer, so dirty pages never pile up and the kernel
+  can drop clean pages of the loops when memory runs short
+
+Realtime mode (threads.realtime) locks the whole mapping in memory, which defeats the point;
+the cold track compression (coldstore.py) is for anonymous memory only.
+'''
+
+import mmap
+import threading
+import time
+
+import numpy as np
+
+from engine import DIRTY_DISK, dirty_plane
+
+def loop_ranges(start, count, length):
+    '''
+    loop_ranges() returns the rows start to start + count of a loop of length rows, wrapping around, as (start, end) ranges
+    '''
+    count = min(count, length)
+    start %= length
+    if start + count <= length:
+        return [(start, start + count)]
+    return [(start, length), (0, start + count - length)]
+
+def read_window(loop, count):
+    '''
+    read_window() returns the row ranges the loop reads in its next count buffers, in its playback mode
+    '''
+    length = loop.length
+    if loop.mode == 'REV':
+        return loop_ranges(length - loop.readp - count, count, length)
+    if loop.mode == 'DBL':
+        return loop_ranges(2 * loop.readp, 2 * count + 1, length)
+    if loop.mode == 'HALF':
+        return loop_ranges((loop.readp + length * loop.play_phase) // 2, count // 2 + 1, length)
+    return loop_ranges(loop.readp, count, length)
+
+class DiskStore:
+    def __init__(self, engine, readahead_ms = 2000, flush_ms = 500):
+        self.engine = engine
+        self.ahead_rows = max(1, round(readahead_ms / 1000 * engine.rate / engine.chunk))
+        self.interval = max(0.01, readahead_ms / 4000) #several passes per read-ahead window
+        self.flush_interval = flush_ms / 1000
+        self.row_bytes = engine.chunk * 2
+        self.page_rows = max(1, mmap.PAGESIZE // self.row_bytes) #rows sharing a page (at least one)
+        self.touched_bytes = 0 #bytes paged in (or found resident) ahead of the callback
+        self.flushed_bytes = 0 #bytes written back
+        self.last_flush = time.monotonic()
+        self.thread = threading.Thread(target = self.run, name = 'diskstore', daemon = True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.read_ahead()
+                if time.monotonic() - self.last_flush >= self.flush_interval:
+                    self.last_flush = time.monotonic()
+                    self.write_behind()
+            except Exception as e:
+                print(f'Long loop store error: {e}')
+            time.sleep(self.interval)
+
+    def touch(self, slot, start, end, write = False):
+        '''
+        touch() pages in rows start to end of slot, for writing if write (without changing them)
+        '''
+        arena = self.engine.arena
+        if end <= start:
+            return
+        page = mmap.PAGESIZE
+        begin = arena.offset + (slot * self.engine.maxlength + start) * self.row_bytes
+        aligned = begin - begin % page
+        arena.map.madvise(mmap.MADV_WILLNEED, aligned, begin + (end - start) * self.row_bytes - aligned)
+        flat = arena.slots[slot, start:end].reshape(-1).view(np.uint8)
+        pages = flat[::page]
+        if write:
+            pages |= 0 #a write fault now, not in the callback
+        else:
+            pages.max()
+        self.touched_bytes += flat.nbytes
+
+    def read_ahead(self):
+        '''
+        read_ahead() pages in what the callback reads and writes next, for every track
+        '''
+        engine = self.engine
+        for loop in engine.loops:
+            slots = engine.slot_of[:, loop.index]
+            if loop.is_recording and not loop.initialized:
+                #a first recording appends at length: stay a page clear of the row being written
+                start = loop.length + self.page_rows
+                self.touch(slots[0], start, min(start + self.ahead_rows, engine.maxlength), write = True)
+                continue
+            if not loop.initialized or loop.length <= 0:
+                continue
+            #the mixer reads every initialized track at readp, muted or not (a muted one at gain 0)
+            for start, end in read_window(loop, self.ahead_rows):
+                self.touch(slots[0], start, end)
+                self.touch(slots[1], start, end)
+            if loop.is_recording:
+                #overdubs write both layers at writep, just behind readp
+                for start, end in loop_ranges(loop.writep + self.page_rows, self.ahead_rows, loop.length):
+                    self.touch(slots[0], start, end, write = True)
+                    self.touch(slots[1], start, end, write = True)
+
+    def write_behind(self):
+        '''
+        write_behind() writes the rows written since the last call back to the file, except those near a write pointer
+        '''
+        engine = self.engine
+        dirty = dirty_plane(engine.dirty_rows, DIRTY_DISK)
+        rows = np.flatnonzero(dirty)
+        if len(rows) == 0:
+            return
+        #leave the pages the callback is writing to for the next pass
+        busy = np.zeros([len(rows)], dtype = bool)
+        for loop in engine.loops:
+            if not loop.is_recording:
+                continue
+            position = loop.writep if loop.initialized else loop.length
+            for layer in (0, 1):
+                base = engine.track_base[layer * engine.tracks + loop.index]
+                busy |= (rows >= base + position - self.page_rows) & (rows <= base + position + self.page_rows)
+        rows = rows[~busy]
+        if len(rows) == 0:
+            return
+        dirty[rows] = 0
+        #runs of consecutive rows, written back one msync each
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        page = mmap.PAGESIZE
+        arena = engine.arena
+        for run in np.split(rows, breaks):
+            begin = arena.offset + int(run[0]) * self.row_bytes
+            end = arena.offset + (int(run[-1]) + 1) * self.row_bytes
+            begin -= begin % page
+            arena.map.flush(begin, end - begin)
+            self.flushed_bytes += end - begin
+
+    def report(self):
+        '''
+        report() returns a one-line summary of the paging work
+        '''
+        return f'Long loops: {self.touched_bytes // 2**20} MB paged ahead, {self.flushed_bytes // 2**20} MB written back'
@@ -0,0 +1,299 @@
+'''
+effects.py contains the per-track insert effects: a biquad EQ/filter, a feedback delay and a
+simple reverb, run by the mixer on every track that has them on, before its gain and pan.
+
+Every effect works on a whole CHUNK of all its tracks at once with preallocated state and
+scratch, so its cost per buffer depends only on the number of tracks it is on, never on the
+audio:
+- Biquad runs the filter recursion as a matrix product: for a sub-block of samples, the output
+  and the filter state after it are a fixed linear function of the input and the state before
+  it (exact, not an approximation of the IIR filter)
+- Delay and Reverb are built from delay lines at least a CHUNK long, so every sample of a
+  buffer reads the line from before the buffer and the whole buffer is one gather and one
+  scatter. Reverb is a Schroeder reverb: four parallel feedback combs and two allpasses
+
+EffectsChain measures each effect once at startup (a fixed cost plus a cost per track) and
+refuses to turn an effect on when the chain would then need more than budget of the callback
+deadline. Each effect also records what it took in the last callback (seconds).
+'''
+
+import time
+
+import numpy as np
+
+EFFECT_NAMES = ('EQ', 'DLY', 'REV') #in processing order, bit i of audioloop.effects is EFFECT_NAMES[i]
+EQ_TYPES = ('lowpass', 'highpass', 'bandpass', 'peak')
+
+#Schroeder reverb delay lines, stretched together when CHUNK is longer than the shortest
+COMB_MS = (29.7, 37.1, 41.1, 43.7)
+ALLPASS_MS = (12.7, 17.3)
+ALLPASS_GAIN = 0.7
+
+def biquad_coefficients(rate, kind, freq, q, gain_db = 0.0):
+    '''
+    biquad_coefficients() returns (b0, b1, b2, a1, a2) of an RBJ cookbook filter, normalized to a0 = 1
+    '''
+    w0 = 2 * np.pi * min(freq, 0.45 * rate) / rate
+    cos = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    a = 10 ** (gain_db / 40)
+    if kind == 'lowpass':
+        b, den = ((1 - cos) / 2, 1 - cos, (1 - cos) / 2), (1 + alpha, -2 * cos, 1 - alpha)
+    elif kind == 'highpass':
+        b, den = ((1 + cos) / 2, -(1 + cos), (1 + cos) / 2), (1 + alpha, -2 * cos, 1 - alpha)
+    elif kind == 'bandpass':
+        b, den = (alpha, 0.0, -alpha), (1 + alpha, -2 * cos, 1 - alpha)
+    elif kind == 'peak':
+        b, den = (1 + alpha * a, -2 * cos, 1 - alpha * a), (1 + alpha / a, -2 * cos, 1 - alpha / a)
+    else:
+        raise ValueError(f'unknown filter type {kind!r}')
+    return tuple(float(c / den[0]) for c in b + den[1:])
+
+def largest_divisor(n, limit):
+    '''
+    largest_divisor() returns the largest divisor of n up to limit
+    '''
+    return max(d for d in range(1, min(n, limit) + 1) if n % d == 0)
+
+class Biquad:
+    name = 'EQ'
+
+    def __init__(self, rate, chunk, tracks, kind = 'lowpass', freq = 1000.0, q = 0.707, gain_db = 0.0):
+        b0, b1, b2, a1, a2 = biquad_coefficients(rate, kind, freq, q, gain_db)
+        self.chunk = chunk
+        self.block = largest_divisor(chunk, 128) #samples per matrix product
+        block = self.block
+        #transposed direct form II, run symbolically over one sub-block: every quantity is a vector of
+        #coefficients of (the block's input samples, z1 and z2 before the block)
+        size = block + 2
+        y = np.zeros([block, size])
+        z1 = np.eye(size)[block]
+        z2 = np.eye(size)[block + 1]
+        for n in range(block):
+            x = np.eye(size)[n]
+            y[n] = b0 * x + z1
+            z1, z2 = b1 * x - a1 * y[n] + z2, b2 * x - a2 * y[n]
+        #[input, state] @ transfer = [output, state after]
+        self.transfer = np.ascontiguousarray(np.vstack((y, z1, z2)).T, dtype = np.float32)
+        self.state = np.zeros([tracks, 2], dtype = np.float32)
+        self.work = np.zeros([tracks, chunk], dtype = np.float32)
+        self.vector = np.zeros([tracks, size], dtype = np.float32)
+        self.result = np.zeros([tracks, size], dtype = np.float32)
+
+    def process(self, rows, active):
+        k = len(active)
+        block = self.block
+        work = self.work[:k]
+        vector = self.vector[:k]
+        result = self.result[:k]
+        np.take(rows, active, axis = 0, out = work)
+        vector[:, block:] = self.state[active]
+        for start in range(0, self.chunk, block):
+            vector[:, :block] = work[:, start:start + block]
+            np.dot(vector, self.transfer, out = result)
+            work[:, start:start + block] = result[:, :block]
+            vector[:, block:] = result[:, block:]
+        rows[active] = work
+        self.state[active] = vector[:, block:]
+
+    def reset(self, track):
+        self.state[track] = 0.0
+
+class DelayLine:
+    '''
+    DelayLine is one delay line per track, length samples (at least a CHUNK) long, all moving together
+    '''
+    def __init__(self, tracks, chunk, length):
+        if length < chunk:
+            raise ValueError('a delay line must be at least a buffer long')
+        self.chunk = chunk
+        self.length = length
+        self.ring = np.zeros([tracks * length], dtype = np.float32)
+        self.base = (np.arange(tracks) * length)[:, np.newaxis]
+        self.offsets = np.arange(chunk)
+        self.position = np.zeros([chunk], dtype = np.intp) #ring index of this buffer's samples
+        self.index = np.zeros([tracks, chunk], dtype = np.intp)
+        self.pos = 0
+
+    def read(self, active, out):
+        '''
+        read() writes the active tracks' samples from length samples ago into out, for write() to replace
+        '''
+        index = self.index[:len(active)]
+        np.add(self.offsets, self.pos, out = self.position)
+        np.remainder(self.position, self.length, out = self.position)
+        np.add(self.base[active], self.position, out = index)
+        np.take(self.ring, index, out = out)
+
+    def write(self, active, values):
+        '''
+        write() stores the active tracks' new samples where read() read and moves the line on by a buffer
+        '''
+        self.ring[self.index[:len(active)]] = values
+        self.pos = (self.pos + self.chunk) % self.length
+
+    def reset(self, track):
+        self.ring[track * self.length:(track + 1) * self.length] = 0.0
+
+class Delay:
+    name = 'DLY'
+
+    def __init__(self, rate, chunk, tracks, delay_ms = 375.0, feedback = 0.4, mix = 0.35):
+        self.line = DelayLine(tracks, chunk, max(chunk, round(delay_ms * rate / 1000)))
+        self.feedback = np.float32(feedback)
+        self.mix = np.float32(mix)
+        self.work = np.zeros([tracks, chunk], dtype = np.float32)
+        self.delayed = np.zeros([tracks, chunk], dtype = np.float32)
+        self.scratch = np.zeros([tracks, chunk], dtype = np.float32)
+
+    def process(self, rows, active):
+        k = len(active)
+        work, delayed, scratch = self.work[:k], self.delayed[:k], self.scratch[:k]
+        np.take(rows, active, axis = 0, out = work)
+        self.line.read(active, delayed)
+        #the line holds input plus feedback of what came out of it, the output is dry plus mix of the line
+        np.multiply(delayed, self.feedback, out = scratch)
+        scratch += work
+        self.line.write(active, scratch)
+        np.multiply(delayed, self.mix, out = scratch)
+        work += scratch
+        rows[active] = work
+
+    def reset(self, track):
+        self.line.reset(track)
+
+class Reverb:
+    name = 'REV'
+
+    def __init__(self, rate, chunk, tracks, decay = 0.8, mix = 0.25):
+        shortest = min(COMB_MS + ALLPASS_MS) * rate / 1000
+        scale = max(1.0, chunk / shortest) #a longer room rather than lines shorter than a buffer
+        self.combs = [DelayLine(tracks, chunk, max(chunk, round(ms * rate / 1000 * scale))) for ms in COMB_MS]
+        self.allpasses = [DelayLine(tracks, chunk, max(chunk, round(ms * rate / 1000 * scale))) for ms in ALLPASS_MS]
+        self.decay = np.float32(decay)
+        self.mix = np.float32(mix)
+        self.work = np.zeros([tracks, chunk], dtype = np.float32)
+        self.wet = np.zeros([tracks, chunk], dtype = np.float32)
+        self.delayed = np.zeros([tracks, chunk], dtype = np.float32)
+        self.scratch = np.zeros([tracks, chunk], dtype = np.float32)
+
+    def process(self, rows, active):
+        k = len(active)
+        work, wet, delayed, scratch = self.work[:k], self.wet[:k], self.delayed[:k], self.scratch[:k]
+        np.take(rows, active, axis = 0, out = work)
+        wet[:] = 0.0
+        #parallel combs: line = input + decay * line output, wet = sum of the line outputs
+        for comb in self.combs:
+            comb.read(active, delayed)
+            wet += delayed
+            np.multiply(delayed, self.decay, out = scratch)
+            scratch += work
+            comb.write(active, scratch)
+        wet *= np.float32(1 / len(self.combs))
+        #allpasses in series: v = wet + g * line output, wet = line output - g * v
+        for allpass in self.allpasses:
+            allpass.read(active, delayed)
+            np.multiply(delayed, ALLPASS_GAIN, out = scratch)
+            scratch += wet
+            allpass.write(active, scratch)
+            np.multiply(scratch, -ALLPASS_GAIN, out = wet)
+            wet += delayed
+        wet *= self.mix
+        work += wet
+        rows[active] = work
+
+    def reset(self, track):
+        for line in self.combs + self.allpasses:
+            line.reset(track)
+
+class EffectsChain:
+    def __init__(self, rate, chunk, tracks, budget = 0.25, eq_type = 'lowpass', eq_freq = 1000.0, eq_q = 0.707,
+                 eq_gain_db = 0.0, delay_ms = 375.0, delay_feedback = 0.4, delay_mix = 0.35, reverb_decay = 0.8,
+                 reverb_mix = 0.25):
+        self.tracks = tracks
+        self.budget = budget * chunk / rate #seconds per callback the enabled effects may take
+        self.effects = (Biquad(rate, chunk, tracks, eq_type, eq_freq, eq_q, eq_gain_db),
+                        Delay(rate, chunk, tracks, delay_ms, delay_feedback, delay_mix),
+                        Reverb(rate, chunk, tracks, reverb_decay, reverb_mix))
+        #tracks each effect is on, replaced as a whole by set() so the callback always sees a consistent array
+        self.active = [np.zeros([0], dtype = np.intp) for effect in self.effects]
+        for effect in self.effects:
+            effect.seconds = 0.0 #time taken in the last callback
+            effect.fixed_cost, effect.track_cost = self.calibrate(effect, rate, chunk)
+
+    def calibrate(self, effect, rate, chunk, repeats = 15):
+        '''
+        calibrate() times the effect on one track and on all tracks, returns (fixed, per track) seconds per callback
+        '''
+        rng = np.random.default_rng(0)
+        rows = (rng.standard_normal([self.tracks, chunk]) * 3000).astype(np.float32)
+        times = []
+        for count in (1, self.tracks):
+            active = np.arange(count)
+            runs = []
+            for i in range(repeats + 3):
+                start = time.perf_counter()
+                effect.process(rows, active)
+                runs.append(time.perf_counter() - start)
+            times.append(float(np.median(runs[3:])))
+        for track in range(self.tracks):
+            effect.reset(track)
+        if self.tracks == 1:
+            return 0.0, times[0]
+        track_cost = max(0.0, (times[1] - times[0]) / (self.tracks - 1))
+        return max(0.0, times[0] - track_cost), track_cost
+
+    def cost(self, counts):
+        '''
+        cost() returns the seconds per callback the chain needs with counts[i] tracks on effect i
+        '''
+        return sum(effect.fixed_cost + effect.track_cost * count for effect, count in zip(self.effects, counts) if count)
+
+    def set(self, track, name, enabled):
+        '''
+        set() turns an effect on or off for a track, refusing what would take the chain over budget
+        '''
+        if name not in EFFECT_NAMES:
+            raise ValueError(f'effect must be one of {", ".join(EFFECT_NAMES)}')
+        i = EFFECT_NAMES.index(name)
+        active = self.active[i]
+        if enabled == (track in active):
+            return
+        if not enabled:
+            self.active[i] = active[active != track]
+            return
+        counts = [len(tracks) for tracks in self.active]
+        counts[i] += 1
+        needed = self.cost(counts)
+        if needed > self.budget:
+            raise ValueError(f'{name} on track {track + 1} would take the effects to {1e3 * needed:.2f} ms per buffer, '
+                             f'over the budget of {1e3 * self.budget:.2f} ms')
+        self.effects[i].reset(track) #no tail from the last time it was on
+        self.active[i] = np.sort(np.append(active, track))
+
+    def mask(self, track):
+        '''
+        mask() returns the effects on for the track as bits, EFFECT_NAMES[i] = bit i
+        '''
+        return sum(1 << i for i, active in enumerate(self.active) if track in active)
+
+    def process(self, rows):
+        '''
+        process() runs every effect on its tracks' rows (float32 [track, sample]) in place (in the callback)
+        '''
+        for effect, active in zip(self.effects, self.active):
+            if len(active):
+                start = time.perf_counter()
+                effect.process(rows, active)
+                effect.seconds = time.perf_counter() - start
+            else:
+                effect.seconds = 0.0
+
+    def report(self):
+        '''
+        report() returns a one-line summary of the effects' costs and the budget
+        '''
+        costs = ', '.join(f'{effect.name} {1e3 * effect.fixed_cost:.3f} + {1e3 * effect.track_cost:.3f}/track'
+                          for effect in self.effects)
+        used = self.cost([len(active) for active in self.active])
+        return f'Track effects (ms per buffer): {costs}; {1e3 * used:.2f} of {1e3 * self.budget:.2f} ms budget in use'
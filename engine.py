@@ -0,0 +1,1112 @@
+'''
+engine.py contains the looper audio engine: the tracks (audioloop), the mixer and the
+per-buffer processing done in the audio callback.
+
+It has no GPIO, display or PyAudio dependencies, so it can also be driven headless
+(e.g. by the benchmarks).
+
+All loop audio lives in one contiguous arena (arena.py) of [MAXLENGTH, CHUNK] slots.
+engine.slot_of[layer, track] says which slot holds each track's main (layer 0) and dub
+(layer 1) audio; each audioloop works on views of its two slots. The remaining slots are
+spare: a background job (the time-stretch in stretch.py, file import in importer.py) fills
+spare slots and the callback swaps them in at a loop boundary by exchanging slot numbers,
+without copying audio.
+Scenes work the same way: every scene is a complete set of tracks in slots of its own, and
+switching scenes (at the master loop boundary) points slot_of and the tracks at another set,
+with a short crossfade from the scene being left.
+Every row written is flagged in engine.dirty, one byte per consumer, so the autosave
+(checkpoint.py) and the waveform overview (waveform.py) only have to look at what changed.
+Cold tracks may be kept compressed (coldstore.py): engine.resident says which blocks of rows
+are in memory, and code outside the callback reads loop audio through engine.read_rows().
+
+With auto-record (engine.auto_record, onset.py) armed tracks start at the first onset in the
+input, to the sample and with a short pre-roll, instead of at a button press or loop restart.
+The input always goes through a capture ring (capture.py, engine.capture) when there is one,
+so the last seconds played can be turned into a track after the fact.
+Tracks may have insert effects (effects.py, engine.effects), applied to their rows in the mixer
+before gain and pan.
+
+Output is mono or interleaved stereo (channels = 1 or 2). Every track has a gain and a pan;
+together with mute they give a target gain per output channel, and the mixer ramps the
+actual gains towards the targets over ramp_ms so that level changes and mutes are click-free.
+'''
+
+import contextlib
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from arena import Arena
+from effects import EFFECT_NAMES
+from meters import Meters
+
+SAMPLEMAX = 0.9 * (2**15) #maximum possible value for an audio sample (little bit of margin)
+CALLBACK_PEAK_DECAY = 0.99 #per callback, so a slow callback stays visible in telemetry for a second or so
+
+#engine.dirty flags, one byte each: each consumer of written rows clears its own by zeroing its byte (dirty_plane()),
+#a plain store that can't undo a flag the callback sets meanwhile, as clearing a bit (read, mask, write back) could
+DIRTY_CHECKPOINT = 1
+DIRTY_WAVEFORM = 1 << 8
+DIRTY_COLD = 1 << 16
+DIRTY_DISK = 1 << 24
+DIRTY_ALL = DIRTY_CHECKPOINT | DIRTY_WAVEFORM | DIRTY_COLD | DIRTY_DISK
+
+COLD_BLOCK_BYTES = 65536 #cold tracks are compressed and paged in in blocks of about this size (coldstore.py)
+
+def dirty_plane(dirty, flag):
+    '''
+    dirty_plane() returns the bytes of dirty (engine.dirty or a part of it) holding flag, as a uint8 view shaped like dirty:
+    non-zero where the flag is set, and zeroing them clears just that flag
+    '''
+    byte = (int(flag).bit_length() - 1) // 8
+    if sys.byteorder == 'big':
+        byte = dirty.itemsize - 1 - byte
+    return dirty.view(np.uint8).reshape(dirty.shape + (dirty.itemsize,))[..., byte]
+
+#playback modes: forward, reverse, half speed (spans two passes of the loop), double speed (two passes per loop)
+PLAYBACK_MODES = ('FWD', 'REV', 'HALF', 'DBL')
+
+#slots filled by a background job, swapped in by the callback. kind is
+#'replace': new audio for the track (dropped if the track was cleared meanwhile),
+#'fill': an empty track, which starts playing with the master loop,
+#'master': new master loop audio for track 1, LENGTH becomes length
+#scene is the one the swap was made for, it is dropped if another scene is playing by then
+Swap = namedtuple('Swap', ['loop', 'main_slot', 'dub_slot', 'length', 'content_length', 'kind', 'scene'])
+
+#audioloop attributes that make up a track's state (saved with a scene, and by the autosave)
+LOOP_FIELDS = ('initialized', 'length_factor', 'length', 'rows_used', 'readp', 'writep', 'is_playing',
+               'last_buffer_recorded', 'content_length', 'dub_ratio', 'gain', 'pan', 'feedback', 'sos', 'mode', 'play_phase')
+
+class audioloop:
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+        self.initialized = False
+        self.length_factor = 1
+        self.length = 0
+        #self.main_audio and self.dub_audio contain audio data in arrays of CHUNKs (views into the arena slots, see bind()).
+        #self.dub_audio contains the latest recorded dub. Clearing this achieves undo.
+        self.bind()
+        self.rows_used = 0 #number of rows that may hold audio, so clearing doesn't touch the whole track
+        self.content_length = 0 #rows of recorded audio, before quantization or TRIM (what a time-stretch fits to length)
+        self.readp = 0
+        self.writep = 0
+        self.is_recording = False
+        self.is_playing = False
+        self.is_waiting = False
+        self.last_buffer_recorded = 0 #index of last buffer added
+        self.preceding_buffer = np.zeros([engine.chunk], dtype = np.int16)
+        """
+        Dub ratio must be reduced with each overdub to keep all overdubs at the same level while preventing clipping.
+        first overdub is attenuated by a factor of 0.9, second by 0.81, etc.
+        each time the existing audio is attenuated by a factor of 0.9.
+        """
+        self.dub_ratio = 1.0
+        #feedback: existing audio is multiplied by this at every overdubbed row (0.9 = the classic decay).
+        #In sound-on-sound mode (sos) the new layer always goes in at full level and old layers fade
+        #by feedback on every pass instead, so an overdub can run forever without clipping.
+        self.feedback = engine.feedback
+        self.sos = False
+        self.mode = 'FWD' #playback mode, see PLAYBACK_MODES
+        self.play_phase = 1 #toggled at the start of every pass, half speed plays the first half of the loop on phase 0
+        self.gain = 1.0 #track level, 0.0 to 2.0
+        self.effects = 0 #insert effects on the track, bit i = effects.EFFECT_NAMES[i] (see set_effect())
+        self.cold = False #True while some of the track's blocks are compressed (coldstore.py): it can't start recording
+        self.pan = 0.0 #-1.0 (left) to 1.0 (right), ignored for mono output
+        self.channel_gains = np.zeros([engine.channels], dtype = np.float32)
+        self.update_channel_gains()
+
+    def bind(self):
+        '''
+        bind() points main_audio and dub_audio (and their dirty flags) at the track's slots in engine.slot_of
+        '''
+        engine = self.engine
+        self.main_audio = engine.arena.slots[engine.slot_of[0, self.index]]
+        self.dub_audio = engine.arena.slots[engine.slot_of[1, self.index]]
+        self.main_dirty = engine.dirty[engine.slot_of[0, self.index]]
+        self.dub_dirty = engine.dirty[engine.slot_of[1, self.index]]
+
+    def update_channel_gains(self):
+        '''
+        update_channel_gains() recomputes the per-channel gain from gain and pan (constant power pan law)
+        '''
+        if self.engine.channels == 1:
+            self.channel_gains[0] = self.gain
+        else:
+            angle = (self.pan + 1) * np.pi / 4
+            self.channel_gains[0] = self.gain * np.cos(angle)
+            self.channel_gains[1] = self.gain * np.sin(angle)
+
+    def set_gain(self, gain):
+        self.gain = float(np.clip(gain, 0.0, 2.0))
+        self.update_channel_gains()
+
+    def set_pan(self, pan):
+        self.pan = float(np.clip(pan, -1.0, 1.0))
+        self.update_channel_gains()
+
+    def set_feedback(self, feedback):
+        self.feedback = float(np.clip(feedback, 0.0, 1.0))
+
+    def set_effect(self, name, enabled):
+        '''
+        set_effect() turns one of the track's insert effects on or off, raises ValueError if it would exceed the effects budget
+        '''
+        if not self.engine.effects:
+            raise ValueError('effects are not enabled')
+        self.engine.effects.set(self.index, name, enabled)
+        self.effects = self.engine.effects.mask(self.index)
+
+    def set_mode(self, mode):
+        '''
+        set_mode() sets the playback mode, half and double speed need an even CHUNK
+        '''
+        if mode not in PLAYBACK_MODES:
+            raise ValueError(f'unknown playback mode {mode!r}')
+        if mode in ('HALF', 'DBL') and self.engine.chunk % 2:
+            print(f'{mode} needs an even CHUNK')
+            return
+        self.mode = mode
+
+    def set_sos(self, enabled):
+        '''
+        set_sos() turns sound-on-sound mode on or off
+
+        turning it on arms a continuous overdub (starting at the next master loop restart), turning it off stops it
+        '''
+        self.sos = enabled
+        if enabled:
+            if self.initialized and not self.is_recording:
+                self.is_waiting = True
+        else:
+            self.is_recording = False
+            self.is_waiting = False
+
+    def increment_pointers(self):
+        '''
+        increment_pointers() increments pointers and, when restarting while recording, advances dub ratio
+        '''
+        if self.readp == self.length - 1:
+            self.readp = 0
+            if self.is_recording and not self.sos:
+                self.dub_ratio = self.dub_ratio * self.feedback
+                print(self.dub_ratio)
+        else:
+            self.readp = self.readp + 1
+        self.writep = (self.writep + 1) % self.length
+
+    def initialize(self):
+        '''
+        initialize() raises self.length to closest integer multiple of LENGTH and initializes read and write pointers
+        '''
+        print('initialize called')
+        if self.initialized:
+            print('redundant initialization')
+            return
+        self.writep = self.length - 1
+        self.last_buffer_recorded = self.writep
+        self.content_length = self.length
+        self.length_factor = (int((self.length - self.engine.overshoot) / self.engine.length) + 1)
+        self.length = self.length_factor * self.engine.length
+        self.rows_used = max(self.rows_used, self.length)
+        print('length ' + str(self.length))
+        print('last buffer recorded ' + str(self.last_buffer_recorded))
+        #crossfade
+        fade_out(self.main_audio[self.last_buffer_recorded], self.engine.down_ramp) #fade out the last recorded buffer
+        preceding_buffer_copy = np.copy(self.preceding_buffer)
+        fade_in(preceding_buffer_copy, self.engine.up_ramp)
+        self.main_audio[self.length - 1, :] += preceding_buffer_copy[:]
+        self.main_dirty[self.last_buffer_recorded] = DIRTY_ALL
+        self.main_dirty[self.length - 1] = DIRTY_ALL
+        #audio should be written ahead of where it is being read from, to compensate for input+output latency
+        self.readp = (self.writep + self.engine.latency) % self.length
+        self.initialized = True
+        self.is_playing = True
+        self.increment_pointers()
+
+    def add_buffer(self, data):
+        '''
+        add_buffer() appends a new buffer unless loop is filled to MAXLENGTH
+        expected to only be called before initialization
+        '''
+        if self.length >= (self.engine.maxlength - 1):
+            self.length = 0
+            print('loop full')
+            return
+        self.main_audio[self.length, :] = data
+        self.main_dirty[self.length] = DIRTY_ALL
+        self.length = self.length + 1
+        self.rows_used = max(self.rows_used, self.length)
+
+    def toggle_mute(self):
+        '''
+        toggle_mute() mutes or unmutes the loop, the mixer fades it out or in over ramp_ms
+        '''
+        if self.is_playing:
+            self.is_playing = False
+        else:
+            self.is_playing = True
+
+    def is_restarting(self):
+        if not self.initialized:
+            return False
+        if self.readp == 0:
+            return True
+        return False
+
+    def advance(self):
+        '''
+        advance() returns the row the loop is currently playing and increments pointers
+
+        returns -1 if the loop is not initialized
+        '''
+        if not self.initialized:
+            return -1
+        tmp = self.readp
+        if tmp == 0:
+            self.play_phase ^= 1
+        self.increment_pointers()
+        return tmp
+
+    def resident(self, row):
+        '''
+        resident() says if the audio at loop position row is in memory (always, unless the track is cold)
+        '''
+        if not self.cold:
+            return True
+        engine = self.engine
+        #the cold store pages in both layers of a block before marking the main one resident
+        return self.mode == 'FWD' and engine.resident[engine.slot_of[0, self.index], row // engine.block_rows]
+
+    def read_mode(self, row, out):
+        '''
+        read_mode() writes the buffer heard at loop position row in the track's playback mode into out (float32 [CHUNK])
+
+        every mode reads strided or reversed views of the loop rows, so it costs about the same as forward playback
+        the position stays locked to the loop: reverse plays row length - 1 - row, double speed plays rows 2 * row
+        and 2 * row + 1 at every other sample, half speed plays half a row per buffer with every sample held twice
+        '''
+        main = self.main_audio
+        dub = self.dub_audio
+        half = self.engine.chunk // 2
+        if self.mode == 'REV':
+            row = self.length - 1 - row
+            np.add(main[row, ::-1], dub[row, ::-1], out = out, dtype = np.float32)
+        elif self.mode == 'DBL':
+            first = (2 * row) % self.length
+            second = (first + 1) % self.length
+            np.add(main[first, ::2], dub[first, ::2], out = out[:half], dtype = np.float32)
+            np.add(main[second, ::2], dub[second, ::2], out = out[half:], dtype = np.float32)
+        elif self.mode == 'HALF':
+            position = row + self.length * self.play_phase
+            row = position // 2
+            start = (position % 2) * half
+            np.add(main[row, start:start + half, None], dub[row, start:start + half, None], out = out.reshape(half, 2), dtype = np.float32)
+
+    def read(self):
+        '''
+        read() reads and returns a buffer of audio from the loop
+
+        if not initialized: Do nothing
+        if initialized but muted: Just increment pointers
+        if initialized and playing: Read audio from the loop and increment pointers
+
+        the mixer does not use read(), it gathers all tracks at once (see engine.mix())
+        '''
+        row = self.advance()
+        if row < 0 or not self.is_playing:
+            return(self.engine.silence)
+        return(self.main_audio[row, :] + self.dub_audio[row, :])
+
+    def dub(self, data, fade_in = False, fade_out = False):
+        '''
+        dub() overdubs an incoming buffer of audio to the loop at writep
+
+        at writep:
+        first, the buffer from dub_audio is mixed into main_audio
+        next, the buffer in dub_audio is overwritten with the incoming buffer
+
+        the callback dubs all recording tracks at once with engine.dub()
+        '''
+        if not self.initialized:
+            return
+        self.engine.dub((self,), data)
+
+    def reset(self):
+        '''
+        reset() gives the track the state of a new, empty track (for a new scene, the audio is left alone)
+        '''
+        self.initialized = False
+        self.is_playing = False
+        self.is_recording = False
+        self.is_waiting = False
+        self.rows_used = 0
+        self.content_length = 0
+        self.length_factor = 1
+        self.length = 0
+        self.readp = 0
+        self.writep = 0
+        self.last_buffer_recorded = 0
+        self.dub_ratio = 1.0
+        self.feedback = self.engine.feedback
+        self.sos = False
+        self.mode = 'FWD'
+        self.play_phase = 1
+        self.gain = 1.0
+        self.pan = 0.0
+
+    def clear(self):
+        '''
+        clear() clears the loop so that a new loop of the same or a different length can be recorded on the track
+        '''
+        self.initialized = False
+        self.is_playing = False
+        self.is_recording = False
+        self.is_waiting = False
+        self.sos = False
+        self.main_audio[:self.rows_used] = 0
+        self.dub_audio[:self.rows_used] = 0
+        self.main_dirty[:self.rows_used] = DIRTY_ALL
+        self.dub_dirty[:self.rows_used] = DIRTY_ALL
+        self.rows_used = 0
+        self.content_length = 0
+        self.length_factor = 1
+        self.length = 0
+        self.readp = 0
+        self.writep = 0
+        self.last_buffer_recorded = 0
+        self.preceding_buffer = np.zeros([self.engine.chunk], dtype = np.int16)
+
+    def undo(self):
+        '''
+        undo() resets dub_audio to silence
+        '''
+        self.dub_audio[:self.rows_used] = 0
+        self.dub_dirty[:self.rows_used] = DIRTY_ALL
+        self.is_recording = False
+        self.is_waiting = False
+
+    def clear_or_undo(self):
+        '''
+        clear if muted, undo if playing.
+        '''
+        if self.is_playing:
+            self.undo()
+        else:
+            self.clear()
+
+    def start_recording(self, previous_buffer):
+        self.is_recording = True
+        self.is_waiting = False
+        self.preceding_buffer = np.copy(previous_buffer)
+
+    def set_recording(self):
+        '''
+        set_recording() either starts or stops recording
+
+        if initialized and recording, stop recording (dubbing)
+        if uninitialized and recording, stop recording (appending) and initialize
+        if initialized and not recording, set as "waiting to record"
+        '''
+        print('set_recording called')
+        already_recording = False
+
+        #if chosen track is currently recording, flag it
+        if self.is_recording:
+            already_recording = True
+
+        #turn off recording
+        if self.is_recording and not self.initialized:
+            self.initialize()
+        self.is_recording = False
+        self.is_waiting = False
+
+        #unless flagged, schedule recording. If chosen track was recording, then stop recording
+        #like a toggle but with delayed enabling and instant disabling
+        if not already_recording:
+            self.is_waiting = True
+
+def fade_in(buffer, up_ramp):
+    '''
+    fade_in() applies fade-in to a buffer
+    '''
+    np.multiply(buffer, up_ramp, out = buffer, casting = 'unsafe')
+
+def fade_out(buffer, down_ramp):
+    '''
+    fade_out() applies fade-out to a buffer
+    '''
+    np.multiply(buffer, down_ramp, out = buffer, casting = 'unsafe')
+
+class LooperEngine:
+    '''
+    LooperEngine owns the loop storage, the tracks and the mixer.
+    process() is called once per audio buffer from the stream callback.
+    '''
+    def __init__(self, rate, chunk, tracks, maxlength, latency, overshoot, channels = 1, ramp_ms = 10, limiter = None,
+                 input_shift = 2, monitor_gain = 0.0, hugepages = True, feedback = 0.9, spare_slots = 2, arena_path = None,
+                 scenes = 1, effects = None, onset = None, capture = None):
+        self.rate = rate
+        self.chunk = chunk
+        self.channels = channels #1 = mono, 2 = interleaved stereo (input is mixed down to mono)
+        self.tracks = tracks
+        self.maxlength = maxlength
+        #the limiter delays everything played by its look-ahead, so recordings have to be moved back by it too:
+        #whole buffers go into latency (in buffers), the rest delays the recorded input by input_delay samples
+        lookahead = limiter.lookahead if limiter else 0
+        self.latency = latency + -(-lookahead // chunk)
+        self.input_delay = -lookahead % chunk
+        self.delay_line = np.zeros([2 * chunk], dtype = np.int16) #the last two input buffers, for input_delay
+        self.overshoot = overshoot #allowance in buffers for pressing 'stop recording' late
+        self.length = 0 #length of the first recording on track 1, all subsequent recordings quantized to a multiple of this.
+
+        self.silence = np.zeros([chunk], dtype = np.int16) #a buffer containing silence
+        self.setup_mix = np.zeros([channels, chunk], dtype = np.float32) #empty mix played while the first loop is recorded
+        self.input_shift = input_shift #recorded input is shifted right by this many bits for overdub headroom
+        self.monitor_gain = monitor_gain #gain of the direct input monitor in the output, 0 = off
+        self.feedback = feedback #initial overdub feedback of every track
+        #multiplying by up_ramp and down_ramp gives fade-in and fade-out
+        self.down_ramp = np.linspace(1, 0, chunk)
+        self.up_ramp = np.linspace(0, 1, chunk)
+
+        #one contiguous arena for all loop audio: a slot per scene, track and layer, plus spare slots for background jobs
+        #call arena.prefault() before starting the stream to keep first-touch page faults out of the callback
+        #(or, with arena_path, map the arena from that file and keep the pages in use resident with diskstore.py)
+        self.slot_count = 2 * tracks * scenes + spare_slots
+        self.arena = Arena(self.slot_count, maxlength, chunk, hugepages = hugepages, path = arena_path)
+        self.diskstore = None #the DiskStore streaming a file-backed arena, set by build_engine (audioprocess.py)
+        #the same storage seen as a flat list of rows, for gathering one row per track in a single np.take
+        self.rows = self.arena.rows
+        #slot holding each [scene, main/dub, track]; slot_of is the playing scene's [main/dub, track], and the slots not in use
+        self.scene_slots = np.arange(2 * tracks * scenes).reshape(scenes, 2, tracks)
+        self.slot_of = self.scene_slots[0]
+        self.spare_slots = list(range(2 * tracks * scenes, 2 * tracks * scenes + spare_slots))
+        self.scene = 0 #the playing scene
+        self.scene_states = [None] * scenes #LOOP_FIELDS of every track of the scenes not playing, None for the playing scene and scenes never played
+        self.pending_scene = None #scene to switch to at the next master loop boundary
+        self.pending_swap = None #Swap to make at the loop's next boundary
+        self.spare_lock = threading.Lock() #held by a background job from taking the spare slots until its swap is requested
+        #rows written since each consumer last looked (DIRTY_* flags), per slot
+        self.dirty = np.zeros([self.slot_count, maxlength], dtype = np.uint32)
+        #first row of each track's main/dub layer in self.rows
+        self.track_base = self.slot_of.reshape(-1) * maxlength
+        #defining the audio loops. loops[0] is the master loop.
+        self.loops = tuple(audioloop(self, i) for i in range(tracks))
+
+        #mixer scratch, preallocated so the callback doesn't allocate per track
+        self.row_index = np.zeros([2 * tracks], dtype = np.intp)
+        self.mix_rows = np.zeros([2 * tracks, chunk], dtype = np.int16)
+        self.track_rows = np.zeros([tracks, chunk], dtype = np.float32) #main + dub per track
+        #dub scratch: main rows of the dubbing tracks followed by their dub rows (only the first 2 * dubbing entries are used)
+        self.dub_index = np.zeros([2 * tracks], dtype = np.intp)
+        self.dub_weights = np.zeros([2 * tracks, 1], dtype = np.float32) #feedback for main rows, dub_ratio (1 in sos mode) for dub rows
+        self.dub_rows = np.zeros([2 * tracks, chunk], dtype = np.int16)
+        self.dub_scaled = np.zeros([2 * tracks, chunk], dtype = np.float32)
+        self.dirty_rows = self.dirty.reshape(-1) #dirty flags indexed like self.rows
+        #blocks of rows in memory, per slot: only cold tracks have released blocks (see coldstore.py, set as cold_store)
+        self.block_rows = max(1, COLD_BLOCK_BYTES // (2 * chunk))
+        self.resident = np.ones([self.slot_count, -(-maxlength // self.block_rows)], dtype = bool)
+        self.cold_store = None
+        #gain ramps: current_gain moves towards target_gain by at most ramp_step per callback,
+        #linearly across the buffer (ramp_shape goes from 1/chunk to 1)
+        self.current_gain = np.zeros([tracks, channels], dtype = np.float32)
+        self.target_gain = np.zeros([tracks, channels], dtype = np.float32)
+        self.gain_delta = np.zeros([tracks, channels], dtype = np.float32)
+        self.ramp_step = min(1.0, chunk / max(1.0, ramp_ms * rate / 1000))
+        self.ramp_shape = (np.arange(1, chunk + 1) / chunk).astype(np.float32)
+        #crossfade after a scene switch: the scene left keeps playing from its own positions, fading out as the new one fades in
+        self.fade_callbacks = int(np.ceil(1 / self.ramp_step))
+        self.fade_left = 0 #callbacks of the fade-out still to go
+        self.fade_base = np.zeros([2 * tracks], dtype = np.intp) #track_base of the scene left
+        self.fade_pos = np.zeros([tracks], dtype = np.intp) #its next row per track
+        self.fade_length = np.zeros([tracks], dtype = np.intp) #its loop lengths (0 = empty)
+        self.fade_gain = np.zeros([tracks, channels], dtype = np.float32) #its gains when it was left
+        self.fade_index = np.zeros([2 * tracks], dtype = np.intp)
+
+        #mixed output (sum of audio from tracks) is multiplied by output_volume before being played.
+        #Without a limiter this is updated by update_volume() as max peak in resultant audio changes
+        self.output_volume = np.float16(1.0)
+        #optional master bus limiter (see limiter.py), keeps loud overdubs from clipping
+        self.limiter = limiter
+        #optional per-track insert effects (see effects.py), turned on per track with audioloop.set_effect()
+        self.effects = effects
+        #input, track and master levels, published once per callback (see meters.py)
+        self.meters = Meters(tracks, chunk)
+
+        #auto-record: armed tracks start at the first onset found by the detector (see onset.py and punch_in())
+        self.onset = onset
+        self.auto_record = False
+        self.setup_armed = False #the first recording waits for an onset
+        self.setup_delay = 0 #samples the first recording lags the input by, so that its first row starts at the onset
+        self.setup_skip = False #the first row of the first recording completes in the next buffer
+        #retrospective looping: every input buffer is recorded into the capture ring (see capture.py)
+        self.capture = capture
+
+        self.click_enabled = False
+        self.click_track = make_click_track(rate, chunk)
+
+        #while looping, prev_rec_buffer keeps track of the audio buffer recorded before the current one
+        self.prev_rec_buffer = np.zeros([chunk], dtype = np.int16)
+        self.play_buffer = np.zeros([chunk * channels], dtype = np.int16) #buffer to hold mixed audio from all tracks
+        self.play_frames = self.play_buffer.reshape(chunk, channels) #the same buffer as [sample, channel]
+
+        self.setup_is_recording = False #set to True when track 1 recording button is first pressed
+        self.setup_donerecording = False #set to true when first track 1 recording is done
+        self.master_row = -1 #master loop row in the buffer process() returned last, -1 while there is no loop
+
+        #callback timing, for telemetry: processing time of the last buffer, decaying peak,
+        #and how often processing alone took longer than a buffer lasts
+        self.deadline = chunk / rate
+        self.callback_count = 0
+        self.callback_seconds = 0.0
+        self.callback_peak_seconds = 0.0
+        self.callback_overruns = 0
+
+    def mix(self):
+        '''
+        mix() reads one buffer from every track and returns their weighted sum
+        as a float32 [channel, sample] array (before output_volume)
+
+        all tracks are gathered with a single np.take, muted and empty tracks simply get a gain of zero,
+        so the cost per track stays flat. While gains are ramping, the gain envelope of each track is
+        current + delta * ramp_shape, so the mix is current . rows + (delta . rows) * ramp_shape:
+        one extra dot product instead of a multiply per track and sample.
+        Insert effects run on the rows of their tracks before the gains.
+        '''
+        tracks = self.tracks
+        moded = [] #tracks playing in a mode other than forward, as (track, row)
+        for i, loop in enumerate(self.loops):
+            row = loop.advance()
+            if i == 0:
+                self.master_row = row
+            if row >= 0 and loop.mode != 'FWD':
+                moded.append((i, row))
+            if row < 0:
+                self.row_index[i] = 0
+                self.target_gain[i] = 0.0
+                self.current_gain[i] = 0.0 #nothing to fade out
+            elif loop.cold and not loop.resident(row):
+                #cold track whose block isn't back in memory yet: silent until the cold store pages it in
+                self.row_index[i] = row
+                self.target_gain[i] = 0.0
+                self.current_gain[i] = 0.0
+            else:
+                self.row_index[i] = row
+                if loop.is_playing:
+                    self.target_gain[i] = loop.channel_gains
+                else:
+                    self.target_gain[i] = 0.0
+        self.row_index[tracks:] = self.row_index[:tracks]
+        np.add(self.row_index, self.track_base, out = self.row_index)
+        np.take(self.rows, self.row_index, axis = 0, out = self.mix_rows)
+        np.add(self.mix_rows[:tracks], self.mix_rows[tracks:], out = self.track_rows, dtype = np.float32)
+        if moded:
+            for i, row in moded:
+                self.loops[i].read_mode(row, self.track_rows[i])
+        if self.effects:
+            self.effects.process(self.track_rows)
+
+        mixed = np.dot(self.current_gain.T, self.track_rows)
+        np.subtract(self.target_gain, self.current_gain, out = self.gain_delta)
+        if self.gain_delta.any():
+            np.clip(self.gain_delta, -self.ramp_step, self.ramp_step, out = self.gain_delta)
+            mixed += np.dot(self.gain_delta.T, self.track_rows) * self.ramp_shape
+            self.current_gain += self.gain_delta
+        if self.fade_left:
+            self.mix_fade(mixed)
+        return mixed
+
+    def mix_fade(self, mixed):
+        '''
+        mix_fade() adds the next buffer of the scene being faded out after a scene switch to mixed
+
+        it plays forward whatever the tracks' modes were, the fade lasts only ramp_ms
+        '''
+        tracks = self.tracks
+        for i in range(tracks):
+            row = self.fade_pos[i] % self.fade_length[i] if self.fade_length[i] else 0
+            self.fade_index[i] = self.fade_base[i] + row
+            self.fade_index[tracks + i] = self.fade_base[tracks + i] + row
+            self.fade_pos[i] += 1
+        #the scratch rows of mix() are free again
+        np.take(self.rows, self.fade_index, axis = 0, out = self.mix_rows)
+        np.add(self.mix_rows[:tracks], self.mix_rows[tracks:], out = self.track_rows, dtype = np.float32)
+        envelope = (self.fade_left - self.ramp_shape) / self.fade_callbacks
+        mixed += np.dot(self.fade_gain.T, self.track_rows) * envelope
+        self.fade_left -= 1
+
+    @property
+    def effect_seconds(self):
+        '''
+        effect_seconds is the time each insert effect took in the last callback, in EFFECT_NAMES order
+        '''
+        if not self.effects:
+            return [0.0] * len(EFFECT_NAMES)
+        return [effect.seconds for effect in self.effects.effects]
+
+    def select_scene(self, scene):
+        '''
+        select_scene() switches to another scene at the next master loop boundary (right away if there is no master loop)
+        '''
+        if not 0 <= scene < len(self.scene_states):
+            raise ValueError(f'scene must be 1 to {len(self.scene_states)}')
+        if not self.setup_donerecording:
+            raise ValueError('record the first loop before switching scenes')
+        self.pending_scene = None if scene == self.scene else scene
+
+    def switch_scene(self):
+        '''
+        switch_scene() makes pending_scene the playing scene: saves the track state, points the tracks at the
+        scene's slots and loads its state, starting the fade-out of the scene left (called in the callback)
+
+        no audio is copied: the cost depends on the number of tracks only
+        '''
+        scene = self.pending_scene
+        self.pending_scene = None
+        for i, loop in enumerate(self.loops):
+            if loop.is_recording and not loop.initialized:
+                loop.initialize()
+            loop.is_recording = False
+            loop.is_waiting = False
+            self.fade_pos[i] = loop.readp
+            self.fade_length[i] = loop.length if loop.initialized else 0
+        self.fade_base[:] = self.track_base
+        self.fade_gain[:] = self.current_gain
+        self.fade_left = self.fade_callbacks
+        self.scene_states[self.scene] = [{field: getattr(loop, field) for field in LOOP_FIELDS} for loop in self.loops]
+
+        self.scene = scene
+        self.slot_of = self.scene_slots[scene]
+        self.track_base[:] = self.slot_of.reshape(-1) * self.maxlength
+        state = self.scene_states[scene]
+        for loop in self.loops:
+            loop.bind()
+            if state:
+                for field in LOOP_FIELDS:
+                    setattr(loop, field, state[loop.index][field])
+            else:
+                loop.reset()
+            loop.update_channel_gains()
+            if loop.initialized:
+                #every scene starts from the top of its loops, at the current LENGTH (TRIM applies to all scenes)
+                loop.length = min(self.maxlength, loop.length_factor * self.length)
+                loop.readp = 0
+                loop.writep = -self.latency % loop.length
+                loop.play_phase = 1
+        if not state:
+            #a new scene gets a silent master loop, to keep time and to overdub track 1 on
+            master = self.loops[0]
+            master.length = master.rows_used = master.content_length = self.length
+            master.initialized = True
+            master.is_playing = True
+            master.writep = -self.latency % self.length
+        #all tracks fade in from silence
+        self.current_gain[:] = 0.0
+        self.scene_states[scene] = None
+        print(f'Scene {scene + 1}')
+
+    def dub(self, dubbing, data, back = 0):
+        '''
+        dub() overdubs one buffer of input on every track in dubbing, in a single vectorized pass
+
+        for each track, at its writep (or back rows before it): main = main * feedback + dub * dub_ratio (1 in sos mode), then dub = data
+        (float32 math in preallocated scratch, truncated back to int16 like the per-track version)
+
+        feedback is applied row by row as the overdub passes, so there is never a whole-loop rescaling pass.
+        One or two overdubs (the common case) work on each track's rows directly: the gather and scatter only
+        pay off from three overdubs on (benchmarks/bench_dub.py)
+        '''
+        if len(dubbing) < 3:
+            for loop in dubbing:
+                self.dub_one(loop, data, back)
+        else:
+            self.dub_many(dubbing, data, back)
+
+    def dub_many(self, dubbing, data, back = 0):
+        '''
+        dub_many() is dub() for several tracks: one gather of their main and dub rows, weighted, one scatter
+        '''
+        count = len(dubbing)
+        index = self.dub_index[:2 * count]
+        weights = self.dub_weights[:2 * count]
+        for i, loop in enumerate(dubbing):
+            position = (loop.writep - back) % loop.length
+            index[i] = self.track_base[loop.index] + position
+            index[count + i] = self.track_base[self.tracks + loop.index] + position
+            weights[i] = loop.feedback
+            weights[count + i] = 1.0 if loop.sos else loop.dub_ratio
+        rows = self.dub_rows[:2 * count]
+        np.take(self.rows, index, axis = 0, out = rows)
+        scaled = self.dub_scaled[:2 * count]
+        np.multiply(rows, weights, out = scaled)
+        np.add(scaled[:count], scaled[count:], out = scaled[:count])
+        np.copyto(rows[:count], scaled[:count], casting = 'unsafe')
+        rows[count:] = data
+        self.rows[index] = rows
+        self.dirty_rows[index] = DIRTY_ALL
+
+    def dub_one(self, loop, data, back = 0):
+        '''
+        dub_one() is dub() for a single track, the same float32 math on the track's own rows
+        '''
+        position = (loop.writep - back) % loop.length
+        main = loop.main_audio[position]
+        scaled, dubbed = self.dub_scaled[0], self.dub_scaled[1]
+        np.multiply(main, np.float32(loop.feedback), out = scaled)
+        np.multiply(loop.dub_audio[position], np.float32(1.0 if loop.sos else loop.dub_ratio), out = dubbed)
+        np.add(scaled, dubbed, out = scaled)
+        np.copyto(main, scaled, casting = 'unsafe')
+        loop.dub_audio[position] = data
+        loop.main_dirty[position] = DIRTY_ALL
+        loop.dub_dirty[position] = DIRTY_ALL
+
+    def start_first_recording(self):
+        '''
+        start_first_recording() starts recording the master loop on track 1 (with auto-record: at the first onset)
+        '''
+        if self.auto_record and self.onset:
+            self.setup_armed = True
+            return
+        self.setup_delay = 0
+        self.setup_is_recording = True
+        self.loops[0].start_recording(self.prev_rec_buffer)
+
+    def start_first_at(self, onset):
+        '''
+        start_first_at() starts the first recording at sample onset of the current buffer, pre-roll included (in the callback)
+
+        the recording lags the input by a constant setup_delay (less than the pre-roll plus a buffer) so that its
+        rows start at the first pre-roll sample: the master loop starts exactly there, whatever the buffer boundaries
+        '''
+        chunk = self.chunk
+        lag = self.onset.preroll - onset #samples of this buffer after the first one recorded, negative if it starts later
+        self.setup_delay = lag if lag >= 0 else lag + chunk
+        self.setup_skip = lag < 0
+        self.setup_armed = False
+        self.setup_is_recording = True
+        self.loops[0].start_recording(self.onset.history.delayed(lag + chunk))
+        print(f'Onset: recording from {self.onset.preroll} samples before sample {onset}')
+
+    def punch_in(self, loop, onset):
+        '''
+        punch_in() starts recording on an armed track at sample onset of the current buffer, pre-roll included
+        (in the callback)
+
+        an overdub writes the pre-roll into the rows it just passed; a new track is appended from the master loop's
+        current row, silent before the onset, so it stays aligned as if it had started at the loop restart
+        '''
+        chunk = self.chunk
+        start = onset - self.onset.preroll #offset of the first sample recorded into the current buffer
+        back = -(start // chunk) if start < 0 else 0 #earlier buffers the pre-roll reaches into
+        loop.start_recording(self.onset.history.delayed((back + 1) * chunk))
+        if loop.initialized:
+            for j in range(back, -1, -1):
+                self.dub((loop,), self.onset.from_onset(j, start), back = j)
+            return
+        master = self.loops[0]
+        position = master.readp if master.initialized and loop is not master else back
+        first = max(0, position - back)
+        #rows before the onset are silence, like a recording started at the restart with nothing played yet
+        used = min(first, loop.rows_used)
+        loop.main_audio[:used] = 0
+        loop.main_dirty[:used] = DIRTY_ALL
+        loop.length = first
+        for j in range(back, -1, -1):
+            if position - j >= 0:
+                loop.add_buffer(self.onset.from_onset(j, start))
+
+    def finish_captured_first(self, rows):
+        '''
+        finish_captured_first() makes the rows captured into track 1 (see capture.py) the master loop, setting LENGTH
+        '''
+        loop = self.loops[0]
+        loop.length = self.length = rows
+        loop.rows_used = max(loop.rows_used, loop.length)
+        self.setup_armed = False
+        self.setup_is_recording = False
+        loop.initialize()
+        self.setup_donerecording = True
+
+    def cancel_first_recording(self):
+        '''
+        cancel_first_recording() drops the first recording (started or armed), track 1 is empty again
+        '''
+        self.setup_armed = False
+        self.setup_is_recording = False
+        self.loops[0].is_recording = False
+        self.loops[0].length = 0
+        self.length = 0
+
+    def finish_first_recording(self):
+        '''
+        finish_first_recording() stops recording the master loop and sets the loop length from it
+        '''
+        self.setup_armed = False
+        self.setup_is_recording = False
+        self.setup_donerecording = True
+        self.loops[0].initialize()
+        self.loops[0].set_recording()
+
+    def read_rows(self, index):
+        '''
+        read_rows() returns a copy of the rows at index (into self.rows), with the blocks of cold tracks
+        that are not in memory decompressed
+
+        for readers of loop audio outside the callback (autosave, waveform, time-stretch)
+        '''
+        if self.cold_store:
+            return self.cold_store.read_rows(index)
+        return self.rows[index]
+
+    def update_volume(self):
+        '''
+        update output volume to prevent mixing distortion due to sample overflow
+        slow to run, so should be called on a different thread (e.g. a button callback function)
+        not needed when the master bus limiter is enabled
+        '''
+        # Only calculate peak if loops are initialized to avoid accessing uninitialized data
+        if not any(loop.initialized for loop in self.loops):
+            return
+        rows = max(loop.rows_used for loop in self.loops)
+        peak = 0
+        #sum all layers of all tracks a block of rows at a time to bound memory use
+        bases = self.track_base[:, np.newaxis]
+        for start in range(0, rows, 256):
+            index = bases + np.arange(start, min(start + 256, rows))
+            block = self.read_rows(index.reshape(-1)).reshape(index.shape + (self.chunk,)).astype(np.int32).sum(axis = 0)
+            peak = max(peak, int(np.max(np.abs(block))))
+        print('peak = ' + str(peak))
+        if peak > SAMPLEMAX:
+            self.output_volume = SAMPLEMAX / peak
+        else:
+            self.output_volume = 1
+        print('output volume = ' + str(self.output_volume))
+
+    @contextlib.contextmanager
+    def acquire_spare(self):
+        '''
+        acquire_spare() gives a background job the two spare slots (main, dub), holding spare_lock until the job is done
+
+        waits until the previous job's swap has been made (or dropped), so that its slots are spare again
+        '''
+        with self.spare_lock:
+            while self.pending_swap is not None:
+                time.sleep(0.01)
+            yield self.spare_slots[0], self.spare_slots[1]
+
+    def request_swap(self, loop, main_slot, dub_slot, length, content_length = None, kind = 'replace'):
+        '''
+        request_swap() asks the callback to replace the track's audio with two spare slots holding length rows
+
+        called from a background job inside acquire_spare(), the swap happens at the track's next loop boundary
+        (see swap_pending()); content_length is the rows of audio before quantization (default length), kind is as in Swap
+        '''
+        self.pending_swap = Swap(loop, main_slot, dub_slot, length, length if content_length is None else content_length, kind, self.scene)
+
+    def swap_pending(self):
+        '''
+        swap_pending() swaps the pending slots in once the track is back at the start of its loop
+        (an empty track: once the master loop is)
+
+        only slot numbers change, so this costs the same whatever the loop length
+        '''
+        swap = self.pending_swap
+        loop = swap.loop
+        if swap.kind == 'fill' and not loop.initialized:
+            if self.loops[0].initialized and self.loops[0].readp != 0:
+                return
+        elif loop.initialized and loop.readp != 0:
+            return
+        self.pending_swap = None
+        if not loop.initialized and swap.kind == 'replace':
+            return #cleared while the job ran, the slots stay spare
+        if swap.scene != self.scene:
+            return #made for a scene that isn't playing any more
+        old_main, old_dub = int(self.slot_of[0, loop.index]), int(self.slot_of[1, loop.index])
+        self.slot_of[0, loop.index] = swap.main_slot
+        self.slot_of[1, loop.index] = swap.dub_slot
+        self.track_base[loop.index] = swap.main_slot * self.maxlength
+        self.track_base[self.tracks + loop.index] = swap.dub_slot * self.maxlength
+        self.spare_slots = [slot for slot in self.spare_slots if slot not in (swap.main_slot, swap.dub_slot)] + [old_main, old_dub]
+        loop.bind()
+        loop.length = swap.length
+        loop.content_length = swap.content_length
+        loop.rows_used = max(swap.length, swap.content_length)
+        if not loop.initialized:
+            loop.readp = 0
+            loop.initialized = True
+            loop.is_playing = True
+        if swap.kind == 'master':
+            loop.length_factor = 1
+            self.set_length(swap.length)
+        else:
+            loop.length_factor = max(1, int(round(swap.length / self.length)))
+        loop.writep = (loop.readp - self.latency) % swap.length
+
+    def set_length(self, length):
+        '''
+        set_length() changes the master loop length (TRIM), updating all initialized loops
+        '''
+        self.length = length
+        for loop in self.loops:
+            if loop.initialized:
+                loop.length = min(self.maxlength, loop.length_factor * length)
+                # Ensure readp/writep are within bounds (of the track's own length, which spans length_factor master loops)
+                loop.readp = loop.readp % loop.length
+                loop.writep = loop.writep % loop.length
+
+    def output(self, mixed, input_buffer):
+        '''
+        output() finishes a float32 [channel, sample] mix: adds the direct monitor signal,
+        limits, meters and writes it to play_buffer
+        '''
+        if self.monitor_gain > 0:
+            #direct monitoring of the input (before input_shift attenuation)
+            mixed += input_buffer * np.float32(self.monitor_gain)
+        if self.limiter:
+            self.limiter.process(mixed)
+        np.clip(mixed, -32768, 32767, out = mixed)
+        if self.meters:
+            self.meters.update(input_buffer, self.track_rows, self.current_gain.max(axis = 1), mixed,
+                               self.limiter.gain_reduction if self.limiter else 1.0)
+        self.play_frames[:] = mixed.T
+        return(self.play_buffer)
+
+    def process(self, in_data):
+        '''
+        process() handles one buffer of input audio and returns the buffer to play, timing the work
+        '''
+        start = time.perf_counter()
+        out = self.process_buffer(in_data)
+        elapsed = time.perf_counter() - start
+        self.callback_count += 1
+        self.callback_seconds = elapsed
+        self.callback_peak_seconds = max(elapsed, self.callback_peak_seconds * CALLBACK_PEAK_DECAY)
+        if elapsed > self.deadline:
+            self.callback_overruns += 1
+        return out
+
+    def delay_input(self, input_buffer):
+        '''
+        delay_input() returns (a view of) the input delayed by input_delay samples
+        '''
+        chunk = self.chunk
+        line = self.delay_line
+        line[:chunk] = line[chunk:]
+        line[chunk:] = input_buffer
+        return line[chunk - self.input_delay:2 * chunk - self.input_delay]
+
+    def process_buffer(self, in_data):
+        '''
+        process_buffer() records, overdubs and mixes one buffer (the work of process())
+        '''
+        loops = self.loops
+        input_buffer = np.frombuffer(in_data, dtype = np.int16)
+        if self.channels > 1:
+            #loops are mono: mix input channels down
+            input_buffer = input_buffer.reshape(self.chunk, self.channels).mean(axis = 1).astype(np.int16)
+        #what is recorded lines up with what was heard (the limiter look-ahead, below a buffer); monitor and meters stay undelayed
+        rec_input = self.delay_input(input_buffer) if self.input_delay else input_buffer
+        #some input attenuation for overdub headroom purposes (straight into the capture ring, if there is one)
+        if self.capture:
+            current_rec_buffer = self.capture.record(rec_input, self.input_shift, loops[0].readp if loops[0].initialized else -1)
+        else:
+            current_rec_buffer = np.right_shift(rec_input, self.input_shift)
+        if self.onset:
+            self.onset.history.push(current_rec_buffer)
+
+        #SETUP: FIRST RECORDING
+        #if setup is not done i.e. if the master loop hasn't been recorded to yet
+        if not self.setup_donerecording:
+            #with auto-record, recording starts at the first onset
+            if self.setup_armed:
+                onset = self.onset.detect(rec_input)
+                if onset >= 0:
+                    self.start_first_at(onset)
+            #if setup is currently recording, that recording action happens in the following lines
+            if self.setup_is_recording:
+                #if the max allowed loop length is exceeded, stop recording and start looping
+                if self.length >= self.maxlength:
+                    print('Overflow')
+                    self.setup_donerecording = True
+                    self.setup_is_recording = False
+                elif self.setup_skip:
+                    self.setup_skip = False
+                else:
+                    #otherwise append incoming audio to master loop, increment LENGTH and continue
+                    loops[0].add_buffer(self.onset.history.delayed(self.setup_delay) if self.setup_delay else current_rec_buffer)
+                    self.length = self.length + 1
+            #nothing to play yet, but keep metering and monitoring the input
+            self.master_row = -1
+            self.setup_mix[:] = 0
+            return(self.output(self.setup_mix, input_buffer))
+        #execution ony reaches here if setup (first loop record and set LENGTH) finished.
+        #a background job (time-stretch) waiting to be swapped in at its track's loop boundary
+        if self.pending_swap:
+            self.swap_pending()
+        #a scene switch waits for the master loop to come round (if there is one)
+        if self.pending_scene is not None and (loops[0].is_restarting() or not loops[0].initialized):
+            self.switch_scene()
+        auto = self.auto_record and self.onset
+        #when master loop restarts, start recording on any other tracks that are waiting
+        if loops[0].is_restarting() and not auto:
+            for loop in loops:
+                #a cold track waits on until the cold store has decompressed it
+                if loop.is_waiting and not loop.cold:
+                    loop.start_recording(self.prev_rec_buffer)
+                    print('Recording...')
+        #if master loop is waiting just start recording without checking restart
+        if loops[0].is_waiting and not loops[0].initialized and not auto:
+                loops[0].start_recording(self.prev_rec_buffer)
+        #with auto-record, waiting tracks start at the first onset instead, already recording this buffer
+        punched = ()
+        if auto and any(loop.is_waiting and not loop.cold for loop in loops):
+            onset = self.onset.detect(rec_input)
+            if onset >= 0:
+                punched = [loop for loop in loops if loop.is_waiting and not loop.cold]
+                for loop in punched:
+                    self.punch_in(loop, onset)
+                    print(f'Recording from onset at sample {onset}...')
+        #if a loop is recording, check initialization and accordingly append or overdub
+        dubbing = []
+        for loop in loops:
+            if loop.is_recording and loop not in punched:
+                if loop.initialized:
+                    dubbing.append(loop)
+                else:
+                    loop.add_buffer(current_rec_buffer)
+        self.dub(dubbing, current_rec_buffer)
+        #mix all tracks and apply output_volume
+        mixed = self.mix()
+        np.multiply(mixed, self.output_volume, out = mixed, casting = 'unsafe')
+
+        # Add click track if enabled and loop is initialized
+        if self.click_enabled and loops[0].initialized and loops[0].readp < len(self.click_track):
+            # Mix in click track at the start of the loop
+            mixed += self.click_track[loops[0].readp]
+
+        #current buffer will serve as previous in next iteration
+        self.prev_rec_buffer[:] = current_rec_buffer
+        #play mixed audio and move on to next iteration
+        return(self.output(mixed, input_buffer))
+
+def make_click_track(rate, chunk):
+    '''
+    make_click_track() generates the click track sound (1kHz beep for 50ms) as a list of buffers
+    '''
+    click_duration_samples = int(0.05 * rate)  # 50ms click
+    click_buffers_needed = (click_duration_samples + chunk - 1) // chunk
+    click_track = []
+    for i in range(click_buffers_needed):
+        t = np.arange(i * chunk, min((i + 1) * chunk, click_duration_samples)) / rate
+        if len(t) < chunk:
+            # Pad the last buffer
+            click_buffer = np.zeros(chunk, dtype=np.int16)
+            click_buffer[:len(t)] = (np.sin(2 * np.pi * 1000 * t[:len(t)]) * 10000).astype(np.int16)
+        else:
+            click_buffer = (np.sin(2 * np.pi * 1000 * t) * 10000).astype(np.int16)
+        click_track.append(click_buffer)
+    return click_track
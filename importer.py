@@ -0,0 +1,217 @@
+'''
+importer.py loads audio files (WAV, FLAC) into tracks.
+
+A file goes into a track, quantized to a multiple of LENGTH like a recording (so FIT can retime
+it to the loop), or replaces the master loop, setting LENGTH to its length (like a TRIM).
+
+Importer runs the jobs on a worker thread that streams the file: it reads blocks of about
+CHUNK frames, mixes them down to mono, converts them to RATE with a streaming resampler and
+writes every completed row straight into a spare slot of the arena, so a long file is never
+decoded into memory as a whole. The callback swaps the slots in at the track's loop boundary
+(engine.request_swap), like a time-stretch result (stretch.py), so playback never stops.
+
+WAV files are read with the wave module (8, 16, 24 and 32 bit PCM); FLAC, float WAV and the
+other formats libsndfile knows need the soundfile package. Imported audio is attenuated by
+input_shift like recorded input, so overdubs on it keep the same headroom.
+'''
+
+import os
+import queue
+import threading
+import time
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from engine import DIRTY_ALL
+
+#an open audio file: read(count) returns up to count frames as float32 [frame, channel]
+#in the int16 range, and no frames at the end of the file
+AudioSource = namedtuple('AudioSource', ['rate', 'channels', 'frames', 'read', 'close'])
+
+def open_audio(path):
+    '''
+    open_audio() opens an audio file for reading in blocks, returns an AudioSource
+    '''
+    try:
+        import soundfile
+    except ImportError:
+        soundfile = None
+    if soundfile:
+        f = soundfile.SoundFile(path)
+        return AudioSource(f.samplerate, f.channels, f.frames,
+                           lambda count: f.read(count, dtype = 'float32', always_2d = True) * np.float32(32768), f.close)
+    if not path.lower().endswith('.wav'):
+        raise ValueError(f'{os.path.basename(path)}: only WAV files can be read without the soundfile package')
+    try:
+        f = wave.open(path, 'rb')
+    except wave.Error as e:
+        raise ValueError(f'{os.path.basename(path)}: {e} (float WAV needs the soundfile package)')
+    width = f.getsampwidth()
+    channels = f.getnchannels()
+    if width not in (1, 2, 3, 4):
+        f.close()
+        raise ValueError(f'{os.path.basename(path)}: unsupported sample width {8 * width} bit')
+
+    def read(count):
+        data = f.readframes(count)
+        if width == 1:
+            samples = (np.frombuffer(data, dtype = np.uint8).astype(np.float32) - 128) * 256
+        elif width == 2:
+            samples = np.frombuffer(data, dtype = '<i2').astype(np.float32)
+        elif width == 3:
+            b = np.frombuffer(data, dtype = np.uint8).reshape(-1, 3).astype(np.int32)
+            samples = ((b[:, 0] << 8 | b[:, 1] << 16 | b[:, 2] << 24) >> 8).astype(np.float32) / 256
+        else:
+            samples = np.frombuffer(data, dtype = '<i4').astype(np.float32) / 65536
+        return samples.reshape(-1, channels)
+    return AudioSource(f.getframerate(), channels, f.getnframes(), read, f.close)
+
+class Resampler:
+    '''
+    Resampler converts a stream of blocks from in_rate to out_rate by linear interpolation (like stretch.resample()),
+    with exact integer positions so long files don't drift
+    '''
+    def __init__(self, in_rate, out_rate):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.produced = 0 #output samples returned so far
+        self.base = 0 #input index of tail[0]
+        self.tail = np.zeros([0], dtype = np.float32) #input samples the next output samples need
+
+    def feed(self, block):
+        '''
+        feed() takes the next input samples (float32), returns the output samples they complete
+        '''
+        if self.in_rate == self.out_rate:
+            return block
+        x = np.concatenate((self.tail, block))
+        available = self.base + len(x)
+        #output n sits at input position n * in_rate / out_rate and needs the input sample after it
+        end = -(-(available - 1) * self.out_rate // self.in_rate)
+        t = np.arange(self.produced, end, dtype = np.int64) * self.in_rate
+        i = t // self.out_rate - self.base
+        frac = ((t % self.out_rate) / self.out_rate).astype(np.float32)
+        out = x[i] * (1 - frac) + x[i + 1] * frac
+        self.produced = end
+        keep = end * self.in_rate // self.out_rate
+        self.tail = x[keep - self.base:]
+        self.base = keep
+        return out
+
+    def flush(self):
+        '''
+        flush() returns the output samples left at the end of the input (against silence after it)
+        '''
+        if self.in_rate == self.out_rate:
+            return np.zeros([0], dtype = np.float32)
+        return self.feed(np.zeros([1], dtype = np.float32))
+
+class Importer:
+    def __init__(self, engine, directory):
+        self.engine = engine
+        self.directory = directory #relative file names are looked up here
+        self.jobs = queue.Queue()
+        self.busy = None #(track index, file name) of the running job
+        self.progress = 0.0
+        self.thread = threading.Thread(target = self.run, name = 'import', daemon = True)
+        self.thread.start()
+
+    def load(self, loop, name, master = False):
+        '''
+        load() imports the named file into the track in the background, or as the master loop (track 1, sets LENGTH)
+        '''
+        engine = self.engine
+        if not engine.setup_donerecording or engine.length <= 0:
+            raise ValueError('record the first loop before importing')
+        if master and loop.index != 0:
+            raise ValueError('the master loop is track 1')
+        #names come from API clients: nothing outside the import directory
+        directory = os.path.realpath(self.directory)
+        path = os.path.realpath(os.path.join(directory, name))
+        if os.path.commonpath([directory, path]) != directory:
+            raise ValueError(f'{name!r} is outside the import directory')
+        if not name or not os.path.isfile(path):
+            raise ValueError(f'no such file: {name!r}')
+        #a file that can't be read is refused here, not on the worker where only the log would tell
+        open_audio(path).close()
+        self.jobs.put((loop, path, master))
+
+    def run(self):
+        while True:
+            loop, path, master = self.jobs.get()
+            try:
+                with self.engine.acquire_spare() as (main_slot, dub_slot):
+                    self.process(loop, path, master, main_slot, dub_slot)
+            except Exception as e:
+                print(f'Import error: {e}')
+            self.busy = None
+
+    def process(self, loop, path, master, main_slot, dub_slot):
+        engine = self.engine
+        name = os.path.basename(path)
+        self.busy = (loop.index, name)
+        self.progress = 0.0
+        start = time.perf_counter()
+        source = open_audio(path)
+        try:
+            rows = self.stream(source, main_slot)
+        finally:
+            source.close()
+        if rows == 0:
+            print(f'Import: {name} is empty')
+            return
+        if master:
+            length, kind = rows, 'master'
+        else:
+            #the nearest whole number of master loops, what a FIT would stretch the file to
+            factor = max(1, min(int(round(rows / engine.length)), engine.maxlength // engine.length))
+            length, kind = factor * engine.length, 'replace' if loop.initialized else 'fill'
+        used = max(rows, length)
+        engine.arena.slots[main_slot, rows:length] = 0 #silence after a file shorter than the loop
+        engine.arena.slots[dub_slot, :used] = 0
+        engine.dirty[main_slot, rows:length] = DIRTY_ALL
+        engine.dirty[dub_slot, :used] = DIRTY_ALL
+        engine.request_swap(loop, main_slot, dub_slot, length, rows, kind)
+        print(f'Track {loop.index + 1}: imported {name}, {rows} rows playing as {length} in {time.perf_counter() - start:.1f}s')
+
+    def stream(self, source, slot):
+        '''
+        stream() decodes, mixes down and resamples source into the slot row by row, returns the rows written
+        '''
+        engine = self.engine
+        chunk = engine.chunk
+        rows_out = engine.arena.slots[slot]
+        dirty = engine.dirty[slot]
+        resampler = Resampler(source.rate, engine.rate)
+        scale = np.float32(2.0 ** -engine.input_shift)
+        block = max(1, -(-chunk * source.rate // engine.rate)) #frames giving about one row
+        pending = np.zeros([0], dtype = np.float32) #resampled samples short of a whole row
+        rows = 0
+        frames_read = 0
+        while True:
+            frames = source.read(block)
+            if len(frames):
+                frames_read += len(frames)
+                samples = resampler.feed(frames.mean(axis = 1, dtype = np.float32) * scale)
+            else:
+                samples = resampler.flush()
+            pending = np.concatenate((pending, samples))
+            if not len(frames) and len(pending) % chunk:
+                pending = np.concatenate((pending, np.zeros([chunk - len(pending) % chunk], dtype = np.float32)))
+            full = min(len(pending) // chunk, engine.maxlength - rows)
+            if full:
+                np.clip(pending[:full * chunk], -32768, 32767, out = pending[:full * chunk])
+                rows_out[rows:rows + full] = pending[:full * chunk].reshape(full, chunk)
+                dirty[rows:rows + full] = DIRTY_ALL
+                rows += full
+                pending = pending[full * chunk:]
+            if rows >= engine.maxlength:
+                print(f'Import: file longer than a track, cut to {rows} rows')
+                break
+            if not len(frames):
+                break
+            if source.frames:
+                self.progress = frames_read / source.frames
+        return rows
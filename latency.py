@@ -1,17 +1,16 @@
 import pyaudio
 import numpy as np
 import time
+from config import load_config, save_config
 
-settings_file = open('Config/settings.prt', 'r')
-parameters = settings_file.readlines()
-settings_file.close()
+config = load_config()
 
-RATE = int(parameters[0]) #sample rate
-CHUNK = int(parameters[1]) #buffer size
+RATE = config['audio']['rate'] #sample rate
+CHUNK = config['audio']['chunk'] #buffer size
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
-INDEVICE = int(parameters[3])
-OUTDEVICE = int(parameters[4])
+INDEVICE = config['audio']['input_device']
+OUTDEVICE = config['audio']['output_device']
 CLIPLENGTH = 100 #probably ok as constant.
 
 click_ang_fr = 0.5 #angular frequency of test click in radians per sample. Probably ok as constant.
@@ -129,14 +128,8 @@ if (confidence > 6): #test for statistical significance
     print('Measured latency is ' + str(clickest_buffer) + ' buffers with buffer size ' + str(CHUNK) + ' at sample rate ' + str(RATE / 1000) + 'kHz')
     print('i.e. about ' + str(latency_in_milliseconds) + ' milliseconds.')
     if (input('Set measured value as latency value for looping? (y/n): ') == 'y'):
-        settings_file = open('Config/settings.prt', 'r')
-        parameters = settings_file.readlines()
-        settings_file.close()
-        settings_file = open('Config/settings.prt', 'w')
-        parameters[2] = str(latency_in_milliseconds) + '\n'
-        for i in range(6):
-            settings_file.write(parameters[i])
-        settings_file.close()
+        config['audio']['latency_ms'] = latency_in_milliseconds
+        save_config(config)
         print('Done.')
 else:
     print('Test not conclusive, please\na) Move mic and speaker closer together\nb) Turn up volume\nc) Move to a quieter location')
@@ -0,0 +1,80 @@
+'''
+limiter.py contains the look-ahead peak limiter used on the master bus.
+
+The signal is delayed by lookahead_ms. Gains are computed per sub-block of a few dozen samples:
+each sub-block's gain is low enough for the loudest sub-block within the look-ahead window, so
+the gain is already down when a transient reaches the output. Gain recovers linearly over
+release_ms. Everything is vectorized per CHUNK with a fixed amount of work, so the CPU cost
+doesn't depend on the audio.
+'''
+
+import numpy as np
+
+class Limiter:
+    def __init__(self, rate, chunk, channels = 1, ceiling = 0.9 * (2**15), lookahead_ms = 3.0, release_ms = 100.0):
+        #sub-block size: largest power of two up to 32 that divides chunk
+        self.block = 1
+        while self.block < 32 and chunk % (self.block * 2) == 0:
+            self.block *= 2
+        self.chunk = chunk
+        self.ceiling = float(ceiling)
+        self.blocks = chunk // self.block
+        #look-ahead rounded up to whole sub-blocks (at least one, so a sub-block's gain covers the next one)
+        self.lookahead_blocks = max(1, int(np.ceil(lookahead_ms * rate / 1000 / self.block)))
+        self.lookahead = self.lookahead_blocks * self.block #delay in samples
+        #linear release: gain may rise by release_step per sub-block
+        self.release_step = self.block / max(1.0, release_ms * rate / 1000)
+
+        #delay line followed by the incoming chunk, preallocated
+        self.buffer = np.zeros([channels, self.lookahead + chunk], dtype = np.float32)
+        self.magnitude = np.zeros_like(self.buffer)
+        self.peaks = np.zeros([self.lookahead_blocks + self.blocks], dtype = np.float32)
+        self.window = np.zeros([self.blocks], dtype = np.float32)
+        self.gains = np.zeros([self.blocks + 1], dtype = np.float32) #previous gain followed by this chunk's gains
+        self.gains[0] = 1.0
+        self.release_ramp = (np.arange(self.blocks + 1) * self.release_step).astype(np.float32)
+        self.block_ramp = (np.arange(1, self.block + 1) / self.block).astype(np.float32)
+        self.sample_gains = np.zeros([self.blocks, self.block], dtype = np.float32)
+        self.gain_reduction = 1.0 #lowest gain applied in the last chunk, for metering
+
+    def process(self, mixed):
+        '''
+        process() limits a float32 [channel, sample] chunk in place and returns it
+
+        the returned audio is delayed by self.lookahead samples
+        '''
+        buffer = self.buffer
+        buffer[:, self.lookahead:] = mixed
+
+        #peak of each sub-block across all channels
+        np.abs(buffer, out = self.magnitude)
+        np.max(self.magnitude.reshape(buffer.shape[0], -1, self.block), axis = (0, 2), out = self.peaks)
+        #loudest sub-block within the look-ahead window of each output sub-block
+        window = self.window
+        window[:] = self.peaks[:self.blocks]
+        for shift in range(1, self.lookahead_blocks + 1):
+            np.maximum(window, self.peaks[shift:shift + self.blocks], out = window)
+        #target gain per sub-block
+        np.maximum(window, self.ceiling, out = window)
+        np.divide(self.ceiling, window, out = window)
+
+        #gain[j] = min(target[j], gain[j-1] + release_step) as a running minimum:
+        #gain[j] = min over m <= j of (target[m] + (j - m) * release_step)
+        gains = self.gains
+        gains[1:] = window
+        gains -= self.release_ramp
+        np.minimum.accumulate(gains, out = gains)
+        gains += self.release_ramp
+
+        #per-sample gain interpolated from the previous sub-block's gain to this one's
+        sample_gains = self.sample_gains
+        np.subtract(gains[1:], gains[:-1], out = sample_gains[:, 0])
+        np.multiply(sample_gains[:, :1], self.block_ramp, out = sample_gains)
+        sample_gains += gains[:-1, None]
+
+        np.multiply(buffer[:, :self.chunk], sample_gains.reshape(-1), out = mixed)
+        self.gain_reduction = float(gains[1:].min())
+        gains[0] = gains[-1]
+        #keep the last look-ahead worth of samples as the delay line for the next chunk
+        buffer[:, :self.lookahead] = buffer[:, self.chunk:]
+        return mixed
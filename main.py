@@ -7,18 +7,31 @@ import time
 import os
 import threading
 from gpiozero import LED, Button, RotaryEncoder
-
-# Try to use LGPIO pin factory for gpiozero if available
+from config import get_config
+from effects import EFFECT_NAMES
+from engine import PLAYBACK_MODES
+from audioprocess import RemoteEngine, build_engine, open_stream
+from controlapi import ControlServer
+from screen import Screen
+from waveform import WaveformMipmap
+
+# Try to use LGPIO pin factory for gpiozero if available, unless one was chosen already
+# (GPIOZERO_PIN_FACTORY, or the mock pins of test_session.py)
 from gpiozero import Device
-try:
-    from gpiozero.pins.lgpio import LGPIOFactory
-    Device.pin_factory = LGPIOFactory()
-except Exception:
-    # Fallback to default pin factory
-    pass
+if Device.pin_factory is None and 'GPIOZERO_PIN_FACTORY' not in os.environ:
+    try:
+        from gpiozero.pins.lgpio import LGPIOFactory
+        Device.pin_factory = LGPIOFactory()
+    except Exception:
+        # Fallback to default pin factory
+        pass
+
+#get configuration (audio settings, pins, display etc.) from Config/settings.json
+config = get_config()
 
-debounce_length = 0.03 #length in seconds of button debounce period
-hold_time_length = 2.0 #length in seconds to hold button before triggering held event
+debounce_length = config['controls']['debounce'] #length in seconds of button debounce period
+hold_time_length = config['controls']['hold_time'] #length in seconds to hold button before triggering held event
+POLL_INTERVAL = config['controls']['poll_interval'] #period in seconds of the main UI loop
 
 # Thread lock for LED updates
 led_update_lock = threading.Lock()
@@ -27,10 +40,14 @@ led_update_lock = threading.Lock()
 display_update_lock = threading.Lock()
 
 # Rotary encoder menu system
-menu_items = ['VOL', 'TRIM', 'CLK']
-current_menu_index = 0  # 0=VOL, 1=TRIM, 2=CLK
+#TRK selects the track that GAIN, FB, SOS, MODE, FIT, PITCH, PAN, FX and CAP adjust
+menu_items = ['VOL', 'TRIM', 'CLK', 'AUTO', 'TRK', 'GAIN', 'FB', 'SOS', 'MODE']
+current_menu_index = 0  # 0=VOL, 1=TRIM, 2=CLK, 3=AUTO, 4=TRK, 5=GAIN, 6=FB, 7=SOS, 8=MODE, then FIT, PITCH (with stretch enabled), PAN (stereo only), SCN (with scenes), FX (with effects), CAP (with capture)
+selected_track = 0
 menu_lock = threading.Lock()
-click_track_enabled = False
+
+LCD_COLS = config['display']['lcd_cols']
+LCD_ROWS = config['display']['lcd_rows']
 
 # Initialize display (supports both OLED and LCD) with error handling
 display = None
@@ -41,9 +58,9 @@ try:
     from luma.core.interface.serial import i2c
     from luma.oled.device import ssd1306
     from PIL import Image, ImageDraw, ImageFont
-    # Try I2C bus 1 (GPIO 2/3), then fallback to bus 20/21
-    for bus in [1, 20, 21]:
-        for addr in [0x3C, 0x3D]:
+    # Try I2C bus 1 (GPIO 2/3), then fallback to bus 20/21 (order set by display.i2c_buses)
+    for bus in config['display']['i2c_buses']:
+        for addr in config['display']['oled_addresses']:
             try:
                 serial = i2c(port=bus, address=addr)
                 display = ssd1306(serial)
@@ -62,12 +79,15 @@ except Exception as e:
         # Fallback to LCD (HD44780 via PCF8574 I2C) - needs 5V
         from RPLCD.i2c import CharLCD
         # Try both common I2C addresses on multiple buses
-        for bus in [1, 20, 21]:
-            for addr in [0x27, 0x3F]:
+        for bus in config['display']['i2c_buses']:
+            for addr in config['display']['lcd_addresses']:
                 try:
-                    display = CharLCD('PCF8574', addr, port=bus, cols=20, rows=4)
+                    display = CharLCD('PCF8574', addr, port=bus, cols=LCD_COLS, rows=LCD_ROWS)
                     display_type = 'LCD'
                     print(f'LCD display initialized on bus {bus} at 0x{addr:02X} (needs 5V)')
+                    # Custom characters 0-7 are level bars, 1 to 8 pixels high
+                    for height in range(1, 9):
+                        display.create_char(height - 1, tuple(0b11111 if row >= 8 - height else 0 for row in range(8)))
                     break
                 except:
                     continue
@@ -79,74 +99,110 @@ except Exception as e:
 if not display:
     print("WARNING: No display found - running without display")
 
-PLAYLEDS = (LED(12), LED(16), LED(4), LED(17))
-RECLEDS = (LED(27), LED(22), LED(10), LED(9))
-PLAYBUTTONS = (Button(11, bounce_time = debounce_length, hold_time = hold_time_length),
-              Button(5, bounce_time = debounce_length, hold_time = hold_time_length),
-              Button(6, bounce_time = debounce_length, hold_time = hold_time_length),
-              Button(13, bounce_time = debounce_length, hold_time = hold_time_length))
-RECBUTTONS = (Button(19, bounce_time = debounce_length, hold_time = hold_time_length),
-               Button(26, bounce_time = debounce_length, hold_time = hold_time_length),
-               Button(21, bounce_time = debounce_length, hold_time = hold_time_length),
-               Button(20, bounce_time = debounce_length, hold_time = hold_time_length))
-
-# Rotary encoder for menu control (GPIO23=CLK, GPIO24=DT, GPIO25=SW)
+gpio = config['gpio']
+PLAYLEDS = tuple(LED(pin) for pin in gpio['play_leds'])
+RECLEDS = tuple(LED(pin) for pin in gpio['rec_leds'])
+PLAYBUTTONS = tuple(Button(pin, bounce_time = debounce_length, hold_time = hold_time_length) for pin in gpio['play_buttons'])
+RECBUTTONS = tuple(Button(pin, bounce_time = debounce_length, hold_time = hold_time_length) for pin in gpio['rec_buttons'])
+
+# Rotary encoder for menu control (default GPIO23=CLK, GPIO24=DT, GPIO25=SW)
 try:
-    encoder = RotaryEncoder(23, 24, bounce_time=0.002, max_steps=0)
-    encoder_button = Button(25, bounce_time=0.1)
-    print('Rotary encoder initialized on GPIO23/24/25')
+    encoder = RotaryEncoder(gpio['encoder_clk'], gpio['encoder_dt'], bounce_time=config['controls']['encoder_bounce'], max_steps=0)
+    encoder_button = Button(gpio['encoder_sw'], bounce_time=config['controls']['encoder_button_bounce'])
+    print(f"Rotary encoder initialized on GPIO{gpio['encoder_clk']}/{gpio['encoder_dt']}/{gpio['encoder_sw']}")
 except Exception as e:
     encoder = None
     encoder_button = None
     print(f'Rotary encoder not available: {e}')
 
 
-#get configuration (audio settings etc.) from file
-settings_file = open('Config/settings.prt', 'r')
-parameters = settings_file.readlines()
-settings_file.close()
-
-RATE = int(parameters[0]) #sample rate
-CHUNK = int(parameters[1]) #buffer size
-FORMAT = pyaudio.paInt16 #specifies bit depth (16-bit)
-CHANNELS = 1 #mono audio
-latency_in_milliseconds = int(parameters[2])
+#audio settings
+RATE = config['audio']['rate'] #sample rate
+CHUNK = config['audio']['chunk'] #buffer size
+CHANNELS = config['audio']['channels'] #1 = mono, 2 = stereo output
+latency_in_milliseconds = config['audio']['latency_ms']
 LATENCY = round((latency_in_milliseconds/1000) * (RATE/CHUNK)) #latency in buffers
-INDEVICE = int(parameters[3]) #index (per pyaudio) of input device
-OUTDEVICE = int(parameters[4]) #index of output device
-overshoot_in_milliseconds = int(parameters[5]) #allowance in milliseconds for pressing 'stop recording' late
-OVERSHOOT = round((overshoot_in_milliseconds/1000) * (RATE/CHUNK)) #allowance in buffers
-MAXLENGTH = int(12582912 / CHUNK) #96mb of audio in total
-SAMPLEMAX = 0.9 * (2**15) #maximum possible value for an audio sample (little bit of margin)
-LENGTH = 0 #length of the first recording on track 1, all subsequent recordings quantized to a multiple of this.
+INDEVICE = config['audio']['input_device'] #index (per pyaudio) of input device
+OUTDEVICE = config['audio']['output_device'] #index of output device
+MAXLENGTH = int(config['audio']['max_samples'] / CHUNK) #buffer budget per track (default 96mb of audio in total)
+TRACKS = config['audio']['tracks'] #number of tracks, loops[0] is the master loop
+if config['stretch']['enabled']:
+    menu_items += ['FIT', 'PITCH']
+if CHANNELS == 2:
+    menu_items.append('PAN') #pan needs stereo output
+SCENES = config['scenes']['count'] #complete sets of tracks, switched with the SCN menu item
+if SCENES > 1:
+    menu_items.append('SCN')
+if config['effects']['enabled']:
+    menu_items.append('FX') #insert effects of the selected track
+if config['capture']['enabled']:
+    menu_items.append('CAP') #capture the last master loops of input into the selected track
 
 print(str(RATE) + ' ' +  str(CHUNK))
 print('NEW VERSION\nlatency correction (buffers): ' + str(LATENCY))
 print('looking for devices ' + str(INDEVICE) + ' and ' + str(OUTDEVICE))
 
-silence = np.zeros([CHUNK], dtype = np.int16) #a buffer containing silence
-
-# Generate click track sound (1kHz beep for 50ms)
-click_duration_samples = int(0.05 * RATE)  # 50ms click
-click_buffers_needed = (click_duration_samples + CHUNK - 1) // CHUNK
-click_track = []
-for i in range(click_buffers_needed):
-    t = np.arange(i * CHUNK, min((i + 1) * CHUNK, click_duration_samples)) / RATE
-    if len(t) < CHUNK:
-        # Pad the last buffer
-        click_buffer = np.zeros(CHUNK, dtype=np.int16)
-        click_buffer[:len(t)] = (np.sin(2 * np.pi * 1000 * t[:len(t)]) * 10000).astype(np.int16)
-    else:
-        click_buffer = (np.sin(2 * np.pi * 1000 * t) * 10000).astype(np.int16)
-    click_track.append(click_buffer)
-
-#mixed output (sum of audio from tracks) is multiplied by output_volume before being played.
-#This is updated dynamically as max peak in resultant audio changes
-output_volume = np.float16(1.0)
+def write_lcd_rows(rows):
+    '''
+    write_lcd_rows() writes rows of text to the LCD, each padded to the display width
+    Don't use clear() - just overwrite with spaces for better reliability
+    '''
+    for row, text in enumerate(rows[:LCD_ROWS]):
+        display.cursor_pos = (row, 0)
+        display.write_string(str(text)[:LCD_COLS].ljust(LCD_COLS))
 
-#multiplying by up_ramp and down_ramp gives fade-in and fade-out
-down_ramp = np.linspace(1, 0, CHUNK)
-up_ramp = np.linspace(0, 1, CHUNK)
+def menu_label(item):
+    '''
+    menu_label() returns the short on-screen label of a menu item with its current value
+    '''
+    loop = loops[selected_track]
+    if item == 'VOL':
+        return f"VOL:{int(engine.output_volume * 100):3d}%"
+    elif item == 'TRIM':
+        return "TR"
+    elif item == 'CLK':
+        return "CLK*" if engine.click_enabled else "CLK"
+    elif item == 'AUTO':
+        return "AUTO*" if engine.auto_record else "AUTO"
+    elif item == 'TRK':
+        return f"T{selected_track + 1}"
+    elif item == 'GAIN':
+        return f"G:{int(loop.gain * 100):3d}%"
+    elif item == 'FB':
+        return f"FB:{int(round(loop.feedback * 100)):3d}%"
+    elif item == 'SOS':
+        return "SOS*" if loop.sos else "SOS"
+    elif item == 'MODE':
+        return f"M:{loop.mode}"
+    elif item in ('FIT', 'PITCH'):
+        if stretcher.busy and stretcher.busy[0] == selected_track:
+            return f"{item[:3]}{int(stretcher.progress * 100):2d}%"
+        return item
+    elif item == 'PAN':
+        if abs(loop.pan) < 0.005:
+            return "P:C"
+        return f"P:{'L' if loop.pan < 0 else 'R'}{int(abs(loop.pan) * 100)}"
+    elif item == 'SCN':
+        #S1>2 while the switch waits for the loop boundary
+        pending = engine.pending_scene
+        return f"S{engine.scene + 1}" + (f">{pending + 1}" if pending is not None else "")
+    elif item == 'FX':
+        #initials of the effects on, e.g. FX:ER for EQ and reverb
+        letters = ''.join(name[0] for i, name in enumerate(EFFECT_NAMES) if loop.effects >> i & 1)
+        return f"FX:{letters or '-'}"
+    return item
+
+def menu_line(width):
+    '''
+    menu_line() shows the selected menu item in brackets, followed by as many of the next items as fit in width
+    '''
+    line = f"[{menu_label(menu_items[current_menu_index])}]"
+    for i in range(1, len(menu_items)):
+        label = menu_label(menu_items[(current_menu_index + i) % len(menu_items)])
+        if len(line) + 1 + len(label) > width:
+            break
+        line += " " + label
+    return line
 
 def update_display_status():
     '''Updates display with comprehensive loop and track status'''
@@ -158,150 +214,17 @@ def update_display_status():
         return  # Skip update if another thread is already updating
     
     try:
-        # Don't update if loops aren't defined yet
-        if 'loops' not in globals():
+        # Don't update if the engine (and the screen drawing it) isn't created yet
+        if 'screen' not in globals():
             return
-            
-        # Calculate loop position and timing
-        loop_time = 0.0
-        loop_position = 0.0
-        loop_percent = 0
-        if LENGTH > 0:
-            loop_time = (LENGTH * CHUNK) / RATE  # Total loop time in seconds
-            if loops[0].initialized and LENGTH > 0:
-                # Prevent division by zero and ensure valid readp
-                readp = max(0, min(loops[0].readp, LENGTH - 1))
-                loop_position = (readp * CHUNK) / RATE
-                loop_percent = int((readp / LENGTH) * 100)
-        
-        # Build track status string - ensure it's always 4 characters
-        track_status = ""
-        for i in range(4):
-            if loops[i].is_recording:
-                track_status += "R"
-            elif loops[i].is_waiting:
-                track_status += "W"
-            elif loops[i].is_playing:
-                track_status += "P"
-            elif loops[i].initialized and not loops[i].is_playing:
-                track_status += "M"  # Muted
-            else:
-                track_status += "-"
-        
         if display_type == 'OLED':
             # OLED: 128x64 pixels, can show more info
             image = Image.new('1', (128, 64))
-            draw = ImageDraw.Draw(image)
-            font = ImageFont.load_default()
-            
-            # Line 1: Loop time (no percentage)
-            if LENGTH > 0:
-                line1 = f"Loop: {loop_time:.4f}s"
-            else:
-                line1 = "Ready to record"
-            draw.text((0, 0), line1, font=font, fill=255)
-            
-            # Line 2: Track status (R=Recording, W=Waiting, P=Playing, M=Muted, -=Empty)
-            line2 = f"T1234: {track_status}"
-            draw.text((0, 16), line2, font=font, fill=255)
-            
-            # Line 3: Position blocks (4 blocks showing quarters)
-            if loops[0].initialized and LENGTH > 0:
-                # Calculate which quarter we're in (0-3)
-                quarter = min(3, int((loops[0].readp / LENGTH) * 4))
-                # Use block character (█) for current quarter
-                blocks = ""
-                for i in range(4):
-                    blocks += "█" if i <= quarter else "▯"
-                line3 = f"Position: {blocks}"
-            else:
-                active_tracks = sum(1 for loop in loops if loop.initialized)
-                recording_tracks = sum(1 for loop in loops if loop.is_recording)
-                waiting_tracks = sum(1 for loop in loops if loop.is_waiting)
-                line3 = f"Act:{active_tracks} Rec:{recording_tracks} Wait:{waiting_tracks}"
-            draw.text((0, 32), line3, font=font, fill=255)
-            
-            # Line 4: Menu or countdown/position
-            if waiting_tracks > 0 and loops[0].initialized:
-                # Show countdown when tracks are waiting
-                buffers_to_restart = LENGTH - loops[0].readp
-                time_to_restart = (buffers_to_restart * CHUNK) / RATE
-                line4 = f"Start in {time_to_restart:.4f}s"
-                draw.text((0, 48), line4, font=font, fill=255)
-            else:
-                # Show menu: VOL TRIM CLK with current selection highlighted
-                menu_str = ""
-                for i, item in enumerate(menu_items):
-                    if i == current_menu_index:
-                        menu_str += f"[{item}] "
-                    else:
-                        menu_str += f" {item}  "
-                # Add volume and click status
-                vol_pct = int(output_volume * 100)
-                clk_status = "ON" if click_track_enabled else "OFF"
-                line4 = f"{menu_str.strip()}"
-                draw.text((0, 48), line4, font=font, fill=255)
-            
-            display.image(image)
-            display.show()
-            
+            screen.draw_oled(ImageDraw.Draw(image), ImageFont.load_default(), selected_track, menu_line(21))
+            display.display(image)
         elif display_type == 'LCD':
             # LCD: 20x4, show comprehensive info
-            # Don't use clear() - just overwrite with spaces for better reliability
-            
-            # Row 1: Loop time (no percentage)
-            if LENGTH > 0:
-                if loops[0].initialized:
-                    row1 = f"Loop:{loop_time:.4f}s"
-                else:
-                    row1 = f"Recording {loop_time:.4f}s"
-            else:
-                row1 = "Ready to Loop"
-            row1 = str(row1)[:20].ljust(20)
-            
-            # Row 2: Track status with detailed info
-            row2 = f"Trk:{track_status}"
-            row2 = str(row2)[:20].ljust(20)
-            
-            # Row 3: Position blocks or countdown
-            waiting_tracks = sum(1 for loop in loops if loop.is_waiting)
-            if waiting_tracks > 0 and loops[0].initialized:
-                buffers_to_restart = LENGTH - loops[0].readp
-                time_to_restart = (buffers_to_restart * CHUNK) / RATE
-                row3 = f"Next loop:{time_to_restart:6.4f}s"
-            elif loops[0].initialized and LENGTH > 0:
-                # Calculate which quarter we're in (0-3)
-                quarter = min(3, int((loops[0].readp / LENGTH) * 4))
-                # Use block character for current quarter
-                blocks = ""
-                for i in range(4):
-                    blocks += chr(0xFF) if i <= quarter else chr(0xA1)  # Full block vs light block
-                row3 = f"Pos: {blocks}"
-            else:
-                row3 = "No loop playing"
-            row3 = str(row3)[:20].ljust(20)
-            
-            # Row 4: Menu with highlighting
-            vol_pct = int(output_volume * 100)
-            clk_char = "*" if click_track_enabled else " "
-            if current_menu_index == 0:  # VOL selected
-                row4 = f"[VOL:{vol_pct:3d}%] TR CLK{clk_char}"
-            elif current_menu_index == 1:  # TRIM selected
-                row4 = f" VOL:{vol_pct:3d}% [TR] CLK{clk_char}"
-            else:  # CLK selected
-                row4 = f" VOL:{vol_pct:3d}%  TR [CLK{clk_char}]"
-            row4 = str(row4)[:20].ljust(20)
-            
-            # Write all four rows with position setting for each
-            display.cursor_pos = (0, 0)
-            display.write_string(row1)
-            display.cursor_pos = (1, 0)
-            display.write_string(row2)
-            display.cursor_pos = (2, 0)
-            display.write_string(row3)
-            display.cursor_pos = (3, 0)
-            display.write_string(row4)
-            
+            write_lcd_rows(screen.lcd_rows(menu_line(LCD_COLS), LCD_COLS))
     except Exception as e:
         print(f'Display error: {e}')
         import traceback
@@ -309,21 +232,6 @@ def update_display_status():
     finally:
         display_update_lock.release()
 
-def fade_in(buffer):
-    '''
-    fade_in() applies fade-in to a buffer
-    '''
-    np.multiply(buffer, up_ramp, out = buffer, casting = 'unsafe')
-
-
-def fade_out(buffer):
-    '''
-    fade_out() applies fade-out to a buffer
-    '''
-    np.multiply(buffer, down_ramp, out = buffer, casting = 'unsafe')
-
-pa = pyaudio.PyAudio()
-
 # Display startup message
 if display:
     try:
@@ -332,368 +240,108 @@ if display:
             draw = ImageDraw.Draw(image)
             font = ImageFont.load_default()
             draw.text((30, 16), 'RASPI LOOPER', font=font, fill=255)
-            draw.text((20, 32), '4-Track Ready', font=font, fill=255)
-            display.image(image)
-            display.show()
+            draw.text((20, 32), f'{TRACKS}-Track Ready', font=font, fill=255)
+            display.display(image)
         elif display_type == 'LCD':
             display.clear()
-            display.cursor_pos = (0, 0)
-            display.write_string('RASPI LOOPER        ')
-            display.cursor_pos = (1, 0)
-            display.write_string('4-Track Ready       ')
-            display.cursor_pos = (2, 0)
-            display.write_string('                    ')
-            display.cursor_pos = (3, 0)
-            display.write_string('Rotate to adjust    ')
+            write_lcd_rows(['RASPI LOOPER', f'{TRACKS}-Track Ready', '', 'Rotate to adjust'])
     except Exception as e:
         print(f'Display error: {e}')
 
-class audioloop:
-    def __init__(self):
-        self.initialized = False
-        self.length_factor = 1
-        self.length = 0
-        #self.main_audio and self.dub_audio contain audio data in arrays of CHUNKs.
-        self.main_audio = np.zeros([MAXLENGTH, CHUNK], dtype = np.int16)
-        #self.dub_audio contains the latest recorded dub. Clearing this achieves undo.
-        self.dub_audio = np.zeros([MAXLENGTH, CHUNK], dtype = np.int16)
-        self.readp = 0
-        self.writep = 0
-        self.is_recording = False
-        self.is_playing = False
-        self.is_waiting = False
-        self.last_buffer_recorded = 0 #index of last buffer added
-        self.preceding_buffer = np.zeros([CHUNK], dtype = np.int16)
-        """
-        Dub ratio must be reduced with each overdub to keep all overdubs at the same level while preventing clipping.
-        first overdub is attenuated by a factor of 0.9, second by 0.81, etc.
-        each time the existing audio is attenuated by a factor of 0.9.
-        """
-        self.dub_ratio = 1.0
-
-    def increment_pointers(self):
-        '''
-        increment_pointers() increments pointers and, when restarting while recording, advances dub ratio
-        '''
-        if self.readp == self.length - 1:
-            self.readp = 0
-            if self.is_recording:
-                self.dub_ratio = self.dub_ratio * 0.9
-                print(self.dub_ratio)
-        else:
-            self.readp = self.readp + 1
-        self.writep = (self.writep + 1) % self.length
-
-    def initialize(self):
-        '''
-        initialize() raises self.length to closest integer multiple of LENGTH and initializes read and write pointers
-        '''
-        print('initialize called')
-        if self.initialized:
-            print('redundant initialization')
-            return
-        self.writep = self.length - 1
-        self.last_buffer_recorded = self.writep
-        self.length_factor = (int((self.length - OVERSHOOT) / LENGTH) + 1)
-        self.length = self.length_factor * LENGTH
-        print('length ' + str(self.length))
-        print('last buffer recorded ' + str(self.last_buffer_recorded))
-        #crossfade
-        fade_out(self.main_audio[self.last_buffer_recorded]) #fade out the last recorded buffer
-        preceding_buffer_copy = np.copy(self.preceding_buffer)
-        fade_in(preceding_buffer_copy)
-        self.main_audio[self.length - 1, :] += preceding_buffer_copy[:]
-        #audio should be written ahead of where it is being read from, to compensate for input+output latency
-        self.readp = (self.writep + LATENCY) % self.length
-        self.initialized = True
-        self.is_playing = True
-        self.increment_pointers()
-
-    def add_buffer(self, data):
-        '''
-        add_buffer() appends a new buffer unless loop is filled to MAXLENGTH
-        expected to only be called before initialization
-        '''
-        if self.length >= (MAXLENGTH - 1):
-            self.length = 0
-            print('loop full')
-            return
-        self.main_audio[self.length, :] = np.copy(data)
-        self.length = self.length + 1
-
-    def toggle_mute(self):
-        if self.is_playing:
-            self.is_playing = False
-        else:
-            self.is_playing = True
-
-    def is_restarting(self):
-        if not self.initialized:
-            return False
-        if self.readp == 0:
-            return True
-        return False
-
-    def read(self):
-        '''
-        read() reads and returns a buffer of audio from the loop
-
-        if not initialized: Do nothing
-        if initialized but muted: Just increment pointers
-        if initialized and playing: Read audio from the loop and increment pointers
-        '''        
-        if not self.initialized:
-            return(silence)
-        
-        if not self.is_playing:
-            self.increment_pointers()
-            return(silence)
-        
-        tmp = self.readp
-        self.increment_pointers()
-        return(self.main_audio[tmp, :] + self.dub_audio[tmp, :])
-    
-    def dub(self, data, fade_in = False, fade_out = False):
-        '''
-        dub() overdubs an incoming buffer of audio to the loop at writep
-        
-        at writep:
-        first, the buffer from dub_audio is mixed into main_audio
-        next, the buffer in dub_audio is overwritten with the incoming buffer
-        '''
-        if not self.initialized:
-            return
-        datadump = np.copy(data)
-        self.main_audio[self.writep, :] = self.main_audio[self.writep, :] * 0.9 + self.dub_audio[self.writep, :] * self.dub_ratio
-        self.dub_audio[self.writep, :] = datadump[:]
-
-    def clear(self):
-        '''
-        clear() clears the loop so that a new loop of the same or a different length can be recorded on the track
-        '''
-        self.main_audio = np.zeros([MAXLENGTH, CHUNK], dtype = np.int16)
-        self.dub_audio = np.zeros([MAXLENGTH, CHUNK], dtype = np.int16)
-        self.initialized = False
-        self.is_playing = False
-        self.is_recording = False
-        self.is_waiting = False
-        self.length_factor = 1
-        self.length = 0
-        self.readp = 0
-        self.writep = 0
-        self.last_buffer_recorded = 0
-        self.preceding_buffer = np.zeros([CHUNK], dtype = np.int16)
-
-    def undo(self):
-        '''
-        undo() resets dub_audio to silence
-        '''
-        self.dub_audio = np.zeros([MAXLENGTH, CHUNK], dtype = np.int16)
-        self.is_recording = False
-        self.is_waiting = False
-
-    def clear_or_undo(self):
-        '''
-        clear if muted, undo if playing.
-        '''
-        if self.is_playing:
-            self.undo()
-        else:
-            self.clear()
-    
-    def start_recording(self, previous_buffer):
-        self.is_recording = True
-        self.is_waiting = False
-        self.preceding_buffer = np.copy(previous_buffer)
-
-    def set_recording(self):
-        '''
-        set_recording() either starts or stops recording
-
-        if initialized and recording, stop recording (dubbing)
-        if uninitialized and recording, stop recording (appending) and initialize
-        if initialized and not recording, set as "waiting to record"
-        '''
-        print('set_recording called')
-        already_recording = False
-
-        #if chosen track is currently recording, flag it
-        if self.is_recording:
-            already_recording = True
-
-        #turn off recording
-        if self.is_recording and not self.initialized:
-            self.initialize()
-        self.is_recording = False
-        self.is_waiting = False
-
-        #unless flagged, schedule recording. If chosen track was recording, then stop recording
-        #like a toggle but with delayed enabling and instant disabling
-        if not already_recording:
-            self.is_waiting = True
-
-#defining four audio loops. loops[0] is the master loop.
-loops = (audioloop(), audioloop(), audioloop(), audioloop())
-
-#while looping, prev_rec_buffer keeps track of the audio buffer recorded before the current one
-prev_rec_buffer = np.zeros([CHUNK], dtype = np.int16)
-
-def update_volume():
-    '''
-    update output volume to prevent mixing distortion due to sample overflow
-    slow to run, so should be called on a different thread (e.g. a button callback function)
-    '''
-    global output_volume
-    try:
-        # Only calculate peak if loops are initialized to avoid accessing uninitialized data
-        if not any(loop.initialized for loop in loops):
-            return
-        
-        peak = np.max(
-                      np.abs(
-                              loops[0].main_audio.astype(np.int32)[:][:]
-                            + loops[1].main_audio.astype(np.int32)[:][:]
-                            + loops[2].main_audio.astype(np.int32)[:][:]
-                            + loops[3].main_audio.astype(np.int32)[:][:]
-                            + loops[0].dub_audio.astype(np.int32)[:][:]
-                            + loops[1].dub_audio.astype(np.int32)[:][:]
-                            + loops[2].dub_audio.astype(np.int32)[:][:]
-                            + loops[3].dub_audio.astype(np.int32)[:][:]
-                            )
-                     )
-        print('peak = ' + str(peak))
-        if peak > SAMPLEMAX:
-            output_volume = SAMPLEMAX / peak
-        else:
-            output_volume = 1
-        print('output volume = ' + str(output_volume))
-    except Exception as e:
-        print(f'Error in update_volume: {e}')
-
-def show_status():
+#with threads.engine_process the engine, audio stream, autosave and stretcher run in their own process
+#(audioprocess.py) and engine is a stand-in that reads its status from shared memory and sends it commands
+ENGINE_PROCESS = config['threads']['engine_process']
+pa = None
+if ENGINE_PROCESS:
+    engine = RemoteEngine()
+    waveform, stretcher, importer, capturer = engine.waveform, engine.stretcher, engine.importer, engine.capturer
+    checkpointer = engine.checkpointer
+    realtime, midi = None, None
+else:
+    pa = pyaudio.PyAudio()
+    #the engine owns all loop audio (one arena holding every track's main and dub layer) and the mixer
+    engine, stretcher, importer, capturer, checkpointer, realtime, midi = build_engine(config)
+    #min/max pyramid of every track for the OLED waveform overview, updated by the UI loop
+    waveform = WaveformMipmap(engine)
+loops = engine.loops
+#the status screen, drawn by update_display_status()
+screen = Screen(engine, waveform, RATE)
+
+def show_status(update_display = True):
     '''
     show_status() checks which loops are recording/playing and lights up LEDs accordingly
-    Also updates display with current status
+    Also updates display with current status (unless update_display is False)
     '''
     with led_update_lock:
-        for i in range(4):
-            if loops[i].is_recording:
-                RECLEDS[i].on()
+        #tracks beyond the configured pins have no LEDs
+        for loop, recled in zip(loops, RECLEDS):
+            if loop.is_recording:
+                recled.on()
             else:
-                RECLEDS[i].off()
-            if loops[i].is_playing:
-                PLAYLEDS[i].on()
+                recled.off()
+        for loop, playled in zip(loops, PLAYLEDS):
+            if loop.is_playing:
+                playled.on()
             else:
-                PLAYLEDS[i].off()
+                playled.off()
     
     # Update display when LEDs change (skip if display is busy)
-    if display:
+    if display and update_display:
         try:
             update_display_status()
         except Exception as e:
             print(f'Display error in show_status: {e}')  # Don't let display errors interrupt the program
 
-setup_is_recording = False #set to True when track 1 recording button is first pressed
-setup_donerecording = False #set to true when first track 1 recording is done
+#the UI loop refreshes the display every so many audio buffers (less often for LCD to avoid timing issues)
+OLED_REFRESH_BUFFERS = config['display']['oled_refresh_buffers']
+LCD_REFRESH_BUFFERS = config['display']['lcd_refresh_buffers']
+DISPLAY_REFRESH_BUFFERS = LCD_REFRESH_BUFFERS if display_type == 'LCD' else OLED_REFRESH_BUFFERS
 
-play_buffer = np.zeros([CHUNK], dtype = np.int16) #buffer to hold mixed audio from all 4 tracks
-display_update_counter = 0  # Counter to throttle display updates
+audio_thread_configured = False
+
+def configure_audio_thread():
+    '''
+    configure_audio_thread() applies the thread priority and core pinning to the thread running the audio callback
+    must be called from the callback itself, since PortAudio creates that thread
+    '''
+    global audio_thread_configured
+    audio_thread_configured = True
+    realtime.configure_audio_thread()
+
+def configure_ui_thread():
+    '''
+    configure_ui_thread() applies threads.ui_nice to the calling (main UI loop) thread
+    '''
+    nice = config['threads']['ui_nice']
+    if nice == 0:
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+        print(f'UI thread niceness set to {nice}')
+    except (AttributeError, OSError) as e:
+        print(f'Could not set UI thread niceness: {e}')
 
 def looping_callback(in_data, frame_count, time_info, status):
-    global play_buffer
-    global prev_rec_buffer
-    global setup_donerecording
-    global setup_is_recording
-    global LENGTH
-    global display_update_counter
-    
-    current_rec_buffer = np.right_shift(np.frombuffer(in_data, dtype = np.int16), 2) #some input attenuation for overdub headroom purposes
+    if not audio_thread_configured:
+        configure_audio_thread()
     
-    # Update display periodically (less often for LCD to avoid timing issues)
-    display_update_counter += 1
-    update_interval = 100 if display_type == 'LCD' else 50  # Much slower updates to prevent stuttering
-    if display_update_counter >= update_interval:
-        display_update_counter = 0
-        if display and setup_donerecording:  # Only update during active looping
-            try:
-                update_display_status()
-            except Exception as e:
-                print(f'Display update error in callback: {e}')  # Don't let display errors interrupt audio
-    
-    #SETUP: FIRST RECORDING
-    #if setup is not done i.e. if the master loop hasn't been recorded to yet
-    if not setup_donerecording:
-        #if setup is currently recording, that recording action happens in the following lines
-        if setup_is_recording:
-            #if the max allowed loop length is exceeded, stop recording and start looping
-            if LENGTH >= MAXLENGTH:
-                print('Overflow')
-                setup_donerecording = True
-                setup_is_recording = False
-                return(silence, pyaudio.paContinue)
-            #otherwise append incoming audio to master loop, increment LENGTH and continue
-            loops[0].add_buffer(current_rec_buffer)
-            LENGTH = LENGTH + 1
-            return(silence, pyaudio.paContinue)
-        #if setup not done and not currently happening then just wait
-        else:
-            return(silence, pyaudio.paContinue)
-    #execution ony reaches here if setup (first loop record and set LENGTH) finished.
-    #when master loop restarts, start recording on any other tracks that are waiting
-    if loops[0].is_restarting():
-        #update_volume()
-        for loop in loops:
-            if loop.is_waiting:
-                loop.start_recording(prev_rec_buffer)
-                print('Recording...')
-    #if master loop is waiting just start recording without checking restart
-    if loops[0].is_waiting and not loops[0].initialized:
-            loops[0].start_recording(prev_rec_buffer)
-    #if a loop is recording, check initialization and accordingly append or overdub
-    for loop in loops:
-        if loop.is_recording:
-            if loop.initialized:
-                loop.dub(current_rec_buffer)
-            else:
-                loop.add_buffer(current_rec_buffer)
-    #add to play_buffer only one-fourth of each audio signal times the output_volume
-    play_buffer[:] = np.multiply((
-                                   loops[0].read().astype(np.int32)[:]
-                                 + loops[1].read().astype(np.int32)[:]
-                                 + loops[2].read().astype(np.int32)[:]
-                                 + loops[3].read().astype(np.int32)[:]
-                                 ), output_volume, out= None, casting = 'unsafe').astype(np.int16)
-    
-    # Add click track if enabled and loop is initialized
-    if click_track_enabled and loops[0].initialized and loops[0].readp < len(click_track):
-        # Mix in click track at the start of the loop
-        play_buffer[:] = np.clip(
-            play_buffer[:].astype(np.int32) + click_track[loops[0].readp].astype(np.int32),
-            -32768, 32767
-        ).astype(np.int16)
-    
-    #current buffer will serve as previous in next iteration
-    prev_rec_buffer = np.copy(current_rec_buffer)
-    #play mixed audio and move on to next iteration
-    return(play_buffer, pyaudio.paContinue)
-
-#now initializing looping_stream (the only audio stream)
-looping_stream = pa.open(
-    format = FORMAT,
-    channels = CHANNELS,
-    rate = RATE,
-    input = True,
-    output = True,
-    input_device_index = INDEVICE,
-    output_device_index = OUTDEVICE,
-    frames_per_buffer = CHUNK,
-    start = True,
-    stream_callback = looping_callback
-)
+    #recording, overdubbing and mixing all happen in the engine; the display is drawn by the UI loop, never here
+    #(rendering and the blocking I2C transfer would hold up the audio)
+    out = engine.process(in_data)
+    if midi:
+        midi.process(time_info) #timestamps the MIDI clock ticks of this buffer
+    return(out, pyaudio.paContinue)
+
+#now initializing looping_stream (the only audio stream), already running in the engine process
+if not ENGINE_PROCESS:
+    looping_stream = open_stream(pa, config, looping_callback)
 
 #audio stream has now been started and the callback function is running in a background thread.
 #first, we give the stream some time to properly start up
 time.sleep(3)
+if realtime:
+    for line in realtime.report():
+        print(line)
 #then we turn on all lights to indicate that looper is ready to start looping
 print('ready')
 for led in RECLEDS:
@@ -701,138 +349,143 @@ for led in RECLEDS:
 for led in PLAYLEDS:
     led.on()
 
-#once all LEDs are on, we wait for the master loop record button to be pressed
-# Wait a bit for GPIO to stabilize after LED changes
-time.sleep(0.3)
-print('Waiting for first button press...')
-
-# Show ready message on display
-if display:
-    try:
-        if display_type == 'OLED':
-            image = Image.new('1', (128, 64))
-            draw = ImageDraw.Draw(image)
-            font = ImageFont.load_default()
-            draw.text((10, 8), 'Press RECORD 1', font=font, fill=255)
-            draw.text((10, 24), 'to start first', font=font, fill=255)
-            draw.text((10, 40), 'loop recording', font=font, fill=255)
-            display.image(image)
-            display.show()
-        elif display_type == 'LCD':
-            display.clear()
-            display.cursor_pos = (0, 0)
-            display.write_string('Press REC1 to start ')
-            display.cursor_pos = (1, 0)
-            display.write_string('recording first loop')
-            display.cursor_pos = (2, 0)
-            display.write_string('                    ')
-            display.cursor_pos = (3, 0)
-            display.write_string('                    ')
-    except Exception as e:
-        print(f'Display error: {e}')
-
-RECBUTTONS[0].wait_for_press()
-print('Button pressed! Starting recording...')
-
-# Show recording message
-if display:
-    try:
-        if display_type == 'OLED':
-            image = Image.new('1', (128, 64))
-            draw = ImageDraw.Draw(image)
-            font = ImageFont.load_default()
-            draw.text((20, 16), 'RECORDING...', font=font, fill=255)
-            draw.text((10, 32), 'Track 1 Active', font=font, fill=255)
-            display.image(image)
-            display.show()
-        elif display_type == 'LCD':
-            display.clear()
-            display.cursor_pos = (0, 0)
-            display.write_string('RECORDING...        ')
-            display.cursor_pos = (1, 0)
-            display.write_string('Track 1 Active      ')
-            display.cursor_pos = (2, 0)
-            display.write_string('                    ')
-            display.cursor_pos = (3, 0)
-            display.write_string('                    ')
-    except Exception as e:
-        print(f'Display error: {e}')
-
-#when the button is pressed, set the flag... looping_callback will see this flag. Also start recording on track 1
-setup_is_recording = True
-loops[0].start_recording(prev_rec_buffer)
-
-#turn off all LEDs except master loop record
-for i in range(1, 4):
-    RECLEDS[i].off()
-for led in PLAYLEDS:
-    led.off()
-
-#allow time for button release, otherwise pressing the button once will start and stop the recording
-time.sleep(0.5)
-print('Waiting for second button press to stop recording...')
+def record_first_loop():
+    '''
+    record_first_loop() waits for the master loop record button, records track 1 until it is pressed again,
+    then initializes the master loop (sets LENGTH); holding the button instead captures what was just played
+    '''
+    #once all LEDs are on, we wait for the master loop record button to be pressed
+    # Wait a bit for GPIO to stabilize after LED changes
+    time.sleep(0.3)
+    print('Waiting for first button press...')
 
-# Update display to show waiting for stop
-if display:
-    try:
-        if display_type == 'OLED':
-            image = Image.new('1', (128, 64))
-            draw = ImageDraw.Draw(image)
-            font = ImageFont.load_default()
-            draw.text((15, 8), 'RECORDING T1...', font=font, fill=255)
-            draw.text((5, 24), 'Press REC1 again', font=font, fill=255)
-            draw.text((25, 40), 'to finish', font=font, fill=255)
-            display.image(image)
-            display.show()
-        elif display_type == 'LCD':
-            display.cursor_pos = (0, 0)
-            display.write_string('Recording T1...     ')
-            display.cursor_pos = (1, 0)
-            display.write_string('Press REC1 again to ')
-            display.cursor_pos = (2, 0)
-            display.write_string('finish recording    ')
-            display.cursor_pos = (3, 0)
-            display.write_string('                    ')
-    except Exception as e:
-        print(f'Display error: {e}')
+    # Show ready message on display
+    if display:
+        try:
+            if display_type == 'OLED':
+                image = Image.new('1', (128, 64))
+                draw = ImageDraw.Draw(image)
+                font = ImageFont.load_default()
+                draw.text((10, 8), 'Press RECORD 1', font=font, fill=255)
+                draw.text((10, 24), 'to start first', font=font, fill=255)
+                draw.text((10, 40), 'loop recording', font=font, fill=255)
+                display.display(image)
+            elif display_type == 'LCD':
+                display.clear()
+                write_lcd_rows(['Press REC1 to start', 'recording first loop', '', ''])
+        except Exception as e:
+            print(f'Display error: {e}')
 
-#now wait for button to be pressed again, then stop recording and initialize master loop
-RECBUTTONS[0].wait_for_press()
-print('Button pressed! Stopping recording...')
+    RECBUTTONS[0].wait_for_press()
+    pressed = time.monotonic()
+    print('Button pressed! Starting recording...')
 
-# Show loop initialization message
-if display:
-    try:
-        if display_type == 'OLED':
-            image = Image.new('1', (128, 64))
-            draw = ImageDraw.Draw(image)
-            font = ImageFont.load_default()
-            draw.text((15, 16), 'Initializing', font=font, fill=255)
-            draw.text((25, 32), 'Loop...', font=font, fill=255)
-            display.image(image)
-            display.show()
-        elif display_type == 'LCD':
-            display.cursor_pos = (0, 0)
-            display.write_string('Initializing loop...') 
-            display.cursor_pos = (1, 0)
-            display.write_string('Please wait         ')
-            display.cursor_pos = (2, 0)
-            display.write_string('                    ')
-            display.cursor_pos = (3, 0)
-            display.write_string('                    ')
-    except Exception as e:
-        print(f'Display error: {e}')
+    # Show recording message
+    if display:
+        try:
+            if display_type == 'OLED':
+                image = Image.new('1', (128, 64))
+                draw = ImageDraw.Draw(image)
+                font = ImageFont.load_default()
+                draw.text((20, 16), 'RECORDING...', font=font, fill=255)
+                draw.text((10, 32), 'Track 1 Active', font=font, fill=255)
+                display.display(image)
+            elif display_type == 'LCD':
+                display.clear()
+                write_lcd_rows(['RECORDING...', 'Track 1 Active', '', ''])
+        except Exception as e:
+            print(f'Display error: {e}')
 
-setup_is_recording = False
-setup_donerecording = True
-print(LENGTH)
-loops[0].initialize()
-print('length is ' + str(LENGTH))
+    #when the button is pressed, set the flag... looping_callback will see this flag. Also start recording on track 1
+    #(with auto-record the callback starts it at the first onset)
+    engine.start_first_recording()
+    if engine.auto_record:
+        print('Auto-record: recording starts when you play')
 
-#stop recording on track 1, light LEDs appropriately, then allow time for button release
-loops[0].set_recording()
-show_status()
-time.sleep(0.5)
+    #held down: the last seconds played before the press become the first loop instead
+    if capturer and not RECBUTTONS[0].wait_for_release(hold_time_length):
+        engine.cancel_first_recording()
+        try:
+            #returns once the master loop is set, or raises if there was not enough input to capture
+            capturer.capture_first(loops[0], config['capture']['first_seconds'], ago = time.monotonic() - pressed)
+            print('length is ' + str(engine.length))
+            show_status()
+            RECBUTTONS[0].wait_for_release()
+            time.sleep(0.5)
+            return
+        except (ValueError, RuntimeError) as e:
+            #record normally instead, from the release (the held button must not stop it right away)
+            print(e)
+            RECBUTTONS[0].wait_for_release()
+            engine.start_first_recording()
+
+    #turn off all LEDs except master loop record
+    for led in RECLEDS[1:]:
+        led.off()
+    for led in PLAYLEDS:
+        led.off()
+
+    #allow time for button release, otherwise pressing the button once will start and stop the recording
+    time.sleep(0.5)
+    print('Waiting for second button press to stop recording...')
+
+    # Update display to show waiting for stop
+    if display:
+        try:
+            if display_type == 'OLED':
+                image = Image.new('1', (128, 64))
+                draw = ImageDraw.Draw(image)
+                font = ImageFont.load_default()
+                draw.text((15, 8), 'RECORDING T1...', font=font, fill=255)
+                draw.text((5, 24), 'Press REC1 again', font=font, fill=255)
+                draw.text((25, 40), 'to finish', font=font, fill=255)
+                display.display(image)
+            elif display_type == 'LCD':
+                write_lcd_rows(['Recording T1...', 'Press REC1 again to', 'finish recording', ''])
+        except Exception as e:
+            print(f'Display error: {e}')
+
+    #now wait for button to be pressed again, then stop recording and initialize master loop
+    RECBUTTONS[0].wait_for_press()
+    while not engine.setup_is_recording:
+        #auto-record still waiting for the first onset: nothing to stop yet
+        print('Nothing recorded yet, play to start')
+        time.sleep(0.5)
+        RECBUTTONS[0].wait_for_press()
+    print('Button pressed! Stopping recording...')
+
+    # Show loop initialization message
+    if display:
+        try:
+            if display_type == 'OLED':
+                image = Image.new('1', (128, 64))
+                draw = ImageDraw.Draw(image)
+                font = ImageFont.load_default()
+                draw.text((15, 16), 'Initializing', font=font, fill=255)
+                draw.text((25, 32), 'Loop...', font=font, fill=255)
+                display.display(image)
+            elif display_type == 'LCD':
+                write_lcd_rows(['Initializing loop...', 'Please wait', '', ''])
+        except Exception as e:
+            print(f'Display error: {e}')
+
+    #stop recording on track 1 and initialize the master loop (sets LENGTH)
+    print(engine.length)
+    engine.finish_first_recording()
+    print('length is ' + str(engine.length))
+
+    #light LEDs appropriately, then allow time for button release
+    show_status()
+    time.sleep(0.5)
+
+if checkpointer and checkpointer.restored:
+    #skip recording the first loop, the restored session is already looping
+    print('Session restored - continuing jam session')
+    show_status()
+else:
+    record_first_loop()
+if checkpointer:
+    checkpointer.start()
 
 #UI do everything else
 
@@ -844,44 +497,67 @@ def finish():
     if not jam_session_active:
         print('Ignoring finish - jam session not yet active')
         return
+    if checkpointer:
+        checkpointer.discard() #intentional exit, don't restore this session on next start
     finished = True
 
+def stop_audio():
+    '''
+    stop_audio() frees the audio device for reuse (stopping the engine process, if there is one)
+    '''
+    if ENGINE_PROCESS:
+        engine.close()
+    else:
+        pa.terminate()
+
 #restart_looper() restarts this python script
-def restart_looper():
+def restart_looper(discard = True):
     if not jam_session_active:
         print('Ignoring restart - jam session not yet active')
         return
-    pa.terminate() #needed to free audio device for reuse
+    if checkpointer and discard:
+        checkpointer.discard() #new session requested
+    stop_audio() #needed to free audio device for reuse
     os.execlp('python3', 'python3', 'main.py') #replaces current process with a new instance of the same script
 
+# Track actions, shared by the buttons and the control API (which reports their errors to the client)
+def clear_or_undo(loop_index):
+    print(f'DEBUG: clear_or_undo called for loop {loop_index}')
+    loops[loop_index].clear_or_undo()
+    show_status()
+
+def set_recording(loop_index):
+    print(f'DEBUG: set_recording called for loop {loop_index}')
+    loops[loop_index].set_recording()
+    show_status()
+
+def toggle_mute(loop_index):
+    print(f'DEBUG: toggle_mute called for loop {loop_index}')
+    loops[loop_index].toggle_mute()
+    show_status()
+
 # Wrapper functions for button callbacks to catch exceptions
 def safe_clear_or_undo(loop_index):
     try:
-        print(f'DEBUG: clear_or_undo called for loop {loop_index}')
-        loops[loop_index].clear_or_undo()
-        show_status()
+        clear_or_undo(loop_index)
     except Exception as e:
         print(f'Error in clear_or_undo for loop {loop_index}: {e}')
 
 def safe_set_recording(loop_index):
     try:
-        print(f'DEBUG: set_recording called for loop {loop_index}')
-        loops[loop_index].set_recording()
-        show_status()
+        set_recording(loop_index)
     except Exception as e:
         print(f'Error in set_recording for loop {loop_index}: {e}')
 
 def safe_toggle_mute(loop_index):
     try:
-        print(f'DEBUG: toggle_mute called for loop {loop_index}')
-        loops[loop_index].toggle_mute()
-        show_status()
+        toggle_mute(loop_index)
     except Exception as e:
         print(f'Error in toggle_mute for loop {loop_index}: {e}')
 
 def safe_update_volume():
     try:
-        update_volume()
+        engine.update_volume() #slow to run, so called from the button release callback
     except Exception as e:
         print(f'Error in update_volume: {e}')
 
@@ -899,6 +575,141 @@ def safe_restart():
     except Exception as e:
         print(f'Error in restart_looper: {e}')
 
+def set_volume(volume):
+    '''
+    set_volume() sets the output volume, 0.1 to 1.5
+    '''
+    engine.output_volume = np.clip(volume, 0.1, 1.5)
+    print(f'Volume: {engine.output_volume:.2f} ({int(engine.output_volume * 100)}%)')
+
+def trim(steps):
+    '''
+    trim() changes the master loop length by 2 buffers per step, updating all loops; returns False if there is no loop yet
+    '''
+    if not (loops[0].initialized and engine.length > 0):
+        print('TRIM: No loop to trim (record first loop)')
+        return False
+    old_length = engine.length
+    engine.set_length(max(100, min(MAXLENGTH, engine.length + (steps * 2))))
+    print(f'Loop length: {old_length} -> {engine.length} buffers ({(engine.length * CHUNK) / RATE:.4f}s)')
+    return True
+
+def set_click(enabled):
+    '''
+    set_click() turns the click track on or off
+    '''
+    engine.click_enabled = enabled
+    print(f'Click track: {"ON" if engine.click_enabled else "OFF"}')
+
+def set_auto(enabled):
+    '''
+    set_auto() turns auto-record on or off: armed tracks start at the first onset in the input
+    '''
+    engine.auto_record = enabled
+    print(f'Auto-record: {"ON" if engine.auto_record else "OFF"}')
+
+def select_scene(steps):
+    '''
+    select_scene() moves the scene to switch to at the next loop boundary by steps
+    '''
+    pending = engine.pending_scene
+    scene = ((engine.scene if pending is None else pending) + steps) % SCENES
+    engine.select_scene(scene)
+    print(f'Scene {scene + 1} at the next loop start')
+
+def set_effects(loop, mask):
+    '''
+    set_effects() turns the track's insert effects on and off to match the bits of mask (EFFECT_NAMES[i] = bit i)
+    '''
+    #effects going off first, so they free their share of the budget
+    for enabled in (False, True):
+        for i, name in enumerate(EFFECT_NAMES):
+            if bool(mask >> i & 1) == enabled and bool(loop.effects >> i & 1) != enabled:
+                loop.set_effect(name, enabled)
+    names = [name for i, name in enumerate(EFFECT_NAMES) if loop.effects >> i & 1]
+    print(f'Track {loop.index + 1} effects: {"+".join(names) or "none"}')
+
+# Control API actions: the same functions as the buttons and the encoder menu
+def api_track(request):
+    track = request.get('track')
+    if not isinstance(track, int) or not 1 <= track <= TRACKS:
+        raise ValueError(f'track must be 1 to {TRACKS}')
+    return track - 1
+
+def api_volume(request):
+    if 'value' in request:
+        set_volume(float(request['value']))
+    else:
+        set_volume(engine.output_volume + int(request.get('steps', 0)) * 0.01)
+
+def api_trim(request):
+    if not trim(int(request.get('steps', 0))):
+        raise ValueError('no loop to trim')
+
+def api_click(request):
+    set_click(bool(request['enabled']) if 'enabled' in request else not engine.click_enabled)
+
+def api_auto(request):
+    set_auto(bool(request['enabled']) if 'enabled' in request else not engine.auto_record)
+
+def api_scene(request):
+    scene = request.get('scene')
+    if not isinstance(scene, int) or not 1 <= scene <= SCENES:
+        raise ValueError(f'scene must be 1 to {SCENES}')
+    engine.select_scene(scene - 1)
+
+def api_fx(request):
+    loop = loops[api_track(request)]
+    name = request.get('effect')
+    if name not in EFFECT_NAMES:
+        raise ValueError(f'effect must be one of {", ".join(EFFECT_NAMES)}')
+    bit = 1 << EFFECT_NAMES.index(name)
+    set_effects(loop, loop.effects | bit if request.get('enabled', not loop.effects & bit) else loop.effects & ~bit)
+
+def api_capture(request):
+    if not capturer:
+        raise ValueError('capturing needs capture enabled')
+    if 'loops' in request:
+        capturer.capture(loops[api_track(request)], loops = int(request['loops']))
+    else:
+        capturer.capture(loops[api_track(request)], seconds = float(request.get('seconds', 0)))
+
+def api_save(request):
+    if not checkpointer:
+        raise ValueError('saving needs autosave enabled')
+    checkpointer.save(str(request.get('name', '')))
+
+def api_load(request):
+    if not checkpointer:
+        raise ValueError('loading needs autosave enabled')
+    if not jam_session_active:
+        raise ValueError('jam session not yet active')
+    checkpointer.load(str(request.get('name', '')))
+    #restart once the reply is out; the restarted looper restores the loaded session
+    threading.Timer(0.5, restart_looper, kwargs = {'discard': False}).start()
+
+def api_import(request):
+    if not importer:
+        raise ValueError('importing needs import enabled')
+    master = bool(request.get('master', False))
+    importer.load(loops[0 if master else api_track(request)], str(request.get('file', '')), master)
+
+control_actions = {
+    'record': lambda request: set_recording(api_track(request)),
+    'mute': lambda request: toggle_mute(api_track(request)),
+    'clear': lambda request: clear_or_undo(api_track(request)),
+    'volume': api_volume,
+    'trim': api_trim,
+    'click': api_click,
+    'auto': api_auto,
+    'scene': api_scene,
+    'fx': api_fx,
+    'capture': api_capture,
+    'save': api_save,
+    'load': api_load,
+    'import': api_import,
+}
+
 # Rotary encoder callback functions
 def encoder_button_pressed():
     '''Cycle through menu items when encoder button is pressed'''
@@ -914,7 +725,7 @@ def encoder_button_pressed():
 
 def encoder_rotated():
     '''Handle encoder rotation based on current menu item'''
-    global output_volume, LENGTH, click_track_enabled
+    global selected_track
     
     if not encoder:
         return
@@ -928,32 +739,91 @@ def encoder_rotated():
         
         if menu == 'VOL':
             # Adjust output volume (0.1 to 1.5) - finer steps
-            output_volume = np.clip(output_volume + (steps * 0.01), 0.1, 1.5)
-            print(f'Volume: {output_volume:.2f} ({int(output_volume * 100)}%)')
+            set_volume(engine.output_volume + (steps * 0.01))
             
         elif menu == 'TRIM':
             # Adjust loop length (only if initialized)
-            if loops[0].initialized and LENGTH > 0:
-                old_length = LENGTH
-                # Adjust by 2 buffers per step - finer control
-                LENGTH = max(100, min(MAXLENGTH, LENGTH + (steps * 2)))
-                
-                # Update all loops to new length
-                for loop in loops:
-                    if loop.initialized:
-                        loop.length = LENGTH
-                        # Ensure readp/writep are within bounds
-                        loop.readp = loop.readp % LENGTH
-                        loop.writep = loop.writep % LENGTH
-                
-                print(f'Loop length: {old_length} -> {LENGTH} buffers ({(LENGTH * CHUNK) / RATE:.4f}s)')
-            else:
-                print('TRIM: No loop to trim (record first loop)')
+            trim(steps)
                 
         elif menu == 'CLK':
             # Toggle click track
-            click_track_enabled = not click_track_enabled
-            print(f'Click track: {"ON" if click_track_enabled else "OFF"}')
+            set_click(not engine.click_enabled)
+            
+        elif menu == 'AUTO':
+            # Toggle auto-record (armed tracks start at the first onset)
+            set_auto(not engine.auto_record)
+            
+        elif menu == 'TRK':
+            # Select the track adjusted by GAIN, FB, SOS, MODE, FIT, PITCH, PAN, FX and CAP
+            selected_track = (selected_track + steps) % TRACKS
+            print(f'Selected track {selected_track + 1}')
+            
+        elif menu == 'GAIN':
+            # Adjust selected track level (0 to 200%), ramped by the mixer
+            loop = loops[selected_track]
+            loop.set_gain(loop.gain + (steps * 0.01))
+            print(f'Track {selected_track + 1} gain: {int(loop.gain * 100)}%')
+            
+        elif menu == 'FB':
+            # Adjust selected track overdub feedback (0 to 100%)
+            loop = loops[selected_track]
+            loop.set_feedback(loop.feedback + (steps * 0.01))
+            print(f'Track {selected_track + 1} feedback: {int(round(loop.feedback * 100))}%')
+            
+        elif menu == 'SOS':
+            # Toggle sound-on-sound (continuous overdub) on the selected track
+            loop = loops[selected_track]
+            loop.set_sos(not loop.sos)
+            print(f'Track {selected_track + 1} sound-on-sound: {"ON" if loop.sos else "OFF"}')
+            
+        elif menu == 'MODE':
+            # Cycle the selected track's playback mode (forward, reverse, half speed, double speed)
+            loop = loops[selected_track]
+            loop.set_mode(PLAYBACK_MODES[(PLAYBACK_MODES.index(loop.mode) + steps) % len(PLAYBACK_MODES)])
+            print(f'Track {selected_track + 1} playback: {loop.mode}')
+            
+        elif menu == 'FIT':
+            # Time-stretch the selected track's recording to its current length (after TRIM), in the background
+            loop = loops[selected_track]
+            if loop.initialized:
+                stretcher.fit(loop)
+                print(f'Track {selected_track + 1}: fitting {loop.content_length} rows to {loop.length_factor * engine.length}')
+            
+        elif menu == 'PITCH':
+            # Pitch-shift the selected track by one semitone per step, in the background
+            loop = loops[selected_track]
+            if loop.initialized:
+                stretcher.pitch(loop, steps)
+                print(f'Track {selected_track + 1}: pitch shift {steps:+d} semitones')
+            
+        elif menu == 'PAN':
+            # Adjust selected track pan (-1 = left, 1 = right), ramped by the mixer
+            loop = loops[selected_track]
+            loop.set_pan(loop.pan + (steps * 0.02))
+            print(f'Track {selected_track + 1} pan: {loop.pan:+.2f}')
+            
+        elif menu == 'SCN':
+            # Choose the scene to switch to at the next master loop boundary
+            try:
+                select_scene(steps)
+            except (ValueError, RuntimeError) as e:
+                print(e)
+            
+        elif menu == 'FX':
+            # Step the selected track through the combinations of its insert effects (refused over the budget)
+            loop = loops[selected_track]
+            try:
+                set_effects(loop, (loop.effects + steps) % (1 << len(EFFECT_NAMES)))
+            except (ValueError, RuntimeError) as e:
+                print(e)
+            
+        elif menu == 'CAP':
+            # Capture the last master loops played into the selected track (one per step clockwise), in the background
+            if steps > 0:
+                try:
+                    capturer.capture(loops[selected_track], loops = steps)
+                except (ValueError, RuntimeError) as e:
+                    print(e)
     
     # Reset encoder steps
     encoder.steps = 0
@@ -967,11 +837,14 @@ def encoder_rotated():
 
 #now defining functions of all the buttons during jam session...
 
-for i in range(4):
-    RECBUTTONS[i].when_held = lambda idx=i: safe_clear_or_undo(idx)
-    RECBUTTONS[i].when_pressed = lambda idx=i: safe_set_recording(idx)
-    RECBUTTONS[i].when_released = safe_update_volume
-    PLAYBUTTONS[i].when_pressed = lambda idx=i: safe_toggle_mute(idx)
+#tracks beyond the configured pins have no buttons
+for i, button in enumerate(RECBUTTONS[:TRACKS]):
+    button.when_held = lambda idx=i: safe_clear_or_undo(idx)
+    button.when_pressed = lambda idx=i: safe_set_recording(idx)
+    if not config['limiter']['enabled']:
+        button.when_released = safe_update_volume #the limiter makes the global peak scan unnecessary
+for i, button in enumerate(PLAYBUTTONS[:TRACKS]):
+    button.when_pressed = lambda idx=i: safe_toggle_mute(idx)
 
 # Setup rotary encoder callbacks if available
 if encoder and encoder_button:
@@ -979,29 +852,38 @@ if encoder and encoder_button:
     # Poll encoder in main loop since when_rotated isn't reliable
     print('Rotary encoder menu enabled: Press button to cycle menu, rotate to adjust')
 
+# Local control/telemetry API, for scripted control alongside the buttons
+if config['control']['enabled']:
+    control_server = ControlServer(config['control']['socket'], engine, control_actions,
+                                   rate = config['control']['telemetry_rate'], batch = config['control']['telemetry_batch'])
+    control_server.start()
+
 # Wait for all buttons to be released before attaching finish/restart handlers
 time.sleep(0.5)
-print('Ready for jam session! Hold PLAYBUTTON 4 (GPIO 20) for 2 sec to exit, or PLAYBUTTON 1 (GPIO 19) to restart')
+print(f"Ready for jam session! Hold PLAYBUTTON {len(PLAYBUTTONS)} (GPIO {gpio['play_buttons'][-1]}) for 2 sec to exit, or PLAYBUTTON 1 (GPIO {gpio['play_buttons'][0]}) to restart")
 
 # Don't attach finish/restart handlers yet - wait for jam session to stabilize
 jam_session_active = False
 
+configure_ui_thread()
+
 #this while loop runs during the jam session.
 try:
     # Wait a few loop iterations before enabling exit/restart to avoid spurious triggers
-    for _ in range(30):  # Wait 3 seconds (30 * 0.1)
+    for _ in range(int(3 / POLL_INTERVAL)):  # Wait 3 seconds
         show_status()
-        time.sleep(0.1)
+        time.sleep(POLL_INTERVAL)
     
     # Check button states before enabling exit/restart
     print('Checking button states...')
     stuck_buttons = []
-    for i in range(4):
-        if PLAYBUTTONS[i].is_pressed:
-            print(f'WARNING: PLAYBUTTON {i} (GPIO {[19,26,21,20][i]}) is stuck pressed!')
+    for i, button in enumerate(PLAYBUTTONS):
+        if button.is_pressed:
+            print(f"WARNING: PLAYBUTTON {i} (GPIO {gpio['play_buttons'][i]}) is stuck pressed!")
             stuck_buttons.append(f'PLAY{i}')
-        if RECBUTTONS[i].is_pressed:
-            print(f'WARNING: RECBUTTON {i} (GPIO {[11,5,6,13][i]}) is stuck pressed!')
+    for i, button in enumerate(RECBUTTONS):
+        if button.is_pressed:
+            print(f"WARNING: RECBUTTON {i} (GPIO {gpio['rec_buttons'][i]}) is stuck pressed!")
             stuck_buttons.append(f'REC{i}')
     
     if stuck_buttons:
@@ -1009,27 +891,35 @@ try:
         print('Hardware issue detected - buttons may not work correctly')
         print('Check your wiring: buttons should connect GPIO to GROUND when pressed')
     
-    # Now safe to enable finish/restart (only if button 3 is not stuck)
+    # Now safe to enable finish/restart (only if the last play button is not stuck)
     jam_session_active = True
-    if not PLAYBUTTONS[3].is_pressed:
-        PLAYBUTTONS[3].when_held = safe_finish
-        print('Exit handler enabled on PLAYBUTTON 3')
+    if not PLAYBUTTONS[-1].is_pressed:
+        PLAYBUTTONS[-1].when_held = safe_finish
+        print(f'Exit handler enabled on PLAYBUTTON {len(PLAYBUTTONS) - 1}')
     else:
-        print('PLAYBUTTON 3 exit handler DISABLED (button stuck)')
+        print(f'PLAYBUTTON {len(PLAYBUTTONS) - 1} exit handler DISABLED (button stuck)')
     PLAYBUTTONS[0].when_held = safe_restart
     print('Restart handler enabled on PLAYBUTTON 0')
     print('Program running - use CTRL+C to force exit')
     
+    last_display_refresh = engine.callback_count
     while not finished:
-        show_status()
+        if display_type == 'OLED' and not ENGINE_PROCESS:
+            waveform.update() #fold the rows written since the last poll into the waveform overview
+        show_status(update_display = False)
+        # Redraw the display from the meter and waveform snapshots every DISPLAY_REFRESH_BUFFERS audio buffers
+        # (button and encoder actions redraw it straight away)
+        if display and engine.callback_count - last_display_refresh >= DISPLAY_REFRESH_BUFFERS:
+            last_display_refresh = engine.callback_count
+            update_display_status()
         # Poll rotary encoder
         if encoder:
             encoder_rotated()
-        time.sleep(0.1)
+        time.sleep(POLL_INTERVAL)
 except Exception as e:
     print(f'Error during jam session: {e}')
     import traceback
     traceback.print_exc()
 finally:
-    pa.terminate()
+    stop_audio()
     print('Done...')
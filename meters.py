@@ -0,0 +1,74 @@
+'''
+meters.py contains the level meters for the input, every track and the master output.
+
+Levels are computed once per callback with vectorized reductions (peak = max of abs,
+RMS = sqrt of mean square) and published as an immutable MeterSnapshot. Readers
+(display, control API) just read meters.snapshot: the callback replaces the whole object,
+so no lock is needed and a reader never sees half an update.
+
+All levels are fractions of full scale (0.0 to 1.0). Peaks fall back by peak_decay per
+callback so that short transients stay visible at the display refresh rate.
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+FULL_SCALE = 2**15
+
+MeterSnapshot = namedtuple('MeterSnapshot', [
+    'input_peak', 'input_rms', #floats
+    'track_peak', 'track_rms', #float32 arrays, one entry per track
+    'master_peak', 'master_rms', #floats, loudest channel
+    'gain_reduction', #lowest limiter gain in the last callback (1.0 = no limiting)
+])
+
+def level_to_db(level, floor = -60.0):
+    '''
+    level_to_db() converts a level (fraction of full scale) to dBFS, clamped at floor
+    '''
+    return max(floor, 20 * np.log10(max(level, 1e-9)))
+
+def level_to_bar(level, steps, floor = -48.0):
+    '''
+    level_to_bar() maps a level to a bar length of 0..steps on a dB scale from floor to 0dBFS
+    '''
+    return int(round(steps * (level_to_db(level, floor) - floor) / -floor))
+
+class Meters:
+    def __init__(self, tracks, chunk, peak_decay = 0.95):
+        self.chunk = chunk
+        self.peak_decay = peak_decay
+        self.input_peak = 0.0
+        self.master_peak = 0.0
+        self.track_peak = np.zeros([tracks], dtype = np.float32)
+        self.snapshot = MeterSnapshot(0.0, 0.0, np.zeros([tracks], dtype = np.float32), np.zeros([tracks], dtype = np.float32), 0.0, 0.0, 1.0)
+
+    def update(self, input_buffer, track_rows, track_gains, master, gain_reduction = 1.0):
+        '''
+        update() measures one callback's worth of audio and publishes a new snapshot
+
+        input_buffer: int16 [sample] input, as recorded
+        track_rows: float32 [track, sample] audio of each track before gain
+        track_gains: float32 [track] gain applied to each track
+        master: float32 [channel, sample] master output
+        '''
+        scale = 1.0 / FULL_SCALE
+        inv_chunk = 1.0 / self.chunk
+
+        input_peak = int(np.max(np.abs(input_buffer.astype(np.int32)))) * scale
+        input_rms = np.sqrt(np.dot(input_buffer, input_buffer.astype(np.float32)) * inv_chunk) * scale
+
+        track_peak = np.max(np.abs(track_rows), axis = 1) * track_gains * scale
+        track_rms = np.sqrt(np.einsum('ts,ts->t', track_rows, track_rows) * inv_chunk) * track_gains * scale
+
+        master_peak = float(np.max(np.abs(master))) * scale
+        master_rms = float(np.sqrt(np.max(np.einsum('cs,cs->c', master, master)) * inv_chunk)) * scale
+
+        #peak fall-back
+        self.input_peak = max(input_peak, self.input_peak * self.peak_decay)
+        self.master_peak = max(master_peak, self.master_peak * self.peak_decay)
+        self.track_peak = np.maximum(track_peak, self.track_peak * self.peak_decay)
+
+        self.snapshot = MeterSnapshot(self.input_peak, float(input_rms), self.track_peak, track_rms.astype(np.float32),
+                                      self.master_peak, master_rms, gain_reduction)
@@ -0,0 +1,164 @@
+'''
+midiclock.py contains MIDI clock sync with drum machines and sequencers.
+
+Clock out: the master loop is beats_per_loop beats long, so it carries 24 * beats_per_loop
+clock ticks (24 PPQN). process() runs in the audio callback right after engine.process(): it
+finds the ticks that fall inside the buffer just mixed and timestamps each one to the sample,
+from PortAudio's DAC time for that buffer. Start is sent on the first tick of the first
+loop pass, stop when the master loop goes away. The callback only appends (time, status)
+pairs to a deque; a sender thread sleeps until each timestamp and writes to the port.
+
+Clock in: incoming clock ticks are timestamped on arrival. Once per beat the average tick
+interval over the last two beats gives the tempo, and the master loop length (LENGTH)
+follows it through engine.set_length(), like a TRIM.
+
+Ports are opened with mido (python-rtmidi backend). An empty port name creates a virtual
+ALSA port called raspi-looper that other software can connect to.
+'''
+
+import collections
+import threading
+import time
+
+PPQN = 24
+CLOCK = 0xF8
+START = 0xFA
+STOP = 0xFC
+VIRTUAL_PORT = 'raspi-looper'
+
+def open_port(name, output):
+    '''
+    open_port() opens the named MIDI port, or a virtual one if name is empty
+    '''
+    import mido
+    opener = mido.open_output if output else mido.open_input
+    if name:
+        return opener(name)
+    return opener(VIRTUAL_PORT, virtual = True)
+
+class MidiClock:
+    def __init__(self, engine, beats_per_loop = 4):
+        self.engine = engine
+        self.beats_per_loop = beats_per_loop
+        self.output = None
+        self.messages = {} #status byte -> message for the output port
+        self.events = collections.deque() #(time.monotonic() time, status byte), in time order
+        self.wakeup = threading.Event()
+        self.running = False #start has been sent
+        self.ticks_sent = 0
+        self.late = 0 #events sent more than 1ms after their time
+        self.input = None
+        self.tick_times = collections.deque(maxlen = 2 * PPQN + 1) #arrival times of the last two beats of incoming ticks
+        self.ticks_received = 0
+        self.tempo_in = 0.0 #bpm of the incoming clock, 0 until known
+
+    def open_output(self, name = ''):
+        '''
+        open_output() opens the clock output port and starts the sender thread
+        '''
+        import mido
+        self.output = open_port(name, True)
+        self.messages = {status: mido.Message.from_bytes([status]) for status in (CLOCK, START, STOP)}
+        threading.Thread(target = self.send_events, name = 'midi-clock', daemon = True).start()
+        print(f'MIDI clock out on {self.output.name} ({self.beats_per_loop} beats per loop)')
+
+    def open_input(self, name = ''):
+        '''
+        open_input() opens the clock input port; LENGTH follows the incoming tempo from then on
+        '''
+        self.input = open_port(name, False)
+        self.input.callback = self.receive
+        print(f'MIDI clock in on {self.input.name} ({self.beats_per_loop} beats per loop)')
+
+    def process(self, time_info):
+        '''
+        process() queues the clock events of the buffer engine.process() just returned
+
+        called from the audio callback with the callback's time_info
+        '''
+        if self.output is None:
+            return
+        engine = self.engine
+        now = time.monotonic()
+        dac_time = time_info.get('output_buffer_dac_time', 0.0) if time_info else 0.0
+        current_time = time_info.get('current_time', 0.0) if time_info else 0.0
+        if dac_time > 0 and current_time > 0:
+            #stream clock to time.monotonic()
+            buffer_time = now + (dac_time - current_time)
+        else:
+            buffer_time = now + engine.chunk / engine.rate #host gives no timing, assume one buffer of output latency
+        if engine.limiter:
+            buffer_time += engine.limiter.lookahead / engine.rate
+
+        row = engine.master_row
+        if row < 0 or engine.length <= 0:
+            if self.running:
+                self.running = False
+                self.events.append((buffer_time, STOP))
+                self.wakeup.set()
+            return
+        #ticks k with k * loop_samples / ticks_per_loop inside [start, start + chunk)
+        ticks_per_loop = PPQN * self.beats_per_loop
+        loop_samples = engine.length * engine.chunk
+        start = row * engine.chunk
+        first = -(-start * ticks_per_loop // loop_samples)
+        end = -(-(start + engine.chunk) * ticks_per_loop // loop_samples)
+        if not self.running:
+            if first != 0:
+                return #start on the loop's first tick
+            self.running = True
+            self.events.append((buffer_time, START))
+        seconds_per_sample = 1.0 / engine.rate
+        for tick in range(first, end):
+            offset = tick * loop_samples / ticks_per_loop - start
+            self.events.append((buffer_time + offset * seconds_per_sample, CLOCK))
+        if first < end:
+            self.wakeup.set()
+
+    def send_events(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while self.events:
+                when, status = self.events.popleft()
+                delay = when - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -0.001:
+                    self.late += 1
+                try:
+                    self.output.send(self.messages[status])
+                except Exception as e:
+                    print(f'MIDI clock send error: {e}')
+                if status == CLOCK:
+                    self.ticks_sent += 1
+
+    def receive(self, message):
+        '''
+        receive() handles one incoming message (called on the MIDI input thread)
+        '''
+        if message.type == 'clock':
+            self.tick_times.append(time.monotonic())
+            self.ticks_received += 1
+            if self.ticks_received % PPQN == 0:
+                self.follow()
+        elif message.type in ('start', 'stop'):
+            self.tick_times.clear() #a new run may have a new tempo
+
+    def follow(self):
+        '''
+        follow() sets LENGTH from the tempo of the incoming clock
+        '''
+        times = self.tick_times
+        if len(times) < times.maxlen:
+            return
+        interval = (times[-1] - times[0]) / (len(times) - 1)
+        self.tempo_in = 60.0 / (PPQN * interval)
+        engine = self.engine
+        if not engine.setup_donerecording or engine.length <= 0:
+            return
+        rows = self.beats_per_loop * PPQN * interval * engine.rate / engine.chunk
+        #hysteresis, so jitter around a rounding boundary doesn't make LENGTH flicker
+        if abs(rows - engine.length) > 0.75 and round(rows) <= engine.maxlength:
+            print(f'MIDI clock in: {self.tempo_in:.1f} bpm, loop length {engine.length} -> {round(rows)} buffers')
+            engine.set_length(round(rows))
@@ -0,0 +1,65 @@
+'''
+onset.py contains the onset detector used by auto-record (engine.auto_record).
+
+With auto-record on, an armed track doesn't start at a button press or at the master loop
+restart but at the first sample of the input that reaches the threshold. Detection is one
+vectorized comparison per CHUNK while something is armed, and gives the onset to the sample.
+
+Recording starts preroll samples before the onset so the attack is never cut. The pre-roll
+comes from InputHistory, the last few buffers of recorded input kept in a small preallocated
+buffer that every callback shifts by one CHUNK (a few kB, cheaper than ring arithmetic for
+slices that have to be contiguous).
+'''
+
+import numpy as np
+
+class InputHistory:
+    def __init__(self, chunk, samples):
+        self.chunk = chunk
+        rows = -(-samples // chunk) + 1
+        self.buffer = np.zeros([rows * chunk], dtype = np.int16) #oldest sample first, the current buffer last
+
+    def push(self, data):
+        '''
+        push() appends the current buffer, dropping the oldest one
+        '''
+        chunk = self.chunk
+        self.buffer[:-chunk] = self.buffer[chunk:]
+        self.buffer[-chunk:] = data
+
+    def delayed(self, delay):
+        '''
+        delayed() returns (a view of) the CHUNK samples that ended delay samples before the end of the current buffer
+        '''
+        end = len(self.buffer) - delay
+        return self.buffer[end - self.chunk:end]
+
+class OnsetDetector:
+    def __init__(self, rate, chunk, threshold_db = -30.0, preroll_ms = 5.0):
+        self.chunk = chunk
+        self.threshold = max(1, int(round(32768 * 10 ** (threshold_db / 20)))) #on the raw input, before input_shift
+        self.preroll = int(round(preroll_ms * rate / 1000)) #samples recorded before the onset
+        #enough for the pre-roll, the first recorded buffer and the one before it (for the loop crossfade)
+        self.history = InputHistory(chunk, self.preroll + 3 * chunk)
+        self.above = np.zeros([chunk], dtype = bool)
+        self.below = np.zeros([chunk], dtype = bool)
+        self.masked = np.zeros([chunk], dtype = np.int16)
+
+    def detect(self, data):
+        '''
+        detect() returns the index of the first sample of data (int16 [CHUNK]) at or above the threshold, -1 if there is none
+        '''
+        np.greater_equal(data, self.threshold, out = self.above)
+        np.less_equal(data, -self.threshold, out = self.below)
+        np.logical_or(self.above, self.below, out = self.above)
+        i = int(np.argmax(self.above))
+        return i if self.above[i] else -1
+
+    def from_onset(self, back, start):
+        '''
+        from_onset() returns the buffer back buffers before the current one with the samples before start
+        (an offset into the current buffer, negative for earlier ones) silenced
+        '''
+        np.copyto(self.masked, self.history.delayed(back * self.chunk))
+        self.masked[:min(self.chunk, max(0, start + back * self.chunk))] = 0
+        return self.masked
@@ -0,0 +1,145 @@
+'''
+realtime.py contains the opt-in realtime setup of the audio callback thread.
+
+With threads.realtime enabled:
+- the loop arena is pre-faulted at startup (see arena.py), even if memory.prefault is off
+- the process memory is locked with mlockall, so buffers can't be paged out later
+- every other thread is moved off threads.audio_cpu, and the audio callback thread
+  pins itself to that core and switches to SCHED_FIFO
+
+Each step can fail without root or the right rlimits (see LimitRTPRIO/LimitMEMLOCK in
+raspi-looper.service), so nothing here raises: report() reads back what actually took effect.
+'''
+
+import ctypes
+import os
+import resource
+import threading
+
+from arena import libc
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+MCL_ONFAULT = 4
+
+DEFAULT_PRIORITY = 70 #SCHED_FIFO priority used in realtime mode when threads.audio_priority is 0
+
+def lock_memory():
+    '''
+    lock_memory() locks current and future pages of the process in RAM, returns an error string or None
+
+    MCL_ONFAULT locks pages as they are first touched instead of populating every mapping
+    (e.g. the autosave image) up front; older kernels without it lock everything
+    '''
+    for flags in (MCL_CURRENT | MCL_FUTURE | MCL_ONFAULT, MCL_CURRENT | MCL_FUTURE):
+        if libc().mlockall(flags) == 0:
+            return None
+        errno = ctypes.get_errno()
+        if errno != 22: #EINVAL: MCL_ONFAULT not supported
+            break
+    return os.strerror(errno)
+
+def locked_kb():
+    '''
+    locked_kb() returns VmLck (kB of locked memory) of this process
+    '''
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmLck:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def rlimit_text(limit):
+    soft = resource.getrlimit(limit)[0]
+    return 'unlimited' if soft == resource.RLIM_INFINITY else str(soft)
+
+class Realtime:
+    def __init__(self, enabled = False, priority = 0, cpu = -1):
+        self.enabled = enabled
+        self.priority = priority if priority > 0 or not enabled else DEFAULT_PRIORITY
+        self.cpu = cpu if enabled else -1
+        self.results = {} #step -> error string (None = took effect), filled in as steps run
+        self.audio_thread = None #(native id, policy, priority, cpus) read back by the audio thread itself
+
+    def prepare(self, arena):
+        '''
+        prepare() pre-faults the loop arena, locks memory and moves the other threads off the audio core
+
+        called once from the main thread, after the engine is created and before the stream is opened
+        '''
+        if not self.enabled:
+            return
+        if not arena.prefaulted:
+            arena.prefault()
+        self.results['mlockall'] = lock_memory()
+        if self.cpu >= 0:
+            self.results['isolate'] = self.isolate_cpu()
+
+    def isolate_cpu(self):
+        '''
+        isolate_cpu() restricts every existing thread to the cores other than the audio core
+
+        threads created later (including PortAudio's) inherit the mask of their creator
+        '''
+        try:
+            cpus = os.sched_getaffinity(0)
+            if self.cpu not in cpus:
+                return f'cpu {self.cpu} not available (have {sorted(cpus)})'
+            others = cpus - {self.cpu}
+            if not others:
+                return 'only one cpu, nothing to isolate from'
+            for tid in os.listdir('/proc/self/task'):
+                os.sched_setaffinity(int(tid), others)
+        except (AttributeError, OSError) as e:
+            return str(e)
+        return None
+
+    def configure_audio_thread(self):
+        '''
+        configure_audio_thread() pins the calling thread to the audio core and applies SCHED_FIFO
+
+        must be called from the audio callback itself, since PortAudio creates that thread
+        '''
+        if self.cpu >= 0:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+                self.results['pin'] = None
+            except (AttributeError, OSError) as e:
+                self.results['pin'] = str(e)
+        if self.priority > 0:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+                self.results['sched_fifo'] = None
+            except (AttributeError, OSError) as e:
+                self.results['sched_fifo'] = str(e)
+        try:
+            self.audio_thread = (threading.get_native_id(), os.sched_getscheduler(0), os.sched_getparam(0).sched_priority, sorted(os.sched_getaffinity(0)))
+        except (AttributeError, OSError):
+            pass
+
+    def report(self):
+        '''
+        report() returns a list of lines saying which realtime settings actually took effect
+        '''
+        def status(step):
+            if step not in self.results:
+                return 'not applied'
+            return 'ok' if self.results[step] is None else 'FAILED: ' + self.results[step]
+
+        lines = [f'Realtime mode: {"on" if self.enabled else "off"}']
+        if self.audio_thread:
+            tid, policy, priority, cpus = self.audio_thread
+            policy_name = 'SCHED_FIFO' if policy == getattr(os, 'SCHED_FIFO', None) else 'normal'
+            lines.append(f'  audio thread {tid}: {policy_name} priority {priority}, cpus {cpus}')
+        else:
+            lines.append('  audio thread: not started')
+        if self.priority > 0:
+            lines.append(f'  SCHED_FIFO {self.priority}: {status("sched_fifo")} (RLIMIT_RTPRIO {rlimit_text(resource.RLIMIT_RTPRIO)})')
+        if self.cpu >= 0:
+            lines.append(f'  pin to cpu {self.cpu}: {status("pin")}, other threads moved off: {status("isolate")}')
+        if self.enabled:
+            lines.append(f'  mlockall: {status("mlockall")}, {locked_kb()} kB locked (RLIMIT_MEMLOCK {rlimit_text(resource.RLIMIT_MEMLOCK)})')
+        return lines
@@ -0,0 +1,167 @@
+'''
+screen.py renders the status screen (loop time, track states, level meters, waveform overview,
+menu) for the OLED and the LCD.
+
+Screen only reads the engine, its meter snapshot and the waveform mipmaps, and draws into the
+draw target it is given (a PIL ImageDraw for the OLED) or returns the rows of text (LCD), so the
+same frame is drawn by main.py's update_display_status() and timed by benchmarks/bench_suite.py
+without a display attached. The menu line is passed in, as the menu belongs to the UI.
+'''
+
+import numpy as np
+
+from controlapi import track_state
+from meters import level_to_bar
+
+OLED_WIDTH = 128
+
+class Screen:
+    def __init__(self, engine, waveform, rate):
+        self.engine = engine
+        self.waveform = waveform
+        self.row_seconds = engine.chunk / rate #duration of one loop row
+        tracks = len(engine.loops)
+        #label for the track status line, e.g. 'T1234' for four tracks
+        self.track_label = 'T' + ''.join(str(i + 1) for i in range(tracks)) if tracks <= 4 else 'Trk'
+
+    def draw_meters(self, draw):
+        '''
+        draw_meters() draws level bars (peak, dB scale) in the gaps between the OLED text lines:
+        input below line 1, one bar per track below line 2, master below line 3
+        '''
+        snapshot = self.engine.meters.snapshot
+        length = level_to_bar(snapshot.input_peak, OLED_WIDTH - 1)
+        if length:
+            draw.rectangle((0, 13, length, 14), fill=255)
+        width = OLED_WIDTH // len(snapshot.track_peak)
+        for i, level in enumerate(snapshot.track_peak):
+            length = level_to_bar(level, width - 2)
+            if length:
+                draw.rectangle((i * width, 29, i * width + length, 30), fill=255)
+        length = level_to_bar(snapshot.master_peak, OLED_WIDTH - 1)
+        if length:
+            draw.rectangle((0, 45, length, 46), fill=255)
+
+    def draw_waveform(self, draw, loop, top, height):
+        '''
+        draw_waveform() draws the track's whole loop as a min/max envelope (one column per pixel)
+        with a playhead, read from the waveform mipmaps; returns False if the track is empty
+        '''
+        envelope = self.waveform.columns(loop, OLED_WIDTH)
+        if envelope is None:
+            return False
+        lo, hi = envelope
+        #normalize to the loudest column, at most 16x so silence stays flat
+        scale = (height - 1) / 2 / max(1 / 16, float(hi.max()), float(-lo.min()))
+        middle = top + (height - 1) / 2
+        y_hi = np.round(middle - hi * scale).astype(int)
+        y_lo = np.round(middle - lo * scale).astype(int)
+        for x in range(OLED_WIDTH):
+            draw.line((x, y_hi[x], x, y_lo[x]), fill=255)
+        if loop.initialized:
+            playhead = loop.readp * OLED_WIDTH // loop.length
+            draw.line((playhead, top, playhead, top + height - 1), fill=255)
+        return True
+
+    def lcd_meters(self):
+        '''
+        lcd_meters() returns one bar character per track, a space, then input and master bars (custom characters 0-7)
+        '''
+        snapshot = self.engine.meters.snapshot
+        def bar(level):
+            height = level_to_bar(level, 8)
+            return chr(height - 1) if height > 0 else " "
+        return "".join(bar(level) for level in snapshot.track_peak) + " " + bar(snapshot.input_peak) + bar(snapshot.master_peak)
+
+    def draw_oled(self, draw, font, selected, menu):
+        '''
+        draw_oled() draws one 128x64 OLED frame into draw: loop time, track states, the waveform of track selected
+        (or the position), the meters and menu (or the countdown to the restart waiting tracks wait for)
+        '''
+        engine = self.engine
+        loops = engine.loops
+        LENGTH = engine.length
+        waiting_tracks = sum(1 for loop in loops if loop.is_waiting)
+
+        # Line 1: Loop time (no percentage)
+        if LENGTH > 0:
+            line1 = f"Loop: {LENGTH * self.row_seconds:.4f}s"
+        else:
+            line1 = "Ready to record"
+        draw.text((0, 0), line1, font=font, fill=255)
+
+        # Line 2: Track status (R=Recording, W=Waiting, P=Playing, M=Muted, -=Empty)
+        line2 = f"{self.track_label}: " + "".join(track_state(loop) for loop in loops)
+        draw.text((0, 16), line2, font=font, fill=255)
+
+        # Line 3: waveform overview of the selected track, or position blocks (4 blocks showing quarters)
+        if loops[0].initialized and LENGTH > 0 and self.draw_waveform(draw, loops[selected], 32, 12):
+            line3 = ""
+        elif loops[0].initialized and LENGTH > 0:
+            # Calculate which quarter we're in (0-3)
+            quarter = min(3, int((loops[0].readp / LENGTH) * 4))
+            # Use block character (█) for current quarter
+            blocks = ""
+            for i in range(4):
+                blocks += "█" if i <= quarter else "▯"
+            line3 = f"Position: {blocks}"
+        else:
+            active_tracks = sum(1 for loop in loops if loop.initialized)
+            recording_tracks = sum(1 for loop in loops if loop.is_recording)
+            line3 = f"Act:{active_tracks} Rec:{recording_tracks} Wait:{waiting_tracks}"
+        if line3:
+            draw.text((0, 32), line3, font=font, fill=255)
+
+        # Level bars in the gaps between lines: input, tracks, master
+        self.draw_meters(draw)
+
+        # Line 4: Menu or countdown/position
+        if waiting_tracks > 0 and loops[0].initialized:
+            # Show countdown when tracks are waiting
+            line4 = f"Start in {(LENGTH - loops[0].readp) * self.row_seconds:.4f}s"
+        else:
+            line4 = menu
+        draw.text((0, 48), line4, font=font, fill=255)
+
+    def lcd_rows(self, menu, cols):
+        '''
+        lcd_rows() returns the four rows of the LCD screen, cols characters wide: loop time, track states and meters,
+        the position (or the countdown to the restart waiting tracks wait for) and menu
+        '''
+        engine = self.engine
+        loops = engine.loops
+        LENGTH = engine.length
+        waiting_tracks = sum(1 for loop in loops if loop.is_waiting)
+
+        # Row 1: Loop time (no percentage)
+        if LENGTH > 0:
+            if loops[0].initialized:
+                row1 = f"Loop:{LENGTH * self.row_seconds:.4f}s"
+            else:
+                row1 = f"Recording {LENGTH * self.row_seconds:.4f}s"
+        else:
+            row1 = "Ready to Loop"
+
+        # Row 2: Track status with detailed info
+        row2 = "Trk:" + "".join(track_state(loop) for loop in loops)
+        # Level bars for each track, then input and master, if they fit
+        meters_str = self.lcd_meters()
+        if len(row2) + 1 + len(meters_str) <= cols:
+            row2 += " " + meters_str
+
+        # Row 3: Position blocks or countdown
+        if waiting_tracks > 0 and loops[0].initialized:
+            row3 = f"Next loop:{(LENGTH - loops[0].readp) * self.row_seconds:6.4f}s"
+        elif loops[0].initialized and LENGTH > 0:
+            # Calculate which quarter we're in (0-3)
+            quarter = min(3, int((loops[0].readp / LENGTH) * 4))
+            # Use block character for current quarter
+            blocks = ""
+            for i in range(4):
+                blocks += chr(0xFF) if i <= quarter else chr(0xA1)  # Full block vs light block
+            row3 = f"Pos: {blocks}"
+        else:
+            row3 = "No loop playing"
+
+        # Row 4: Menu with highlighting
+        return [row1, row2, row3, menu]
@@ -0,0 +1,154 @@
+'''
+stretch.py contains the time-stretch / pitch-shift engine used to retime loops.
+
+The stretch is a phase vocoder reading the loop as a circular signal. Every output frame k
+(hop HOP) is built from two analysis frames HOP apart at input position k * HOP / ratio: the
+magnitude of the first and a phase that accumulates the measured phase advance between the two.
+The accumulated phase can't close the circle at an arbitrary new length, so the output runs one
+frame past the end and that continuation is crossfaded into the start: the loop point becomes
+a short crossfade instead of a phase jump. Frames are processed BLOCK_FRAMES at a time with
+vectorized FFTs and a cumulative sum for the phase, so no step holds the interpreter for long.
+A pitch shift is a stretch by the pitch ratio followed by resampling back to the original length.
+
+Stretcher runs the jobs on a worker thread: it snapshots the track, writes the result into
+the engine's spare slots and asks the callback to swap them in at the track's next loop
+boundary (engine.request_swap), so the audio callback never waits on it. File import
+(importer.py) uses the same spare slots, so each job holds them with engine.acquire_spare().
+'''
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+from engine import DIRTY_ALL
+
+FRAME = 2048 #FFT size
+HOP = FRAME // 4 #synthesis hop
+BLOCK_FRAMES = 64 #frames per vectorized block
+WINDOW = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(FRAME) / FRAME)).astype(np.float32) #periodic hann
+OLA_GAIN = np.float32(1.5) #sum of the squared window at HOP = FRAME / 4
+
+def resample(x, length):
+    '''
+    resample() linearly resamples the circular signal x to length samples
+    '''
+    out = np.empty([length], dtype = np.float32)
+    step = len(x) / length
+    for start in range(0, length, 65536):
+        t = np.arange(start, min(length, start + 65536)) * step
+        i = t.astype(np.int64)
+        frac = (t - i).astype(np.float32)
+        out[start:start + len(t)] = x[i % len(x)] * (1 - frac) + x[(i + 1) % len(x)] * frac
+    return out
+
+def time_stretch(x, length, pitch_ratio = 1.0, progress = None):
+    '''
+    time_stretch() stretches the circular float32 signal x to length samples, pitch shifted by pitch_ratio
+
+    progress, if given, is called with the fraction done after every block
+    '''
+    n = len(x)
+    overlap = FRAME // HOP
+    #stretch to the pitch-scaled length (a whole number of hops), then resample to length
+    frames = max(overlap, int(round(length * pitch_ratio / HOP)))
+    ratio = frames * HOP / n
+    #frames first to last cover output samples 0 to frames * HOP + FRAME completely;
+    #out row r holds samples (r - (overlap - 1)) * HOP onwards
+    first_frame = 1 - overlap
+    last_frame = frames + overlap - 1
+    out = np.zeros([frames + 3 * overlap - 2, HOP], dtype = np.float32)
+    offsets = np.arange(FRAME)
+    phase = None #output phase of the previous frame
+    advance = None #phase advance measured at the previous frame
+
+    for start in range(first_frame, last_frame + 1, BLOCK_FRAMES):
+        k = np.arange(start, min(last_frame + 1, start + BLOCK_FRAMES))
+        position = np.round(k * HOP / ratio).astype(np.int64)
+        first = np.fft.rfft(x[(position[:, None] + offsets) % n] * WINDOW, axis = 1)
+        second = np.fft.rfft(x[(position[:, None] + HOP + offsets) % n] * WINDOW, axis = 1)
+        measured = np.angle(second) - np.angle(first)
+
+        #phase[k] = phase[k - 1] + advance[k - 1], as a cumulative sum within the block
+        steps = np.empty(first.shape, dtype = np.float64)
+        if phase is None:
+            steps[0] = np.angle(first[0])
+        else:
+            steps[0] = phase + advance
+        steps[1:] = measured[:-1]
+        block_phase = np.cumsum(steps, axis = 0)
+        phase = np.mod(block_phase[-1], 2 * np.pi)
+        advance = measured[-1]
+
+        frame_audio = np.fft.irfft(np.abs(first) * np.exp(1j * block_phase), n = FRAME, axis = 1).astype(np.float32)
+        frame_audio *= WINDOW / OLA_GAIN
+        #overlap-add: each frame covers overlap hops
+        frame_audio = frame_audio.reshape(len(k), overlap, HOP)
+        for j in range(overlap):
+            out[k - first_frame + j] += frame_audio[:, j]
+        if progress:
+            progress((k[-1] - first_frame + 1) / (last_frame - first_frame + 1))
+
+    out = out.reshape(-1)
+    head = (overlap - 1) * HOP
+    stretched = out[head:head + frames * HOP]
+    #crossfade the continuation past the end into the start
+    fade = np.linspace(0, 1, FRAME, endpoint = False, dtype = np.float32)
+    tail = out[head + frames * HOP:head + frames * HOP + FRAME]
+    stretched[:FRAME] = stretched[:FRAME] * fade + tail * (1 - fade)
+    if len(stretched) == length:
+        return stretched
+    return resample(stretched, length)
+
+class Stretcher:
+    def __init__(self, engine):
+        self.engine = engine
+        self.jobs = queue.Queue()
+        self.busy = None #(track index, description) of the running job
+        self.progress = 0.0
+        self.thread = threading.Thread(target = self.run, name = 'stretch', daemon = True)
+        self.thread.start()
+
+    def fit(self, loop):
+        '''
+        fit() retimes the track's recorded audio to its current length (after TRIM or quantization)
+        '''
+        self.jobs.put((loop, loop.length_factor * self.engine.length, 0))
+
+    def pitch(self, loop, semitones):
+        '''
+        pitch() shifts the track by semitones, keeping its length
+        '''
+        self.jobs.put((loop, loop.length, semitones))
+
+    def run(self):
+        while True:
+            loop, rows, semitones = self.jobs.get()
+            try:
+                with self.engine.acquire_spare() as (main_slot, dub_slot):
+                    self.process(loop, rows, semitones, main_slot, dub_slot)
+            except Exception as e:
+                print(f'Stretch error: {e}')
+            self.busy = None
+
+    def process(self, loop, rows, semitones, main_slot, dub_slot):
+        engine = self.engine
+        if not loop.initialized or rows <= 0 or rows > engine.maxlength:
+            return
+        source_rows = min(loop.content_length, engine.maxlength)
+        if source_rows == rows and semitones == 0:
+            return
+        self.busy = (loop.index, f'{semitones:+d}st' if semitones else 'fit')
+        self.progress = 0.0
+        start = time.perf_counter()
+        ratio = 2 ** (semitones / 12)
+        for layer, slot in enumerate((main_slot, dub_slot)):
+            #snapshot the layer, the callback may keep overdubbing while we work (read_rows: it may be cold)
+            x = engine.read_rows(engine.track_base[layer * engine.tracks + loop.index] + np.arange(source_rows)).reshape(-1).astype(np.float32)
+            y = time_stretch(x, rows * engine.chunk, ratio, lambda done: setattr(self, 'progress', (layer + done) / 2))
+            np.clip(y, -32768, 32767, out = y)
+            engine.arena.slots[slot, :rows] = y.reshape(rows, engine.chunk)
+            engine.dirty[slot, :rows] = DIRTY_ALL
+        engine.request_swap(loop, main_slot, dub_slot, rows)
+        print(f'Track {loop.index + 1}: {source_rows} -> {rows} rows, {semitones:+d} semitones in {time.perf_counter() - start:.1f}s')
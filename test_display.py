@@ -133,8 +133,7 @@ def update_display_status():
                 line4 = f"Pos: {loop_position:.1f}s"
                 draw.text((0, 48), line4, font=font, fill=255)
             
-            display.image(image)
-            display.show()
+            display.display(image)
             
         elif display_type == 'LCD':
             # LCD: 16x2, must be concise
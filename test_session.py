@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+End-to-end test of main.py without the hardware: gpiozero's mock pins stand in for the buttons,
+LEDs and rotary encoder, and a simulated duplex audio device (installed as the pyaudio module)
+calls the audio callback in real time. A script of presses, holds and encoder turns runs a short
+session and measures, for each GPIO edge, how many samples pass before its effect:
+
+- record: pressing REC 1 for the first loop, to the first input sample in the loop (negative
+  when part of the buffer arriving at the press is recorded)
+- mute, unmute: PLAY 1, to the first output sample that is faded / no longer silent
+- undo: holding REC 1 after an overdub, to the output dropping the overdub (includes hold_time)
+- volume: turning the encoder in the VOL menu (includes the UI loop's encoder polling)
+
+Each case is a session with its own settings (all of them, each in its own process, by default):
+- session: the measurements above
+- limiter: the same with the master limiter on, plus an overdub of the looper's own output (a
+  player perfectly in time with what they hear) that has to land exactly on the loop it echoes
+- capture: the first loop captured by holding REC 1 instead (the last second played, ending at
+  the press); capture: press to the end of the captured input
+- capture-short: holding REC 1 before enough has been played to capture: the looper has to fall
+  back to recording from the release (record: release to the first input sample in the loop)
+- longloop: the session with the loop memory mapped from a file (longloop), checking that a
+  muted track is still paged in ahead of the callback, which reads it at gain 0
+
+The input is a ramp (every sample one higher than the last, wrapping), so the loop content tells
+which input sample was recorded first and any gain change breaks the ramp in the output. The
+simulated device hands each input buffer to the callback once its last sample is in and plays
+the returned buffer straight away (one buffer of latency, nothing else), so the numbers are
+the looper's own latency, on top of what a real sound card adds.
+
+Needs gpiozero (no Raspberry Pi or PortAudio). Settings come from the schema defaults plus
+what the measurements need (no limiter, input_shift 0, latency_ms 0, ...) and the case's
+changes, not settings.json.
+
+    python3 test_session.py [--case all] [--chunk 512] [--rate 44100] [--output results.json]
+
+Exits with status 1 if a check fails or an effect takes longer than --max-latency-ms
+(hold_time and encoder polling excluded).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import numpy as np
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+RAMP_BASE = 1024 #input ramp runs from RAMP_BASE to RAMP_BASE + RAMP_PERIOD - 1
+RAMP_PERIOD = 8192
+DUB_LEVEL = 1000 #constant input recorded by the overdub
+LOOP_SECONDS = 2.0 #length of the first loop
+CAPTURE_SECONDS = 1.0 #length of the first loop in the capture case
+LOOP_FILE = os.path.join(tempfile.gettempdir(), f'test_session-{os.getpid()}.bin') #loop memory of the longloop case
+MAX_SECONDS = 120 #output captured for the analysis
+CASES = ('session', 'limiter', 'capture', 'capture-short', 'longloop')
+
+class SimulatedStream:
+    def __init__(self, device, rate, channels, frames_per_buffer, stream_callback, start = True, **kwargs):
+        self.device = device
+        self.rate = rate
+        self.channels = channels
+        self.chunk = frames_per_buffer
+        self.callback = stream_callback
+        self.period = self.chunk / rate
+        self.played = np.zeros([MAX_SECONDS * rate], dtype = np.int16) #first output channel, by stream position
+        self.callbacks = 0
+        self.late = 0 #callbacks that started more than a buffer late
+        self.error = None
+        self.active = False
+        self.t0 = None
+        if start:
+            self.start_stream()
+
+    def start_stream(self):
+        self.active = True
+        self.t0 = time.monotonic()
+        threading.Thread(target = self.run, name = 'simulated-audio', daemon = True).start()
+
+    def stop_stream(self):
+        self.active = False
+
+    def close(self):
+        self.active = False
+
+    def is_active(self):
+        return self.active
+
+    def position(self):
+        '''
+        position() returns the current stream position in samples
+        '''
+        return int((time.monotonic() - self.t0) * self.rate)
+
+    def run(self):
+        k = 0
+        while self.active and (k + 2) * self.chunk <= self.played.size:
+            #input buffer k is complete at the end of its period, its output starts playing then
+            due = self.t0 + (k + 1) * self.period
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self.period:
+                self.late += 1
+            samples = self.device.input(k * self.chunk, self.chunk)
+            in_data = np.repeat(samples, self.channels).tobytes()
+            time_info = {'input_buffer_adc_time': self.t0 + k * self.period, 'current_time': time.monotonic(),
+                         'output_buffer_dac_time': due}
+            try:
+                out, flag = self.callback(in_data, self.chunk, time_info, 0)
+            except Exception as e:
+                self.error = repr(e)
+                self.active = False
+                raise
+            start = (k + 1) * self.chunk
+            self.played[start:start + self.chunk] = np.frombuffer(out, dtype = np.int16)[::self.channels]
+            self.callbacks += 1
+            k += 1
+            if flag != 0:
+                self.active = False
+
+class SimulatedDevice:
+    def __init__(self):
+        self.signal = 'ramp' #'ramp', 'dub', 'echo' (the output played at the same time) or 'silence'
+        self.stream = None
+        self.terminated = False
+
+    def input(self, start, count):
+        '''
+        input() returns count input samples from stream position start
+        '''
+        if self.signal == 'ramp':
+            return (RAMP_BASE + np.arange(start, start + count) % RAMP_PERIOD).astype(np.int16)
+        elif self.signal == 'dub':
+            return np.full([count], DUB_LEVEL, dtype = np.int16)
+        elif self.signal == 'echo':
+            return self.stream.played[start:start + count].copy()
+        return np.zeros([count], dtype = np.int16)
+
+    def open(self, **kwargs):
+        self.stream = SimulatedStream(self, **kwargs)
+        return self.stream
+
+    def terminate(self):
+        if self.stream:
+            self.stream.close()
+        self.terminated = True
+
+    def module(self):
+        '''
+        module() returns a stand-in for the pyaudio module whose PyAudio() is this device
+        '''
+        module = types.ModuleType('pyaudio')
+        module.paInt16 = 8
+        module.paContinue = 0
+        module.paComplete = 1
+        module.paAbort = 2
+        module.PyAudio = lambda: self
+        return module
+
+def session_config(rate, chunk, case = 'session'):
+    import config
+    settings = {
+        'audio': {'rate': rate, 'chunk': chunk, 'latency_ms': 0, 'input_shift': 0, 'max_samples': 30 * rate,
+                  'input_device': 0, 'output_device': 0},
+        'overdub': {'feedback': 1.0}, #keeps the recorded ramp intact under the overdub
+        'stretch': {'enabled': False},
+        'limiter': {'enabled': False},
+        'autosave': {'enabled': False},
+        'controls': {'hold_time': 0.5},
+    }
+    if case == 'limiter':
+        settings['limiter'] = {'enabled': True}
+        #the simulated device plays a buffer after it was recorded: one buffer of latency to correct
+        settings['audio']['latency_ms'] = round(1000 * chunk / rate)
+    elif case == 'capture':
+        settings['capture'] = {'enabled': True, 'first_seconds': CAPTURE_SECONDS}
+    elif case == 'capture-short':
+        settings['capture'] = {'enabled': True, 'first_seconds': 20.0} #more than is played before the hold
+    elif case == 'longloop':
+        settings['longloop'] = {'enabled': True, 'path': LOOP_FILE}
+    return config.validate(settings)
+
+def ramp_break(played, start, stop):
+    '''
+    ramp_break() returns the first position in [start, stop) where the output stops following the ramp
+    '''
+    diffs = np.diff(played[start - 1:stop].astype(np.int32))
+    broken = np.flatnonzero((diffs != 1) & (diffs != 1 - RAMP_PERIOD))
+    return start + int(broken[0]) if broken.size else None
+
+def sound_start(played, start, stop):
+    '''
+    sound_start() returns the first position in [start, stop) where the output isn't silent
+    '''
+    sound = np.flatnonzero(played[start:stop])
+    return start + int(sound[0]) if sound.size else None
+
+class Session:
+    def __init__(self, namespace, device, config, case = 'session'):
+        from gpiozero import Device
+        self.case = case
+        self.namespace = namespace
+        self.device = device
+        self.config = config
+        self.rate = config['audio']['rate']
+        self.chunk = config['audio']['chunk']
+        self.pin = Device.pin_factory.pin
+        self.gpio = config['gpio']
+        self.gap = 2 * config['controls']['debounce'] + 0.02 #between button edges
+        self.encoder_gap = 2 * config['controls']['encoder_bounce'] + 0.003 #between encoder edges
+        self.edges = [] #(event, edge position, detect, window in samples, latency allowance in samples)
+        self.failures = []
+
+    def __getattr__(self, name):
+        #the looper's globals (engine, loops, ...), as main.py defines them
+        try:
+            return self.namespace[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def wait_for(self, predicate, what, timeout = 10.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'timed out waiting for {what}')
+            time.sleep(0.002)
+
+    def wait_for_position(self, lo, hi):
+        '''
+        wait_for_position() waits until the master loop is between fractions lo and hi of its length
+        '''
+        self.wait_for(lambda: lo <= self.loops[0].readp / self.engine.length < hi, f'loop position {lo}-{hi}',
+                      timeout = 2 * LOOP_SECONDS + 1)
+
+    def press(self, pin, hold = 0.05):
+        '''
+        press() presses and releases the button on pin, returns the stream position of the press
+        (the release's is left in self.released)
+        '''
+        edge = self.device.stream.position() #mock pins run the handlers inside drive_low()
+        self.pin(pin).drive_low()
+        time.sleep(hold)
+        self.released = self.device.stream.position()
+        self.pin(pin).drive_high()
+        time.sleep(self.gap)
+        return edge
+
+    def turn(self, steps):
+        '''
+        turn() turns the encoder by steps detents (positive = clockwise), returns the stream position of the edge
+        completing the first detent
+        '''
+        first, second = (self.gpio['encoder_clk'], self.gpio['encoder_dt'])[::1 if steps > 0 else -1]
+        edge = None
+        for _ in range(abs(steps)):
+            for pin, low in ((first, True), (second, True), (first, False), (second, False)):
+                if low:
+                    self.pin(pin).drive_low()
+                else:
+                    if edge is None and pin == second:
+                        edge = self.device.stream.position()
+                    self.pin(pin).drive_high()
+                time.sleep(self.encoder_gap)
+        time.sleep(self.gap)
+        return edge
+
+    def echo_overdub(self, hold):
+        '''
+        echo_overdub() overdubs track 1 with what it plays, as heard through the limiter look-ahead, and checks
+        that every overdubbed row equals the row it echoes; then undoes the overdub
+        '''
+        rec1 = self.gpio['rec_buttons'][0]
+        self.device.signal = 'echo'
+        self.press(rec1)
+        self.wait_for(lambda: self.loops[0].is_recording, 'the echo overdub', timeout = 2 * LOOP_SECONDS + 1)
+        self.wait_for_position(0.6, 0.9)
+        self.press(rec1)
+        self.device.signal = 'silence'
+        length = self.engine.length
+        main, dub = self.loops[0].main_audio[:length], self.loops[0].dub_audio[:length]
+        rows = np.flatnonzero(dub.any(axis = 1))[1:-1] #the rows in the middle of the overdub
+        #both hold the input ramp, so the difference of their first samples is how late the overdub landed
+        late = (int(main[rows[0], 0]) - int(dub[rows[0], 0])) % RAMP_PERIOD if rows.size else None
+        self.check(rows.size > 0 and np.array_equal(dub[rows], main[rows]),
+                   f'an overdub of the output lines up with it ({late} samples late)')
+        self.wait_for_position(0.05, 0.2)
+        self.press(rec1, hold = hold + 0.2)
+
+    def check(self, ok, what):
+        print(('ok   ' if ok else 'FAIL ') + what)
+        if not ok:
+            self.failures.append(what)
+
+    def run(self, max_latency):
+        seconds = lambda s: int(s * self.rate)
+        hold = self.config['controls']['hold_time']
+        poll = self.config['controls']['poll_interval']
+        rec1, play1 = self.gpio['rec_buttons'][0], self.gpio['play_buttons'][0]
+
+        #main.py lights every LED once the stream runs, then waits for REC 1
+        self.wait_for(lambda: 'RECLEDS' in self.namespace and all(led.is_lit for led in self.RECLEDS + self.PLAYLEDS),
+                      'the looper to start', timeout = 30)
+        time.sleep(0.5)
+        self.device.signal = 'ramp'
+        loop_seconds = LOOP_SECONDS
+        if self.case == 'capture':
+            #held: the last CAPTURE_SECONDS played before the press become the loop, nothing more is recorded
+            loop_seconds = CAPTURE_SECONDS
+            edge = self.press(rec1, hold = hold + 0.3)
+            self.wait_for(lambda: self.loops[0].initialized, 'the captured master loop')
+        else:
+            if self.case == 'capture-short':
+                #held too early to capture: recording starts at the release
+                self.press(rec1, hold = hold + 0.3)
+                edge = self.released
+            else:
+                edge = self.press(rec1)
+            self.wait_for(lambda: self.engine.setup_is_recording, 'the first recording')
+            time.sleep(LOOP_SECONDS - 0.05 - self.gap)
+            self.press(rec1)
+            self.wait_for(lambda: self.loops[0].initialized, 'the master loop')
+        #the loop holds the input ramp from its first recorded sample on; a capture's input ends (span later) near the press
+        span = self.engine.length * self.chunk if self.case == 'capture' else 0
+        first = int(self.loops[0].main_audio[0, 0]) - RAMP_BASE
+        recorded = edge - span + (first - edge + span) % RAMP_PERIOD
+        if recorded - (edge - span) > RAMP_PERIOD // 2:
+            recorded -= RAMP_PERIOD
+        self.record_start = ('capture' if span else 'record', edge, recorded + span)
+        if span:
+            rows = self.loops[0].main_audio[1:self.engine.length - 1].ravel().astype(np.int32)
+            self.check(np.all(np.diff(rows) % RAMP_PERIOD == 1), 'the captured loop holds the input as played')
+            self.check(abs(recorded + span - edge) <= 2 * self.chunk, 'the capture ends at the press, not at the release')
+        self.check(abs(self.engine.length * self.chunk / self.rate - loop_seconds) < 0.1,
+                   f'first loop is {self.engine.length} buffers')
+        self.device.signal = 'silence'
+        self.wait_for(lambda: self.namespace.get('jam_session_active'), 'the jam session', timeout = 10)
+        time.sleep(0.2)
+
+        self.wait_for_position(0.1, 0.4)
+        self.edges.append(('mute', self.press(play1), ramp_break, seconds(0.3), 0))
+        time.sleep(0.3)
+        self.check(not self.loops[0].is_playing, 'PLAY 1 mutes track 1')
+        if self.case == 'longloop':
+            #track 1 is the only track: whatever is paged in now is its read window
+            store = self.engine.diskstore
+            touched = store.touched_bytes
+            time.sleep(3 * store.interval)
+            self.check(store.touched_bytes > touched, 'a muted track is paged in ahead of the callback')
+        self.wait_for_position(0.1, 0.4)
+        self.edges.append(('unmute', self.press(play1), sound_start, seconds(0.3), 0))
+        time.sleep(0.3)
+        self.check(self.loops[0].is_playing, 'PLAY 1 unmutes track 1')
+
+        #overdub the first 60% of a pass, then undo it by holding REC 1
+        self.device.signal = 'dub'
+        self.press(rec1)
+        self.wait_for(lambda: self.loops[0].is_recording, 'the overdub', timeout = 2 * LOOP_SECONDS + 1)
+        self.wait_for_position(0.6, 0.9)
+        self.press(rec1)
+        self.device.signal = 'silence'
+        self.check(not self.loops[0].is_recording and bool(self.loops[0].dub_audio[:self.engine.length].any()),
+                   'REC 1 overdubs track 1')
+        self.wait_for_position(0.05, 0.2)
+        self.edges.append(('undo', self.press(rec1, hold = hold + 0.2), ramp_break, seconds(hold + 0.3), seconds(hold)))
+        self.check(not self.loops[0].dub_audio[:self.engine.length].any() and not self.loops[0].is_waiting,
+                   'holding REC 1 undoes the overdub')
+        if self.case == 'limiter':
+            self.echo_overdub(hold)
+
+        #VOL is the first menu item
+        self.wait_for_position(0.1, 0.4)
+        self.edges.append(('volume', self.turn(5), ramp_break, seconds(poll + 0.2), seconds(poll)))
+        time.sleep(poll + 0.1)
+        self.check(abs(float(self.engine.output_volume) - 1.05) < 0.005, f'encoder sets volume {float(self.engine.output_volume):.3f}')
+        self.turn(-5)
+
+        #holding the last PLAY button ends the session
+        self.wait_for(lambda: self.PLAYBUTTONS[-1].when_held is not None, 'the exit handler')
+        self.press(self.gpio['play_buttons'][-1], hold = hold + 0.3)
+        self.wait_for(lambda: self.device.terminated, 'the looper to stop the audio device')
+
+        #measure on the captured output
+        stream = self.device.stream
+        results = [self.result(*self.record_start, 0, max_latency)]
+        for event, edge, detect, window, allowance in self.edges:
+            effect = detect(stream.played, edge, edge + window)
+            self.check(effect is not None, f'{event} shows up in the output')
+            results.append(self.result(event, edge, effect, allowance, max_latency))
+        self.check(stream.error is None, f'audio callback errors: {stream.error or "none"}')
+        return results
+
+    def result(self, event, edge, effect, allowance, max_latency):
+        entry = {'event': event, 'edge': edge, 'effect': effect}
+        if effect is not None:
+            samples = effect - edge
+            entry.update(samples = samples, ms = round(1e3 * samples / self.rate, 2), buffers = round(samples / self.chunk, 2))
+            self.check(samples - allowance <= max_latency * self.rate / 1000,
+                       f'{event}: {samples} samples ({entry["ms"]} ms) within {max_latency} ms'
+                       + (f' + {1e3 * allowance / self.rate:.0f} ms' if allowance else ''))
+        return entry
+
+def run_main(namespace):
+    try:
+        with open(MAIN, 'r') as f:
+            exec(compile(f.read(), MAIN, 'exec'), namespace)
+    except BaseException as e:
+        namespace['__error__'] = repr(e)
+        raise
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Hardware-free end-to-end session with latency measurements')
+    parser.add_argument('--case', choices = ('all',) + CASES, default = 'all')
+    parser.add_argument('--rate', type = int, default = 44100)
+    parser.add_argument('--chunk', type = int, default = 512)
+    parser.add_argument('--max-latency-ms', type = float, default = 50.0)
+    parser.add_argument('--output', help = 'write results to this JSON file')
+    args = parser.parse_args()
+    if args.case == 'all':
+        #every case in its own process: main.py runs once per interpreter
+        failed = []
+        for case in CASES:
+            print(f'=== {case}')
+            command = [sys.executable, __file__, '--case', case, '--rate', str(args.rate), '--chunk', str(args.chunk),
+                       '--max-latency-ms', str(args.max_latency_ms)]
+            if args.output:
+                root, ext = os.path.splitext(args.output)
+                command += ['--output', f'{root}-{case}{ext}']
+            if subprocess.run(command).returncode != 0:
+                failed.append(case)
+        if failed:
+            sys.exit(f'cases failed: {", ".join(failed)}')
+        return
+
+    try:
+        from gpiozero import Device
+        from gpiozero.pins.mock import MockFactory
+    except ImportError:
+        sys.exit('gpiozero is needed for the mock pins: pip install gpiozero')
+    Device.pin_factory = MockFactory()
+    device = SimulatedDevice()
+    sys.modules['pyaudio'] = device.module()
+    import config
+    config._config = session_config(args.rate, args.chunk, args.case) #main.py's get_config() returns this
+
+    namespace = {'__name__': '__main__', '__file__': MAIN}
+    looper = threading.Thread(target = run_main, args = (namespace,), name = 'looper', daemon = True)
+    looper.start()
+    session = Session(namespace, device, config._config, args.case)
+    try:
+        events = session.run(args.max_latency_ms)
+    except TimeoutError as e:
+        sys.exit(f'FAIL {e} ({namespace.get("__error__", "no error in main.py")})')
+    looper.join(timeout = 5)
+    session.check(not looper.is_alive(), 'the looper exits')
+    if os.path.exists(LOOP_FILE):
+        os.remove(LOOP_FILE)
+
+    stream = device.stream
+    print(f'\n{"event":<8} {"samples":>8} {"ms":>8} {"buffers":>8}')
+    for entry in events:
+        if entry['effect'] is not None:
+            print(f"{entry['event']:<8} {entry['samples']:>8} {entry['ms']:>8.2f} {entry['buffers']:>8.2f}")
+    print(f'{stream.callbacks} callbacks, {stream.late} late, {session.engine.callback_overruns} overruns, '
+          f'peak {1e6 * session.engine.callback_peak_seconds:.0f} us of {1e6 * session.engine.deadline:.0f} us')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'case': args.case, 'rate': args.rate, 'chunk': args.chunk,
+                         'hold_time': session.config['controls']['hold_time'],
+                         'poll_interval': session.config['controls']['poll_interval']},
+                'events': events,
+                'callbacks': stream.callbacks,
+                'late': stream.late,
+                'overruns': session.engine.callback_overruns,
+                'failures': session.failures,
+            }, f, indent = 1)
+        print(f'Results written to {args.output}')
+    if session.failures:
+        print(f'{len(session.failures)} checks failed')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+waveform.py contains the min/max mipmap pyramid behind the OLED waveform overview.
+
+Level 0 holds the minimum and maximum sample of every row of every arena slot; each level
+above halves the resolution (entry i of level l covers rows i * 2**l to (i + 1) * 2**l).
+update() only recomputes the rows flagged DIRTY_WAVEFORM by add_buffer, dub, clear, undo and the
+time-stretch swap, then walks those entries up the pyramid, so keeping it current costs a
+few rows per display refresh.
+
+columns() picks the level whose entries are just shorter than one screen column and reduces
+at most a few entries per column, so drawing the overview reads the same amount of data
+whatever the loop length, instead of scanning the loop audio.
+
+All levels share one int16 block, which can be supplied by the caller: with the engine in its
+own process (audioprocess.py) the block is shared memory, updated there and drawn by the UI.
+'''
+
+import threading
+
+import numpy as np
+
+from engine import DIRTY_WAVEFORM, dirty_plane
+
+def level_sizes(maxlength):
+    '''
+    level_sizes() returns the number of entries per slot of every pyramid level, finest first
+    '''
+    sizes = [maxlength]
+    while sizes[-1] > 1:
+        sizes.append((sizes[-1] + 1) // 2)
+    return sizes
+
+def mipmap_nbytes(slots, maxlength):
+    '''
+    mipmap_nbytes() returns the size of the block holding the pyramid of slots slots
+    '''
+    return 2 * slots * sum(level_sizes(maxlength)) * 2
+
+class WaveformMipmap:
+    def __init__(self, engine, buffer = None):
+        self.engine = engine
+        slots, maxlength = engine.slot_count, engine.maxlength
+        sizes = level_sizes(maxlength)
+        if buffer is None:
+            storage = np.zeros([2, slots, sum(sizes)], dtype = np.int16)
+        else:
+            storage = np.frombuffer(buffer, dtype = np.int16, count = 2 * slots * sum(sizes)).reshape(2, slots, sum(sizes))
+        self.lo = [] #per level: int16 [slot, entry] minimum
+        self.hi = [] #per level: int16 [slot, entry] maximum
+        start = 0
+        for size in sizes:
+            self.lo.append(storage[0, :, start:start + size])
+            self.hi.append(storage[1, :, start:start + size])
+            start += size
+        self.lock = threading.Lock() #update() may run on the UI thread and in button callbacks
+
+    def update(self, max_rows = 4096):
+        '''
+        update() brings the pyramid up to date with the rows written since the last call
+
+        at most max_rows rows are read per call, the rest are picked up by the next call
+        '''
+        engine = self.engine
+        with self.lock:
+            dirty = dirty_plane(engine.dirty_rows, DIRTY_WAVEFORM)
+            rows = np.flatnonzero(dirty)[:max_rows]
+            if len(rows) == 0:
+                return 0
+            dirty[rows] = 0
+            maxlength = engine.maxlength
+            slots, rows_in_slot = np.divmod(rows, maxlength)
+            audio = engine.read_rows(rows)
+            self.lo[0][slots, rows_in_slot] = audio.min(axis = 1)
+            self.hi[0][slots, rows_in_slot] = audio.max(axis = 1)
+            #walk the changed entries up the pyramid
+            entries = rows
+            for level in range(1, len(self.lo)):
+                size = self.lo[level].shape[1]
+                child_size = self.lo[level - 1].shape[1]
+                slots, child = np.divmod(entries, child_size)
+                entries = np.unique(slots * size + child // 2)
+                slots, entry = np.divmod(entries, size)
+                left = 2 * entry
+                right = np.minimum(left + 1, child_size - 1)
+                self.lo[level][slots, entry] = np.minimum(self.lo[level - 1][slots, left], self.lo[level - 1][slots, right])
+                self.hi[level][slots, entry] = np.maximum(self.hi[level - 1][slots, left], self.hi[level - 1][slots, right])
+            return len(rows)
+
+    def columns(self, loop, width):
+        '''
+        columns() returns the (min, max) envelope of the track as two float32 arrays of width columns,
+        scaled to -1..1 (main and dub layers summed), or None if the track is empty
+        '''
+        length = loop.length #while the first pass is recorded this is the length so far
+        if length <= 0:
+            return None
+        #coarsest level whose entries still fit inside one column
+        level = 0
+        while level + 1 < len(self.lo) and 2 ** (level + 1) <= length / width:
+            level += 1
+        scale = 2 ** level
+        #entries overlapping each column; reduceat reduces starts[i]:starts[i + 1]
+        starts = (np.arange(width) * length // width) // scale
+        first = starts[0]
+        last = max(starts[-1] + 1, (length + scale - 1) // scale)
+        engine = self.engine
+        lo = np.zeros([width], dtype = np.int32)
+        hi = np.zeros([width], dtype = np.int32)
+        for layer in (0, 1):
+            slot = engine.slot_of[layer, loop.index]
+            lo += np.minimum.reduceat(self.lo[level][slot, first:last], starts - first)
+            hi += np.maximum.reduceat(self.hi[level][slot, first:last], starts - first)
+        return lo.astype(np.float32) / 2**15, hi.astype(np.float32) / 2**15